@@ -0,0 +1,69 @@
+import numpy as np
+import pandas as pd
+from carbon_intensity import carbon_intensity
+from time_index import HOUR_COL, add_hour_key, hour_starts
+
+
+def weighted_mean_by_group(df, group_col, value_cols, weight_col):
+    # Weighted mean of each value column per group in a single grouped pass:
+    # sum(value * weight) / sum(weight), where rows with a NaN value or NaN
+    # weight drop out of both sums for that column. Groups whose remaining
+    # weights sum to zero come back as NaN instead of raising.
+    values = df[value_cols].to_numpy(dtype="float64")
+    weights = df[weight_col].to_numpy(dtype="float64")[:, None]
+
+    valid = ~np.isnan(values) & ~np.isnan(weights)
+    masked_weights = np.where(valid, weights, 0.0)
+    weighted_values = np.where(valid, values, 0.0) * masked_weights
+
+    keys = df[group_col]
+    numerator = pd.DataFrame(weighted_values, columns=value_cols, index=df.index).groupby(keys).sum()
+    denominator = pd.DataFrame(masked_weights, columns=value_cols, index=df.index).groupby(keys).sum()
+    return numerator / denominator.where(denominator != 0)
+
+
+# Columns to aggregate (weighted average by regional_percentage)
+WEATHER_AQI_COLS = [
+    "temperature_2m__celsius",
+    "dew_point_2m__celsius",
+    "rain__millimetre",
+    "snowfall__centimetre",
+    "cloud_cover__percentage",
+    "wind_speed_10m__kilometres_per_hour",
+    "pm2_5__micrograms_per_cubic_metre"
+]
+
+
+def aggregate_iso(df, group_col="datetime_utc"):
+    # Only keep rows with non-null regional_percentage
+    df = df[df["regional_percentage"].notnull()]
+    # Weighted averages for all weather/AQI columns in one grouped pass
+    df_weighted = weighted_mean_by_group(df, group_col, WEATHER_AQI_COLS, "regional_percentage")
+    # Zone loads are counted once per zone even when several cities share it
+    df_zone = df.drop_duplicates([group_col, "zone"])
+    df_sums = df_zone.groupby(group_col)[["load", "load_forecast"]].sum()
+    # regional_percentage sum is for reference, should be 1.0
+    df_sums["regional_percentage"] = df.groupby(group_col)["regional_percentage"].sum()
+    return df_weighted.join(df_sums).reset_index()
+
+
+def build_iso_level(df_merged, df_fuel, fuel_cols):
+    # ISO-level hourly frame: aggregated weather/AQI and load, joined with
+    # the fuel mix and its carbon intensity. Hours are independent, so this
+    # can run on any time slice of the merged data.
+    df_agg = aggregate_iso(df_merged)
+
+    # Add load_to_forecast_diff
+    df_agg["load_to_forecast_diff"] = df_agg["load"] - df_agg["load_forecast"]
+
+    # Join with fuel mix data on the integer hour key, one on-the-hour
+    # reading per hour of sub-hourly fuel mixes
+    df_agg = pd.merge(
+        add_hour_key(df_agg, "datetime_utc"),
+        add_hour_key(hour_starts(df_fuel, "interval_start_utc"), "interval_start_utc"),
+        on=HOUR_COL,
+        how="inner"
+    )
+
+    df_agg["carbon_intensity__gco2eq_per_kwh"] = carbon_intensity(df_agg, fuel_cols)
+    return df_agg
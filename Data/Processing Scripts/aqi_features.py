@@ -0,0 +1,201 @@
+import numpy as np
+import pandas as pd
+
+from array_store import SERIES_COLS, dense_positions, to_dense
+from instrumentation import run, span
+from iso_adapters import ISO_ADAPTERS
+from schema import apply_schema
+from storage import read_table, table_exists, write_table
+from time_index import HOUR_COL, add_hour_key, hours_to_datetime
+
+PM25_COL = "pm2_5__micrograms_per_cubic_metre"
+
+# Rolling PM2.5 means over these many hours. A window needs 75% of its
+# hours (EPA's completeness rule for 24h averages), else it is NaN.
+ROLLING_HOURS = [24, 72]
+MIN_COVERAGE = 0.75
+
+# EPA PM2.5 AQI breakpoints (2024 revision): concentration ranges in
+# ug/m3, truncated to 0.1, and the AQI range each maps to
+AQI_CATEGORIES = ["good", "moderate", "unhealthy_for_sensitive_groups", "unhealthy", "very_unhealthy", "hazardous"]
+PM25_BREAKPOINTS = np.array([
+    [0.0, 9.0, 0, 50],
+    [9.1, 35.4, 51, 100],
+    [35.5, 55.4, 101, 150],
+    [55.5, 125.4, 151, 200],
+    [125.5, 225.4, 201, 300],
+    [225.5, 325.4, 301, 500],
+])
+
+# A bad-air event is a run of consecutive hours whose 24h mean PM2.5 is at
+# least this (the start of "unhealthy for sensitive groups") lasting at
+# least EVENT_MIN_HOURS
+EVENT_THRESHOLD = 35.5
+EVENT_MIN_HOURS = 1
+
+# Weather covariates lagged by these many hours
+LAG_COLS = [
+    "temperature_2m__celsius",
+    "dew_point_2m__celsius",
+    "rain__millimetre",
+    "snowfall__centimetre",
+    "cloud_cover__percentage",
+    "wind_speed_10m__kilometres_per_hour",
+]
+LAG_HOURS = [1, 24]
+
+
+def rolling_mean(x, window, min_coverage=MIN_COVERAGE):
+    # Trailing mean over the last `window` hours (this hour included) of
+    # every row of a (series, hour) array, from running sums. NaN hours are
+    # skipped; windows with less than min_coverage of their hours are NaN.
+    valid = ~np.isnan(x)
+    sums = np.zeros((x.shape[0], x.shape[1] + 1))
+    counts = np.zeros((x.shape[0], x.shape[1] + 1))
+    np.cumsum(np.where(valid, x, 0.0), axis=1, out=sums[:, 1:])
+    np.cumsum(valid, axis=1, out=counts[:, 1:])
+    lagged = np.maximum(np.arange(1, x.shape[1] + 1) - window, 0)
+    window_sum = sums[:, 1:] - sums[:, lagged]
+    window_count = counts[:, 1:] - counts[:, lagged]
+    with np.errstate(divide="ignore", invalid="ignore"):
+        return np.where(window_count >= min_coverage * window, window_sum / window_count, np.nan)
+
+
+def lag(x, hours):
+    # x shifted `hours` later along the hour axis, NaN where nothing precedes
+    lagged = np.full(x.shape, np.nan, dtype=x.dtype)
+    lagged[:, hours:] = x[:, :-hours]
+    return lagged
+
+
+def aqi_category(pm25):
+    # Index into AQI_CATEGORIES for PM2.5 concentrations (-1 where NaN)
+    truncated = np.floor(np.asarray(pm25) * 10) / 10
+    category = np.searchsorted(PM25_BREAKPOINTS[:-1, 1], truncated, side="left")
+    return np.where(np.isnan(truncated), -1, category)
+
+
+def pm25_aqi(pm25):
+    # EPA AQI value for PM2.5 concentrations, interpolated linearly within
+    # each category; concentrations above the scale are capped at 500
+    truncated = np.floor(np.asarray(pm25) * 10) / 10
+    category = np.clip(aqi_category(pm25), 0, None)
+    c_lo, c_hi, i_lo, i_hi = (PM25_BREAKPOINTS[category, i] for i in range(4))
+    aqi = np.round((i_hi - i_lo) / (c_hi - c_lo) * (np.minimum(truncated, c_hi) - c_lo) + i_lo)
+    return np.where(np.isnan(truncated), np.nan, aqi)
+
+
+def find_runs(flags, min_hours=1):
+    # Run-length encode a (series, hour) boolean array: (row, start, end)
+    # of every run of True, end exclusive. Padding each row with False makes
+    # every run start at a +1 step and end at a -1 step; np.nonzero returns
+    # them in row-major order, so the i-th start pairs with the i-th end.
+    padded = np.zeros((flags.shape[0], flags.shape[1] + 2), dtype=np.int8)
+    padded[:, 1:-1] = flags
+    steps = np.diff(padded, axis=1)
+    rows, starts = np.nonzero(steps == 1)
+    _, ends = np.nonzero(steps == -1)
+    keep = ends - starts >= min_hours
+    return rows[keep], starts[keep], ends[keep]
+
+
+def label_runs(shape, rows, starts, ends):
+    # (series, hour) array holding each hour's run number (-1 outside
+    # runs), filled by flat index without a loop over runs
+    labels = np.full(shape, -1, dtype="int64")
+    lengths = ends - starts
+    offsets = np.arange(lengths.sum()) - np.repeat(np.cumsum(lengths) - lengths, lengths)
+    labels.ravel()[np.repeat(rows * shape[1] + starts, lengths) + offsets] = np.repeat(np.arange(len(rows)), lengths)
+    return labels
+
+
+def run_stats(x, rows, starts, ends):
+    # Max and mean of x over each run, ignoring NaN, with reduceat on the
+    # flattened array
+    n_hours = x.shape[1]
+    if not len(rows):
+        return np.empty(0), np.empty(0)
+    bounds = np.column_stack([rows * n_hours + starts, rows * n_hours + ends]).ravel()
+    flat = x.ravel()
+    # reduceat needs indices < len; a run ending at the last hour ends at len
+    padded = np.append(flat, np.nan)
+    valid = ~np.isnan(padded)
+    peak = np.fmax.reduceat(padded, bounds)[::2]
+    total = np.add.reduceat(np.where(valid, padded, 0.0), bounds)[::2]
+    count = np.add.reduceat(valid.astype("int64"), bounds)[::2]
+    with np.errstate(invalid="ignore"):
+        return peak, total / count
+
+
+def build_features(df_merged, event_threshold=EVENT_THRESHOLD, event_min_hours=EVENT_MIN_HOURS):
+    # Exposure features for a merged causal frame, every city at once:
+    # returns (per-hour features aligned with df_merged's rows, one row per
+    # bad-air event). Work happens on dense (city, hour) arrays, so gaps in
+    # the merged hours count as missing, not as adjacent hours.
+    df_merged = add_hour_key(df_merged, "datetime_utc")
+    series, rows, cols, start_hour, n_hours = dense_positions(df_merged)
+    shape = (len(series), n_hours)
+
+    pm25 = to_dense(df_merged[PM25_COL], rows, cols, shape, dtype="float64")
+    features = {}
+    for hours in ROLLING_HOURS:
+        features[f"pm2_5_mean_{hours}h"] = rolling_mean(pm25, hours)
+    pm25_24h = features["pm2_5_mean_24h"]
+    features["pm2_5_aqi"] = pm25_aqi(pm25_24h)
+
+    event_rows, event_starts, event_ends = find_runs(pm25_24h >= event_threshold, event_min_hours)
+    features["aqi_event_id"] = label_runs(shape, event_rows, event_starts, event_ends)
+
+    for col in LAG_COLS:
+        if col in df_merged.columns:
+            values = to_dense(df_merged[col], rows, cols, shape)
+            for hours in LAG_HOURS:
+                features[f"{col}_lag_{hours}h"] = lag(values, hours)
+
+    # Back to the merged frame's rows
+    df_features = df_merged[SERIES_COLS + ["datetime_utc", HOUR_COL]].copy()
+    for name, dense in features.items():
+        df_features[name] = dense[rows, cols]
+    category = aqi_category(df_features["pm2_5_mean_24h"].to_numpy())
+    df_features["aqi_category"] = pd.Categorical.from_codes(category, categories=AQI_CATEGORIES, ordered=True)
+    df_features["aqi_event"] = df_features["aqi_event_id"] >= 0
+
+    peak, mean = run_stats(pm25, event_rows, event_starts, event_ends)
+    df_events = series.iloc[event_rows].reset_index(drop=True)
+    df_events.insert(0, "aqi_event_id", np.arange(len(event_rows)))
+    df_events["start_utc"] = hours_to_datetime(start_hour + event_starts)
+    df_events["end_utc"] = hours_to_datetime(start_hour + event_ends)
+    df_events["hours"] = event_ends - event_starts
+    df_events["pm2_5_peak"] = peak
+    df_events["pm2_5_mean"] = mean
+    df_events["pm2_5_mean_24h_peak"] = run_stats(pm25_24h, event_rows, event_starts, event_ends)[0]
+    return apply_schema(df_features), apply_schema(df_events)
+
+
+def compute_aqi_features(iso_name):
+    # Feature and event tables for one ISO's merged table, written next to it
+    adapter = ISO_ADAPTERS[iso_name]
+    if not table_exists(adapter.merged_table):
+        print(f"No merged {iso_name.upper()} data, skipping.")
+        return None
+
+    with span(f"features:{iso_name}"):
+        with span("read"):
+            df_merged = read_table(adapter.merged_table)
+        with span("build"):
+            df_features, df_events = build_features(df_merged)
+        with span("write"):
+            output_path = write_table(df_features, adapter.features_table, partition_cols=["zone"], partition_by_year=True)
+            events_path = write_table(df_events, adapter.events_table)
+    print(f"Saved {iso_name.upper()} AQI features to {output_path} ({len(df_events)} events in {events_path})")
+    return output_path
+
+
+def main():
+    with run("aqi_features"):
+        for iso_name in ISO_ADAPTERS:
+            compute_aqi_features(iso_name)
+
+
+if __name__ == "__main__":
+    main()
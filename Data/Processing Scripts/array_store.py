@@ -0,0 +1,161 @@
+import os
+
+import numpy as np
+import pandas as pd
+
+from instrumentation import run, span
+from iso_adapters import ISO_ADAPTERS
+from storage import data_path, read_arrays, read_table, table_exists, write_arrays
+from time_index import HOUR_COL, add_hour_key, epoch_hours, hours_to_datetime
+
+# Units of the grid columns, which carry no __unit suffix
+GRID_UNITS = {
+    "load": "megawatt",
+    "load_forecast": "megawatt",
+    "load_to_forecast_diff": "megawatt",
+    "regional_percentage": "fraction",
+}
+
+SERIES_COLS = ["city", "state", "zone"]
+
+
+def column_info(col, dtype):
+    # Variable name and unit of a stored column. Open-Meteo columns are
+    # named <variable>__<unit> (see helper.extract_data_from_api_response).
+    name, sep, unit = col.partition("__")
+    return {"name": name, "unit": unit if sep else GRID_UNITS.get(col), "dtype": str(dtype)}
+
+
+def store_path(iso_name):
+    return data_path("Merged", f"{iso_name}_hourly_arrays")
+
+
+class ArrayStore:
+    # Hourly numeric columns of a merged causal table as one 2-D array per
+    # column: row s holds series[s] (a city, with its state and zone),
+    # column h the hour start_hour + h. Hours without data are NaN. Opened
+    # memory-mapped, so queries read only the pages they touch and every
+    # process opening the store shares one copy in the page cache.
+    def __init__(self, meta, arrays):
+        self.start_hour = meta["start_hour"]
+        self.n_hours = meta["n_hours"]
+        self.series = pd.DataFrame(meta["series"], columns=SERIES_COLS)
+        self.columns = meta["columns"]
+        self.arrays = arrays
+
+    @classmethod
+    def open(cls, path, columns=None, mmap=True):
+        meta, _ = read_arrays(path, [])
+        names = list(columns or meta["columns"])
+        return cls(meta, read_arrays(path, names, mmap=mmap)[1])
+
+    def units(self):
+        return {col: info["unit"] for col, info in self.columns.items()}
+
+    def rows(self, city=None, zone=None):
+        # Series rows for a city and/or zone (all rows if neither is given)
+        mask = np.ones(len(self.series), dtype=bool)
+        if city is not None:
+            mask &= (self.series["city"] == city).to_numpy()
+        if zone is not None:
+            mask &= (self.series["zone"] == zone).to_numpy()
+        rows = np.flatnonzero(mask)
+        if not len(rows):
+            raise KeyError(f"No series for city={city!r}, zone={zone!r}")
+        return rows
+
+    def hours(self, start=None, end=None):
+        # Column slice for start <= hour < end (datetimes or strings)
+        first = 0 if start is None else epoch_hours(pd.Series([pd.Timestamp(start)]))[0] - self.start_hour
+        last = self.n_hours if end is None else epoch_hours(pd.Series([pd.Timestamp(end)]))[0] - self.start_hour
+        return slice(int(np.clip(first, 0, self.n_hours)), int(np.clip(last, 0, self.n_hours)))
+
+    def values(self, column, city=None, zone=None, start=None, end=None):
+        # (series, hours) array for a range query. One city is a view into
+        # the mapped file; several rows are copied, but only their range.
+        rows = self.rows(city, zone)
+        hours = self.hours(start, end)
+        array = self.arrays[column]
+        if len(rows) == 1:
+            return array[rows[0]:rows[0] + 1, hours]
+        return array[rows, hours]
+
+    def frame(self, columns=None, city=None, zone=None, start=None, end=None):
+        # Long frame (city, state, zone, datetime_utc, columns...) for a
+        # range query, skipping hours with no data in any of the columns
+        columns = list(columns or self.arrays)
+        rows = self.rows(city, zone)
+        hours = self.hours(start, end)
+        hour_keys = self.start_hour + np.arange(self.n_hours)[hours]
+        data = {col: self.values(col, city, zone, start, end).ravel() for col in columns}
+        df = self.series.iloc[np.repeat(rows, len(hour_keys))].reset_index(drop=True)
+        df[HOUR_COL] = np.tile(hour_keys, len(rows))
+        df["datetime_utc"] = hours_to_datetime(df[HOUR_COL])
+        for col in columns:
+            df[col] = data[col]
+        has_data = np.zeros(len(df), dtype=bool)
+        for col in columns:
+            has_data |= ~np.isnan(data[col])
+        return df[has_data].reset_index(drop=True)
+
+
+def dense_positions(df):
+    # Layout of a merged frame (with utc_hour) on a dense (series, hour)
+    # grid: the series table (one row per city), each row's series row and
+    # hour column, and the first hour and number of hours
+    series = df[SERIES_COLS].astype(str).drop_duplicates().sort_values(SERIES_COLS).reset_index(drop=True)
+    rows = pd.MultiIndex.from_frame(series).get_indexer(pd.MultiIndex.from_frame(df[SERIES_COLS].astype(str)))
+    hours = df[HOUR_COL].to_numpy(dtype="int64")
+    start_hour = int(hours.min())
+    n_hours = int(hours.max()) - start_hour + 1
+    return series, rows, hours - start_hour, start_hour, n_hours
+
+
+def to_dense(values, rows, cols, shape, dtype=None):
+    # Scatter one column into a (series, hour) array, NaN where missing
+    values = np.asarray(values)
+    dense = np.full(shape, np.nan, dtype=dtype or values.dtype)
+    dense[rows, cols] = values
+    return dense
+
+
+def store_columns(df):
+    # Float columns worth storing: measurements and grid values
+    return [c for c in df.columns if pd.api.types.is_float_dtype(df[c])]
+
+
+def build_array_store(iso_name):
+    # Write the array store for one ISO's merged table
+    adapter = ISO_ADAPTERS[iso_name]
+    if not table_exists(adapter.merged_table):
+        print(f"No merged {iso_name.upper()} data, skipping.")
+        return None
+
+    with span(f"array_store:{iso_name}"):
+        with span("read"):
+            df = add_hour_key(read_table(adapter.merged_table), "datetime_utc")
+        with span("build"):
+            series, rows, cols, start_hour, n_hours = dense_positions(df)
+            columns = store_columns(df)
+            arrays = {col: to_dense(df[col], rows, cols, (len(series), n_hours)) for col in columns}
+            meta = {
+                "table": os.path.basename(adapter.merged_table),
+                "start_hour": start_hour,
+                "n_hours": n_hours,
+                "series": series.to_dict("records"),
+                "columns": {col: column_info(col, arrays[col].dtype) for col in columns},
+            }
+        with span("write"):
+            path = write_arrays(store_path(iso_name), meta, arrays)
+    print(f"Saved {iso_name.upper()} array store to {path}")
+    return path
+
+
+def main():
+    with run("array_store"):
+        for iso_name in ISO_ADAPTERS:
+            build_array_store(iso_name)
+
+
+if __name__ == "__main__":
+    main()
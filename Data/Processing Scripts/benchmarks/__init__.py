@@ -0,0 +1,4 @@
+# Benchmarks for the processing scripts, run from Data/Processing Scripts:
+#   python -m benchmarks                  time every case against baselines.json
+#   python -m benchmarks --save-baseline  record new baselines
+#   python -m benchmarks --compare        speedups over the replaced code
@@ -0,0 +1,118 @@
+import argparse
+import json
+import os
+import platform
+import shutil
+import sys
+import tempfile
+from datetime import date
+
+import numpy as np
+import pandas as pd
+
+import storage
+
+# Baselines are stored as multiples of the calibration workload's time
+# (see cases.calibration), timed on the same run, so the committed file is
+# not tied to the machine that recorded it. A case only counts as a
+# regression when it is also at least MIN_REGRESSION_S slower in absolute
+# terms, which keeps timer noise on millisecond cases out of the check.
+BASELINE_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "baselines.json")
+MIN_REGRESSION_S = 0.02
+
+
+def case_key(name, config):
+    # Baselines are kept per data size and storage format
+    return f"{name}[cities={config['cities']},years={config['years']},{config['format']}]"
+
+
+def load_baselines(path):
+    if os.path.exists(path):
+        with open(path) as f:
+            return json.load(f)
+    return {}
+
+
+def save_baselines(baselines, path):
+    with open(path, "w") as f:
+        json.dump(baselines, f, indent=2, sort_keys=True)
+        f.write("\n")
+
+
+def select_cases(cases, patterns):
+    if not patterns:
+        return list(cases)
+    return [name for name in cases if any(p in name for p in patterns)]
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog="python -m benchmarks", description="Time pipeline functions on synthetic data.")
+    parser.add_argument("cases", nargs="*", help="only run cases whose name contains one of these")
+    parser.add_argument("--cities", type=int, default=3, help="synthetic cities per ISO (default: %(default)s)")
+    parser.add_argument("--years", type=int, default=1, help="years of hourly data (default: %(default)s)")
+    parser.add_argument("--format", choices=["parquet", "csv"], default=storage.STORAGE_FORMAT)
+    parser.add_argument("--repeat", type=int, default=5, help="best of this many runs per case")
+    parser.add_argument("--baseline", default=BASELINE_PATH)
+    parser.add_argument("--save-baseline", action="store_true", help="store these timings as the new baselines")
+    parser.add_argument("--tolerance", type=float, default=1.5, help="fail when a case is this many times slower")
+    parser.add_argument("--min-regression", type=float, default=MIN_REGRESSION_S, help="ignore slowdowns smaller than this many seconds")
+    parser.add_argument("--compare", action="store_true", help="print speedups over the replaced implementations")
+    args = parser.parse_args(argv)
+
+    if args.compare:
+        from .comparisons import run_comparisons
+        run_comparisons()
+        return 0
+
+    config = {"cities": args.cities, "years": args.years, "format": args.format}
+    baselines = load_baselines(args.baseline)
+    regressions = []
+    data_dir = tempfile.mkdtemp(prefix="energy-benchmarks-")
+    try:
+        # Every pipeline module imported from here on reads the synthetic tree
+        storage.STORAGE_FORMAT = args.format
+        storage.set_data_dir(data_dir)
+        from .cases import CASES, calibration, time_call
+        from .generators import write_data_tree
+        write_data_tree(data_dir, args.cities, args.years)
+
+        calibration_s, _ = time_call(calibration(), repeat=max(args.repeat, 3))
+        print(f"calibration: {calibration_s:.4f}s; baselines are scaled by it")
+        print(f"{'case':<34} {'seconds':>9} {'baseline':>9} {'ratio':>7}")
+        for name in select_cases(CASES, args.cases):
+            seconds, _ = time_call(CASES[name](config), repeat=args.repeat)
+            key = case_key(name, config)
+            relative = baselines.get(key, {}).get("relative")
+            line = f"{name:<34} {seconds:>9.4f}"
+            if relative:
+                expected = relative * calibration_s
+                ratio = seconds / expected
+                line += f" {expected:>9.4f} {ratio:>6.2f}x"
+                if ratio > args.tolerance and seconds - expected > args.min_regression:
+                    line += "  REGRESSION"
+                    regressions.append(name)
+            print(line)
+            if args.save_baseline:
+                baselines[key] = {
+                    "relative": round(seconds / calibration_s, 4),
+                    "seconds": round(seconds, 6),
+                    "calibration_s": round(calibration_s, 6),
+                    "saved": date.today().isoformat(),
+                    "python": platform.python_version(),
+                    "pandas": pd.__version__,
+                    "numpy": np.__version__,
+                }
+    finally:
+        shutil.rmtree(data_dir, ignore_errors=True)
+
+    if args.save_baseline:
+        save_baselines(baselines, args.baseline)
+        print(f"Saved baselines to {args.baseline}")
+    elif regressions:
+        print(f"{len(regressions)} case(s) slower than {args.tolerance}x baseline: {', '.join(regressions)}")
+        return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,213 @@
+import contextlib
+import io
+import time
+
+from .generators import HOURS_PER_YEAR, FakeHourly, make_fuel_mix_frame, make_merged_frame, make_weather_frame
+
+# Regression cases: name -> setup(config) returning the zero-argument call
+# to time. config has cities (per ISO) and years; the merge cases read the
+# tree generators.write_data_tree wrote to storage.DATA_DIR. Pipeline
+# modules are imported inside the setups, after the runner has pointed
+# DATA_DIR at that tree.
+
+
+def time_call(fn, repeat=3):
+    # Best-of-N wall time in seconds, plus the result of the last call
+    best = float("inf")
+    result = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = fn()
+        best = min(best, time.perf_counter() - start)
+    return best, result
+
+
+def calibration():
+    # Fixed NumPy/pandas workload (sort, grouped sum, merge) timed on every
+    # run; baselines are stored relative to it so they carry over between
+    # machines of different speed
+    import numpy as np
+    import pandas as pd
+    rng = np.random.default_rng(0)
+    df = pd.DataFrame({"key": rng.integers(0, 1000, 1_000_000), "value": rng.random(1_000_000)})
+    df_keys = pd.DataFrame({"key": np.arange(1000), "weight": rng.random(1000)})
+
+    def work():
+        np.sort(df["value"].to_numpy())
+        sums = df.groupby("key")["value"].sum()
+        return pd.merge(df, df_keys, on="key")["weight"].sum() + sums.sum()
+    return work
+
+
+def quiet(fn):
+    # Drop the progress prints of pipeline functions while timing them
+    def call():
+        with contextlib.redirect_stdout(io.StringIO()):
+            return fn()
+    return call
+
+
+def n_hours(config):
+    return HOURS_PER_YEAR * config["years"]
+
+
+def setup_extract(config):
+    from helper import extract_data_from_api_response
+    hourly = FakeHourly(6, n_hours(config))
+    cols = [f"var_{i}" for i in range(6)]
+    return lambda: extract_data_from_api_response(hourly, cols, timezone="America/New_York")
+
+
+def setup_aggregate_iso(config):
+    from aggregation import aggregate_iso
+    df = make_merged_frame(config["cities"] * 3, n_hours(config))
+    return lambda: aggregate_iso(df)
+
+
+def setup_carbon_intensity(config):
+    from carbon_intensity import ISONE_FUEL_COLS, carbon_intensity
+    df = make_fuel_mix_frame(ISONE_FUEL_COLS, n_hours(config))
+    return lambda: carbon_intensity(df, ISONE_FUEL_COLS)
+
+
+def setup_build_iso_level(config):
+    from aggregation import build_iso_level
+    from carbon_intensity import ISONE_FUEL_COLS
+    df = make_merged_frame(config["cities"] * 3, n_hours(config))
+    df_fuel = make_fuel_mix_frame(ISONE_FUEL_COLS, n_hours(config))
+    return lambda: build_iso_level(df, df_fuel, ISONE_FUEL_COLS)
+
+
+def setup_parse_utc(config):
+    # Open-Meteo datetime strings as to_csv writes them, with the offset
+    # switching at every DST change
+    from time_index import parse_utc
+    values = make_weather_frame(n_hours(config))["datetime"].astype(str)
+    return lambda: parse_utc(values)
+
+
+def setup_join_hour_key(config):
+    # Grid join on (zone, utc_hour) once the key was assigned at ingest
+    import pandas as pd
+    from time_index import HOUR_COL, add_hour_key
+    df = add_hour_key(make_merged_frame(config["cities"] * 3, n_hours(config)), "datetime_utc")
+    df_left = df.drop(columns=["load", "load_forecast", "regional_percentage"])
+    df_grid = df[["zone", HOUR_COL, "load", "load_forecast", "regional_percentage"]].sample(frac=1, random_state=0)
+    return lambda: pd.merge(df_left, df_grid, on=["zone", HOUR_COL])
+
+
+def setup_grid_index_join(config):
+    # The same join answered from a grid index by array indexing
+    from grid_index import GRID_COLS, GridIndex
+    from time_index import add_hour_key
+    df = add_hour_key(make_merged_frame(config["cities"] * 3, n_hours(config)), "datetime_utc")
+    grid_index = GridIndex.from_frame(df)
+    df_left = df.drop(columns=GRID_COLS)
+    return lambda: grid_index.join(df_left)
+
+
+def setup_aqi_features(config):
+    # Rolling means, AQI, event runs and lags over every city at once
+    from aqi_features import build_features
+    df = make_merged_frame(config["cities"] * 3, n_hours(config))
+    df = df.assign(city=df["zone"], state="state")
+    return lambda: build_features(df)
+
+
+def setup_quality_check(config):
+    # The validation pass merge_iso runs on every merged frame
+    from data_quality import QualityReport
+    df = make_merged_frame(config["cities"] * 3, n_hours(config))
+    df = df.assign(city=df["zone"], state="state")
+    return lambda: QualityReport("iso").check_merged(df)
+
+
+def setup_load_baseline(config):
+    # Baseline fit and anomaly join at the scale of hundreds of zones
+    from load_baseline import LoadBaseline, ZoneHours, add_load_anomalies
+    df = make_merged_frame(config["cities"] * 100, n_hours(config))
+
+    def fit_and_join():
+        zone_hours = ZoneHours(df, "America/New_York")
+        return add_load_anomalies(df, LoadBaseline.fit(zone_hours), zone_hours)
+    return fit_and_join
+
+
+def setup_emissions(iso_name):
+    # Rerun of the marginal emissions stage once the grid index and the
+    # fuel-mix arrays are cached, as after a load-data refresh
+    def setup(config):
+        from marginal_emissions import compute_marginal_emissions
+        quiet(lambda: compute_marginal_emissions(iso_name))()
+        return quiet(lambda: compute_marginal_emissions(iso_name))
+    return setup
+
+
+def setup_merge(iso_name, city_workers=1):
+    # Full merge_iso run on the synthetic tree, reads and writes included.
+    # The grid index is built beforehand, as its pipeline stage would.
+    # city_workers is capped at the CPU count, so on one core the pooled
+    # case times the serial merge.
+    def setup(config):
+        import merge_data
+        from grid_index import build_grid_index
+        quiet(lambda: build_grid_index(iso_name))()
+        return quiet(lambda: merge_data.merge_iso(iso_name, city_workers=city_workers))
+    return setup
+
+
+def setup_iso_level(iso_name):
+    def setup(config):
+        import merge_data
+        from merge_iso_level_data import aggregate_iso_level
+        quiet(lambda: merge_data.merge_iso(iso_name))()
+        return quiet(lambda: aggregate_iso_level(iso_name))
+    return setup
+
+
+def setup_read_merged(iso_name):
+    def setup(config):
+        import merge_data
+        from iso_adapters import ISO_ADAPTERS
+        from storage import read_table
+        quiet(lambda: merge_data.merge_iso(iso_name))()
+        return lambda: read_table(ISO_ADAPTERS[iso_name].merged_table)
+    return setup
+
+
+def setup_array_store_query(iso_name):
+    # One city-month of one column from the memory-mapped array store
+    def setup(config):
+        import merge_data
+        from array_store import ArrayStore, build_array_store, store_path
+        quiet(lambda: merge_data.merge_iso(iso_name))()
+        quiet(lambda: build_array_store(iso_name))()
+
+        def query():
+            store = ArrayStore.open(store_path(iso_name))
+            city = store.series["city"].iloc[0]
+            return store.values("temperature_2m__celsius", city=city, start="2021-06-01", end="2021-07-01").sum()
+        return query
+    return setup
+
+
+CASES = {
+    "extract_data_from_api_response": setup_extract,
+    "aggregate_iso": setup_aggregate_iso,
+    "carbon_intensity": setup_carbon_intensity,
+    "build_iso_level": setup_build_iso_level,
+    "parse_utc": setup_parse_utc,
+    "join_hour_key": setup_join_hour_key,
+    "grid_index_join": setup_grid_index_join,
+    "aqi_features": setup_aqi_features,
+    "load_baseline": setup_load_baseline,
+    "quality_check": setup_quality_check,
+    "merge_isone": setup_merge("isone"),
+    "merge_nyiso": setup_merge("nyiso"),
+    "merge_caiso": setup_merge("caiso"),
+    "merge_nyiso_4_workers": setup_merge("nyiso", city_workers=4),
+    "aggregate_iso_level_nyiso": setup_iso_level("nyiso"),
+    "read_merged_nyiso": setup_read_merged("nyiso"),
+    "array_store_query_nyiso": setup_array_store_query("nyiso"),
+    "marginal_emissions_nyiso": setup_emissions("nyiso"),
+}
@@ -0,0 +1,274 @@
+import os
+import tempfile
+
+import numpy as np
+import pandas as pd
+
+from aggregation import WEATHER_AQI_COLS, weighted_mean_by_group
+from grid_index import GRID_COLS, GridIndex
+from helper import extract_data_from_api_response, get_unit_name
+from carbon_intensity import CARBON_INTENSITY, ISONE_FUEL_COLS, carbon_intensity
+from instrumentation import path_bytes
+from load_baseline import MIN_HOURS, TEMP_BIN_WIDTH, TEMP_COL, LoadBaseline, ZoneHours
+from marginal_emissions import marginal_emissions
+import storage
+from schema import apply_schema, memory_report, with_local_date_time
+from time_index import HOUR_COL, add_hour_key, parse_utc
+
+from .cases import time_call
+from .generators import FakeHourly, make_fuel_mix_frame, make_merged_frame, make_weather_frame
+
+# Speedup of each optimized function over the implementation it replaced,
+# checking first that both give the same result
+
+
+def aggregate_weighted_lambda(df, group_col="datetime_utc"):
+    # Reference: the original per-group np.average lambdas from aggregate_iso
+    df = df[df["regional_percentage"].notnull()]
+    agg_dict = {}
+    for col in WEATHER_AQI_COLS:
+        agg_dict[col] = lambda x, col=col: np.average(x, weights=df.loc[x.index, "regional_percentage"])
+    return df.groupby(group_col).agg(agg_dict)
+
+
+def bench_aggregate_iso(n_zones=8, n_hours=24 * 90):
+    df = make_merged_frame(n_zones, n_hours)
+    t_lambda, expected = time_call(lambda: aggregate_weighted_lambda(df), repeat=1)
+    t_vector, actual = time_call(
+        lambda: weighted_mean_by_group(df, "datetime_utc", WEATHER_AQI_COLS, "regional_percentage")
+    )
+    # Both paths must agree before the timings mean anything
+    pd.testing.assert_frame_equal(actual, expected, check_exact=False, rtol=1e-9)
+    print(f"aggregate_iso ({n_zones} zones x {n_hours} hours): "
+          f"lambda {t_lambda:.3f}s, vectorized {t_vector:.3f}s, "
+          f"speedup {t_lambda / t_vector:.0f}x")
+
+
+def carbon_intensity_row(row, fuel_cols):
+    # Reference: the original row-wise carbon_intensity_row_* loop
+    total = 0
+    total_mw = 0
+    for col in fuel_cols:
+        mw = row.get(col, 0)
+        ci = CARBON_INTENSITY.get(col, 0)
+        total += mw * ci
+        total_mw += mw
+    return total / total_mw if total_mw > 0 else np.nan
+
+
+def bench_carbon_intensity(n_hours=24 * 365):
+    # Drop one fuel so the missing-column path is covered too
+    df = make_fuel_mix_frame(ISONE_FUEL_COLS[:-1], n_hours)
+    t_apply, expected = time_call(
+        lambda: df.apply(carbon_intensity_row, axis=1, fuel_cols=ISONE_FUEL_COLS), repeat=1
+    )
+    t_vector, actual = time_call(lambda: carbon_intensity(df, ISONE_FUEL_COLS))
+    pd.testing.assert_series_equal(actual, expected, check_exact=False, rtol=1e-9)
+    print(f"carbon_intensity ({n_hours} hours): "
+          f"apply {t_apply:.3f}s, vectorized {t_vector:.4f}s, "
+          f"speedup {t_apply / t_vector:.0f}x")
+
+
+def bench_storage(n_zones=8, n_hours=24 * 365):
+    df = make_merged_frame(n_zones, n_hours)
+    local = df["datetime_utc"].dt.tz_convert("America/New_York")
+    df.insert(0, "datetime", local)
+    df.insert(2, "date", local.dt.date)
+    df.insert(3, "time", local.dt.time)
+
+    with tempfile.TemporaryDirectory() as tmp:
+        base = os.path.join(tmp, "merged")
+        csv_path = storage.write_table(df, base, fmt="csv")
+        parquet_path = storage.write_table(df, base, fmt="parquet", partition_cols=["zone"], partition_by_year=True)
+
+        def load_csv():
+            # What the merge scripts had to do: parse every datetime string
+            df_csv = pd.read_csv(csv_path)
+            df_csv["datetime"] = pd.to_datetime(df_csv["datetime"], utc=True)
+            df_csv["datetime_utc"] = pd.to_datetime(df_csv["datetime_utc"], utc=True)
+            return df_csv
+
+        t_csv, _ = time_call(load_csv)
+        t_parquet, _ = time_call(lambda: pd.read_parquet(parquet_path))
+        t_projected, _ = time_call(lambda: storage.read_table(
+            base, columns=["datetime_utc", "pm2_5__micrograms_per_cubic_metre"], filters=[("zone", "=", "zone_0")]
+        ))
+        print(f"storage ({len(df)} rows): "
+              f"csv {path_bytes(csv_path) / 1e6:.1f}MB / {t_csv:.3f}s, "
+              f"parquet {path_bytes(parquet_path) / 1e6:.1f}MB / {t_parquet:.3f}s, "
+              f"parquet 2 cols 1 zone {t_projected:.4f}s")
+
+
+def make_legacy_merged_frame(n_cities=25, n_hours=24 * 365 * 4):
+    # merged_*_causal frame as the merge scripts used to hold it: repeated
+    # string identifiers, object date/time columns, float64 everywhere
+    df = make_merged_frame(n_cities, n_hours)
+    df = df.rename(columns={"zone": "city"})
+    df["state"] = "New York"
+    df["zone"] = df["city"].str.replace("zone_", "z", regex=False)
+    df["datetime"] = df["datetime_utc"]
+    local = df["datetime_utc"].dt.tz_convert("America/New_York")
+    df["date"] = local.dt.date
+    df["time"] = local.dt.time
+    df["city"] = df["city"].astype(object)
+    df["state"] = df["state"].astype(object)
+    df["zone"] = df["zone"].astype(object)
+    return df
+
+
+def bench_schema(n_cities=25, n_hours=24 * 365 * 4):
+    df = make_legacy_merged_frame(n_cities, n_hours)
+    df_compact = apply_schema(df)
+    memory_report(df, df_compact, f"schema ({len(df)} rows)")
+    t_derive, _ = time_call(
+        lambda: with_local_date_time(df_compact, {c: "America/New_York" for c in df_compact["city"].cat.categories}),
+        repeat=1
+    )
+    print(f"schema: deriving local date/time on demand {t_derive:.3f}s")
+
+
+def extract_data_legacy(timeseries, cols, timezone="America/Los_Angeles"):
+    # Reference: the original decoder with date/time object columns and the
+    # bare-except probing loop
+    datetime_index = pd.date_range(
+        start=pd.to_datetime(timeseries.Time(), unit="s", utc=True),
+        end=pd.to_datetime(timeseries.TimeEnd(), unit="s", utc=True),
+        freq=pd.Timedelta(seconds=timeseries.Interval()),
+        inclusive="left"
+    ).tz_convert(timezone)
+    df_dict = {"datetime": datetime_index, "date": datetime_index.date, "time": datetime_index.time}
+    i = 0
+    while True:
+        try:
+            col_name = cols[i] + "__" + get_unit_name(timeseries.Variables(i).Unit())
+            df_dict[col_name] = timeseries.Variables(i).ValuesAsNumpy()
+            i += 1
+        except Exception:
+            break
+    return pd.DataFrame(data=df_dict)
+
+
+def bench_extract(n_vars=6, n_hours=24 * 365 * 4):
+    hourly = FakeHourly(n_vars, n_hours)
+    cols = [f"var_{i}" for i in range(n_vars)]
+    t_legacy, expected = time_call(lambda: extract_data_legacy(hourly, cols))
+    t_fast, actual = time_call(lambda: extract_data_from_api_response(hourly, cols))
+    pd.testing.assert_frame_equal(actual, expected.drop(columns=["date", "time"]))
+    print(f"extract_data_from_api_response ({n_vars} vars x {n_hours} hours): "
+          f"legacy {t_legacy:.3f}s, fast {t_fast:.4f}s, speedup {t_legacy / t_fast:.0f}x")
+
+
+def bench_time_index(n_zones=8, n_hours=24 * 365 * 4):
+    # Parse: inferred pd.to_datetime vs the fixed-layout parser on
+    # to_csv-style strings with DST offsets
+    values = make_weather_frame(n_hours)["datetime"].astype(str)
+    t_infer, expected = time_call(lambda: pd.to_datetime(values, utc=True), repeat=1)
+    t_fast, actual = time_call(lambda: parse_utc(values))
+    assert (actual == expected).all()
+    print(f"parse_utc ({n_hours} strings): "
+          f"to_datetime {t_infer:.3f}s, fixed layout {t_fast:.4f}s, speedup {t_infer / t_fast:.0f}x")
+
+    # Join: parse both sides' strings and merge on (zone, datetime_utc) vs
+    # merge on (zone, utc_hour) assigned at ingest
+    df = make_merged_frame(n_zones, n_hours)
+    df["datetime_utc"] = df["datetime_utc"].astype(str)
+    df_left = df.drop(columns=["load", "load_forecast", "regional_percentage"])
+    df_grid = df[["zone", "datetime_utc", "load", "load_forecast", "regional_percentage"]].sample(frac=1, random_state=0)
+
+    def join_datetime():
+        left = df_left.assign(datetime_utc=pd.to_datetime(df_left["datetime_utc"], utc=True))
+        right = df_grid.assign(datetime_utc=pd.to_datetime(df_grid["datetime_utc"], utc=True))
+        return pd.merge(left, right, on=["zone", "datetime_utc"])
+
+    def join_hour_key():
+        left = add_hour_key(df_left, "datetime_utc")
+        right = add_hour_key(df_grid, "datetime_utc").drop(columns="datetime_utc")
+        return pd.merge(left, right, on=["zone", HOUR_COL])
+
+    t_datetime, expected = time_call(join_datetime, repeat=1)
+    t_key, actual = time_call(join_hour_key)
+    assert np.array_equal(actual["load"].to_numpy(), expected["load"].to_numpy())
+    print(f"join ({len(df)} rows): "
+          f"parse + datetime keys {t_datetime:.3f}s, hour keys {t_key:.3f}s, "
+          f"speedup {t_datetime / t_key:.1f}x")
+
+
+def bench_grid_index(n_zones=11, n_hours=24 * 365 * 4):
+    # Keyed merge against long grid data vs array lookups in a grid index
+    df = add_hour_key(make_merged_frame(n_zones, n_hours), "datetime_utc")
+    df_left = df.drop(columns=GRID_COLS)
+    df_grid = df[["zone", HOUR_COL] + GRID_COLS].sample(frac=1, random_state=0)
+    t_build, grid_index = time_call(lambda: GridIndex.from_frame(df_grid), repeat=1)
+    t_merge, expected = time_call(lambda: pd.merge(df_left, df_grid, on=["zone", HOUR_COL]))
+    t_index, actual = time_call(lambda: grid_index.join(df_left))
+    pd.testing.assert_frame_equal(actual, expected)
+    print(f"grid index ({len(df)} rows): build {t_build:.3f}s once, "
+          f"merge {t_merge:.3f}s, index join {t_index:.3f}s, speedup {t_merge / t_index:.1f}x")
+
+
+def baseline_groupby_apply(df, timezone):
+    # Reference: per-zone groupby/apply as the analysis notebooks did it
+    local = df["datetime_utc"].dt.tz_convert(timezone)
+    df = df.assign(
+        hour_of_week=local.dt.dayofweek * 24 + local.dt.hour,
+        temp_bin=np.floor(df[TEMP_COL] / TEMP_BIN_WIDTH) * TEMP_BIN_WIDTH,
+    )
+    return df.groupby("zone").apply(
+        lambda g: g.groupby(["hour_of_week", "temp_bin"])["load"].agg(expected_load="mean", load_std="std", n_hours="size")
+    ).reset_index()
+
+
+def bench_load_baseline(n_zones=300, n_hours=24 * 365):
+    # Per-zone groupby/apply vs one sort-based pass over every zone
+    df = make_merged_frame(n_zones, n_hours)
+    timezone = "America/New_York"
+    t_apply, expected = time_call(lambda: baseline_groupby_apply(df, timezone), repeat=1)
+    t_sorted, actual = time_call(lambda: LoadBaseline.fit(ZoneHours(df, timezone)).to_frame())
+    # One load per zone and hour here, so the cells must agree exactly
+    expected = expected[expected["n_hours"] >= MIN_HOURS].sort_values(["zone", "hour_of_week", "temp_bin"])
+    actual = actual[actual["n_hours"] >= MIN_HOURS]
+    assert np.array_equal(actual["n_hours"].to_numpy(), expected["n_hours"].to_numpy())
+    assert np.allclose(actual["expected_load"].to_numpy(), expected["expected_load"].to_numpy())
+    assert np.allclose(actual["load_std"].to_numpy(), expected["load_std"].to_numpy())
+    print(f"load baseline ({n_zones} zones x {n_hours} hours): "
+          f"groupby/apply {t_apply:.3f}s, sorted pass {t_sorted:.3f}s, speedup {t_apply / t_sorted:.1f}x")
+
+
+def marginal_emissions_per_window(load, emissions, window, min_pairs):
+    # Reference: one least-squares fit per trailing window
+    d_load = np.r_[np.nan, np.diff(load)]
+    d_emissions = np.r_[np.nan, np.diff(emissions)]
+    slope = np.full(len(load), np.nan)
+    for t in range(len(load)):
+        x = d_load[max(0, t - window + 1):t + 1]
+        y = d_emissions[max(0, t - window + 1):t + 1]
+        valid = ~np.isnan(x) & ~np.isnan(y)
+        if valid.sum() >= min_pairs:
+            X = np.column_stack([np.ones(valid.sum()), x[valid]])
+            slope[t] = np.linalg.lstsq(X, y[valid], rcond=None)[0][1]
+    return slope
+
+
+def bench_marginal_emissions(n_hours=24 * 365, window=30 * 24):
+    # Per-window fits vs all windows solved as one batch
+    rng = np.random.default_rng(0)
+    load = 20000 + rng.normal(0, 500, n_hours).cumsum() / 10
+    emissions = 400 * load + rng.normal(0, 1e5, n_hours)
+    load[::500] = np.nan
+    t_loop, expected = time_call(lambda: marginal_emissions_per_window(load, emissions, window, window // 2), repeat=1)
+    t_batch, actual = time_call(lambda: marginal_emissions(load, emissions, window, window // 2))
+    assert np.allclose(actual, expected, equal_nan=True, rtol=1e-6)
+    print(f"marginal emissions ({n_hours} hours, {window}h windows): "
+          f"per-window fits {t_loop:.3f}s, batched {t_batch:.3f}s, speedup {t_loop / t_batch:.1f}x")
+
+
+def run_comparisons():
+    bench_aggregate_iso()
+    bench_carbon_intensity()
+    bench_storage()
+    bench_schema()
+    bench_extract()
+    bench_time_index()
+    bench_grid_index()
+    bench_load_baseline()
+    bench_marginal_emissions()
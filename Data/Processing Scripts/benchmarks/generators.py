@@ -0,0 +1,218 @@
+import os
+
+import numpy as np
+import pandas as pd
+
+from aggregation import WEATHER_AQI_COLS
+from carbon_intensity import ISONE_FUEL_COLS, NYISO_FUEL_COLS
+
+# Deterministic stand-ins for every input the pipeline reads: Open-Meteo
+# weather/AQI tables, GridStatus load/forecast and fuel-mix tables and
+# city_zone_info.csv. Same arguments (and seed) give the same data.
+
+START = "2021-01-01"
+HOURS_PER_YEAR = 24 * 365
+
+ISONE_ZONES = [
+    ".Z.MAINE", ".Z.NEWHAMPSHIRE", ".Z.VERMONT", ".Z.RHODEISLAND",
+    ".Z.CONNECTICUT", ".Z.WCMASS", ".Z.SEMASS", ".Z.NEMASSBOST"
+]
+NYISO_ZONES = ['west', 'genese', 'centrl', 'north', 'mhk_vl', 'capitl', 'hud_vl', 'millwd', 'dunwod', 'nyc', 'longil']
+
+WEATHER_COLS = [c for c in WEATHER_AQI_COLS if not c.startswith("pm2_5")]
+AQI_COLS = ["pm2_5__micrograms_per_cubic_metre"]
+
+# Columns of caiso_standardized_hourly that the CAISO adapter reads
+CAISO_FUELS = ["solar", "wind", "geothermal", "natural_gas", "large_hydro", "nuclear", "batteries", "imports"]
+
+
+def hours_utc(n_hours, start=START):
+    return pd.date_range(start, periods=n_hours, freq="h", tz="UTC")
+
+
+def intervals_utc(n_hours, minutes=60, start=START):
+    # Interval starts covering n_hours hours, every `minutes` minutes; the
+    # sub-hourly GridStatus tables (nyiso_load, fuel mixes) report every 5
+    return pd.date_range(start, periods=n_hours * 60 // minutes, freq=f"{minutes}min", tz="UTC")
+
+
+def make_weather_frame(n_hours, timezone="America/New_York", seed=0, cols=WEATHER_COLS):
+    # Open-Meteo-shaped table as helper.py saves it: local tz-aware datetime
+    # plus float32 columns named <variable>__<unit>
+    rng = np.random.default_rng(seed)
+    df = pd.DataFrame(rng.normal(10, 5, (n_hours, len(cols))).astype("float32"), columns=cols)
+    df.insert(0, "datetime", hours_utc(n_hours).tz_convert(timezone))
+    return df
+
+
+def make_aqi_frame(n_hours, timezone="America/New_York", seed=0):
+    df = make_weather_frame(n_hours, timezone, seed, cols=AQI_COLS)
+    df[AQI_COLS] = np.abs(df[AQI_COLS])
+    return df
+
+
+def make_isone_grid(n_hours, zones=ISONE_ZONES, seed=0):
+    # ISONE long-format tables: (reliability region forecast with
+    # regional_percentage, real-time zonal load), one row per zone and hour
+    rng = np.random.default_rng(seed)
+    utc = hours_utc(n_hours)
+    df_forecast = pd.DataFrame({
+        "interval_start_utc": np.repeat(utc, len(zones)),
+        "location": np.tile(zones, n_hours),
+        "load_forecast": rng.uniform(500, 1500, n_hours * len(zones)),
+    })
+    df_forecast["interval_end_utc"] = df_forecast["interval_start_utc"] + pd.Timedelta("1h")
+    df_forecast["regional_percentage"] = (
+        df_forecast["load_forecast"] / df_forecast.groupby("interval_start_utc")["load_forecast"].transform("sum")
+    )
+    df_zonal = df_forecast[["interval_start_utc", "location"]].copy()
+    df_zonal["load"] = df_forecast["load_forecast"] + rng.normal(0, 20, len(df_zonal))
+    return df_forecast, df_zonal
+
+
+def make_nyiso_grid(n_hours, seed=0, load_minutes=60):
+    # NYISO wide-format tables: one column per zone, plus the system-wide
+    # load column nyiso_load carries. nyiso_load has a row every
+    # load_minutes (5 in GridStatus); readings drift within each hour.
+    rng = np.random.default_rng(seed)
+    utc = hours_utc(n_hours)
+    forecast = rng.uniform(100, 5000, (n_hours, len(NYISO_ZONES)))
+    df_forecast = pd.DataFrame(forecast, columns=NYISO_ZONES)
+    df_forecast.insert(0, "interval_start_utc", utc)
+    per_hour = 60 // load_minutes
+    load = np.repeat(forecast, per_hour, axis=0) + rng.normal(0, 50, (n_hours * per_hour, len(NYISO_ZONES)))
+    df_load = pd.DataFrame(load, columns=NYISO_ZONES)
+    df_load.insert(0, "interval_start_utc", intervals_utc(n_hours, load_minutes))
+    df_load["load"] = df_load[NYISO_ZONES].sum(axis=1)
+    return df_forecast, df_load
+
+
+def make_fuel_mix_frame(fuel_cols, n_hours=HOURS_PER_YEAR, seed=0, minutes=60):
+    # GridStatus fuel-mix table with one MW column per fuel and a row every
+    # `minutes` (5 for the ISONE and NYISO tables)
+    rng = np.random.default_rng(seed)
+    utc = intervals_utc(n_hours, minutes)
+    df = pd.DataFrame(rng.uniform(0, 2000, (len(utc), len(fuel_cols))), columns=fuel_cols)
+    df.insert(0, "interval_start_utc", utc)
+    # A few all-zero rows to exercise the NaN path
+    df.loc[::1000, fuel_cols] = 0
+    return df
+
+
+def make_caiso_standardized(n_hours, seed=0):
+    # caiso_standardized_hourly: system load/forecast and fuel_mix.* columns
+    rng = np.random.default_rng(seed)
+    utc = hours_utc(n_hours)
+    df = pd.DataFrame({"interval_start_utc": utc, "interval_end_utc": utc + pd.Timedelta("1h")})
+    df["load.load"] = rng.uniform(20000, 40000, n_hours)
+    df["load_forecast.load_forecast"] = df["load.load"] + rng.normal(0, 500, n_hours)
+    for fuel in CAISO_FUELS:
+        df[f"fuel_mix.{fuel}"] = rng.uniform(0, 5000, n_hours)
+    return df
+
+
+def make_merged_frame(n_zones=8, n_hours=HOURS_PER_YEAR, seed=0):
+    # merged_*_causal-shaped frame: one row per zone per hour
+    rng = np.random.default_rng(seed)
+    hours = hours_utc(n_hours)
+    df = pd.DataFrame({
+        "datetime_utc": np.tile(hours, n_zones),
+        "zone": np.repeat([f"zone_{i}" for i in range(n_zones)], n_hours),
+    })
+    for col in WEATHER_AQI_COLS:
+        df[col] = rng.normal(10, 5, len(df))
+    shares = rng.random((n_hours, n_zones))
+    df["regional_percentage"] = (shares / shares.sum(axis=1, keepdims=True)).T.ravel()
+    df["load_forecast"] = rng.normal(1000, 100, len(df))
+    df["load"] = df["load_forecast"] + rng.normal(0, 20, len(df))
+    return df
+
+
+def make_city_zone_info(n_cities):
+    # n_cities per ISO. ISONE/NYISO cities cycle through the zones (so
+    # several cities can share one); CAISO cities are matched by state.
+    records = []
+    for i in range(n_cities):
+        records.append(("Isone City %d" % i, "Maine", ISONE_ZONES[i % len(ISONE_ZONES)], "America/New_York"))
+        records.append(("Nyiso City %d" % i, "New York", NYISO_ZONES[i % len(NYISO_ZONES)], "America/New_York"))
+        records.append(("Caiso City %d" % i, "California", None, "America/Los_Angeles"))
+    return pd.DataFrame(
+        [
+            {"city": city, "state": state, "zone": zone, "latitude": 0.0, "longitude": 0.0,
+             "timezone": tz, "population": None, "weather_filename": None, "aqi_filename": None}
+            for city, state, zone, tz in records
+        ]
+    )
+
+
+def write_data_tree(root, n_cities=3, years=1, seed=0):
+    # A complete Data tree under root: city_zone_info.csv, Open-Meteo tables
+    # for every city and the GridStatusIO tables all three ISO adapters
+    # read, covering `years` years of hours. Tables go through
+    # storage.write_table, so they use the configured storage format.
+    import storage
+
+    n_hours = HOURS_PER_YEAR * years
+    for name in ["OpenMeteo", "GridStatusIO", "Merged"]:
+        os.makedirs(os.path.join(root, name), exist_ok=True)
+
+    df_cities = make_city_zone_info(n_cities)
+    df_cities.to_csv(os.path.join(root, "city_zone_info.csv"), index=False)
+    for i, row in enumerate(df_cities.itertuples(index=False)):
+        base = os.path.join(root, "OpenMeteo", f"{row.city}_{row.state}_hourly")
+        storage.write_table(make_weather_frame(n_hours, row.timezone, seed + i), base + "_weather")
+        storage.write_table(make_aqi_frame(n_hours, row.timezone, seed + i), base + "_aqi")
+
+    grid_dir = os.path.join(root, "GridStatusIO")
+    df_forecast, df_zonal = make_isone_grid(n_hours, seed=seed)
+    storage.write_table(df_forecast, os.path.join(grid_dir, "isone_reliability_region_load_forecast"))
+    storage.write_table(df_zonal, os.path.join(grid_dir, "isone_zonal_load_real_time_hourly"))
+    df_forecast, df_load = make_nyiso_grid(n_hours, seed=seed, load_minutes=5)
+    storage.write_table(df_forecast, os.path.join(grid_dir, "nyiso_zonal_load_forecast_hourly"))
+    storage.write_table(df_load, os.path.join(grid_dir, "nyiso_load"))
+    storage.write_table(make_fuel_mix_frame(ISONE_FUEL_COLS, n_hours, seed, minutes=5), os.path.join(grid_dir, "isone_fuel_mix"))
+    storage.write_table(make_fuel_mix_frame(NYISO_FUEL_COLS, n_hours, seed, minutes=5), os.path.join(grid_dir, "nyiso_fuel_mix"))
+    storage.write_table(make_caiso_standardized(n_hours, seed), os.path.join(grid_dir, "caiso_standardized_hourly"))
+    return root
+
+
+class FakeVariable:
+    # Stands in for openmeteo_sdk VariableWithValues
+    def __init__(self, unit, values):
+        self.unit = unit
+        self.values = values
+
+    def Unit(self):
+        return self.unit
+
+    def ValuesAsNumpy(self):
+        return self.values
+
+
+class FakeHourly:
+    # Stands in for the VariablesWithTime FlatBuffer returned by .Hourly()
+    def __init__(self, n_vars=6, n_hours=HOURS_PER_YEAR * 4, seed=0):
+        rng = np.random.default_rng(seed)
+        self.start = int(pd.Timestamp(START, tz="UTC").timestamp())
+        self.n_hours = n_hours
+        self.variables = [
+            FakeVariable(unit, rng.normal(size=n_hours).astype("float32"))
+            for unit in range(1, n_vars + 1)
+        ]
+
+    def Time(self):
+        return self.start
+
+    def TimeEnd(self):
+        return self.start + 3600 * self.n_hours
+
+    def Interval(self):
+        return 3600
+
+    def VariablesLength(self):
+        return len(self.variables)
+
+    def Variables(self, i):
+        if i >= len(self.variables):
+            return None
+        return self.variables[i]
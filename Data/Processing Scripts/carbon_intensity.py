@@ -0,0 +1,60 @@
+import numpy as np
+import pandas as pd
+
+# Carbon intensity values (g CO2 eq per kWh)
+# source: https://en.wikipedia.org/wiki/Emission_intensity
+# solar: assumes 70/30 split between grid scale (22) and rooftop (46)
+CARBON_INTENSITY = {
+    "coal": 1001,
+    "hydro": 4,
+    "landfill_gas": 469,
+    "natural_gas": 469,
+    "nuclear": 16,
+    "oil": 893,
+    "other": 600,
+    "refuse": 469,
+    "solar": 29,
+    "wind": 12,
+    "wood": 230,
+    "dual_fuel": 600,
+    "other_fossil_fuels": 600,
+    "other_renewables": 30,
+    "geothermal": 38,
+    "biomass": 230,
+    "biogas": 469,
+    "small_hydro": 4,
+    "large_hydro": 4,
+}
+
+# Fuel-mix columns reported by each ISO
+ISONE_FUEL_COLS = [
+    "coal", "hydro", "landfill_gas", "natural_gas", "nuclear", "oil",
+    "other", "refuse", "solar", "wind", "wood"
+]
+NYISO_FUEL_COLS = [
+    "dual_fuel", "hydro", "natural_gas", "nuclear", "other_fossil_fuels",
+    "other_renewables", "wind"
+]
+# CAISO batteries (negative while charging) and imports (unknown mix) are
+# left out of the intensity calculation
+CAISO_FUEL_COLS = [
+    "solar", "wind", "geothermal", "biomass", "biogas", "small_hydro",
+    "coal", "nuclear", "natural_gas", "large_hydro", "other"
+]
+
+
+def intensity_vector(fuel_cols):
+    # Coefficient vector aligned with fuel_cols; unknown fuels count as zero
+    return np.array([CARBON_INTENSITY.get(col, 0) for col in fuel_cols], dtype="float64")
+
+
+def carbon_intensity(df, fuel_cols):
+    # Generation-weighted carbon intensity for every row of a fuel-mix frame
+    # as one matrix-vector product. Fuel columns missing from df count as
+    # zero MW; rows with zero total MW are NaN.
+    mw = df.reindex(columns=fuel_cols, fill_value=0).to_numpy(dtype="float64")
+    total = mw @ intensity_vector(fuel_cols)
+    total_mw = mw.sum(axis=1)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        intensity = np.where(total_mw > 0, total / total_mw, np.nan)
+    return pd.Series(intensity, index=df.index)
@@ -0,0 +1,132 @@
+import argparse
+import importlib
+import os
+import sys
+
+# One entry point for the pipeline steps, runnable from any directory. Only
+# the standard library is imported up front: each command imports its stage
+# module when it runs, after the data root is set, so --help and argument
+# errors return at once and only the fetch commands load the API clients.
+
+SCRIPT_DIR = os.path.dirname(os.path.abspath(__file__))
+DEFAULT_DATA_DIR = os.environ.get("ENERGY_DATA_DIR", os.path.dirname(SCRIPT_DIR))
+
+# Per-ISO commands: name -> (module, function run for each ISO, help)
+ISO_COMMANDS = {
+    "aggregate": ("merge_iso_level_data", "aggregate_iso_level", "ISO-level hourly aggregates of the merged tables"),
+    "grid-index": ("grid_index", "build_grid_index", "rebuild the dense grid indexes"),
+    "array-store": ("array_store", "build_array_store", "rebuild the memory-mapped array stores"),
+    "features": ("aqi_features", "compute_aqi_features", "AQI event and exposure features"),
+    "load-baseline": ("load_baseline", "compute_load_anomalies", "load baselines and anomalies"),
+    "emissions": ("marginal_emissions", "compute_marginal_emissions", "average and marginal emissions"),
+    "validate": ("data_quality", "validate_merged", "data-quality report of the merged tables"),
+}
+
+
+def load(module_name, data_dir):
+    # Stage modules build their paths at import time, so the data root is
+    # set before the first of them is imported
+    storage = importlib.import_module("storage")
+    storage.set_data_dir(data_dir)
+    return importlib.import_module(module_name)
+
+
+def iso_names(args):
+    adapters = importlib.import_module("iso_adapters").ISO_ADAPTERS
+    unknown = [name for name in args.iso or [] if name not in adapters]
+    if unknown:
+        sys.exit(f"unknown ISO: {', '.join(unknown)} (expected one of {', '.join(adapters)})")
+    return args.iso or list(adapters)
+
+
+def run_iso_command(args):
+    module_name, function_name, _ = ISO_COMMANDS[args.command]
+    module = load(module_name, args.data_dir)
+    names = iso_names(args)
+    from instrumentation import run
+    with run(module_name):
+        for iso_name in names:
+            getattr(module, function_name)(iso_name)
+
+
+def fetch_weather(args):
+    helper = load("helper", args.data_dir)
+    from instrumentation import run
+    with run("helper"):
+        helper.get_city_zone_info(max_workers=args.max_workers, refresh=args.refresh, batch_size=args.batch_size)
+
+
+def fetch_grid(args):
+    gridstatus = load("get_gridstatus_data", args.data_dir)
+    from instrumentation import run
+    entries = gridstatus.datasets
+    if args.dataset:
+        entries = [entry for entry in entries if entry["dataset"] in args.dataset]
+        unknown = set(args.dataset) - {entry["dataset"] for entry in entries}
+        if unknown:
+            sys.exit(f"unknown dataset: {', '.join(sorted(unknown))}")
+    client = gridstatus.get_client()
+    with run("get_gridstatus_data"):
+        for entry in entries:
+            gridstatus.update_dataset(entry, client)
+
+
+def merge(args):
+    merge_data = load("merge_data", args.data_dir)
+    names = iso_names(args)
+    from instrumentation import run
+    with run("merge_data"):
+        merge_data.merge_isos(names, max_workers=args.max_workers, streaming=args.streaming, city_workers=args.city_workers)
+
+
+def pipeline(args, pipeline_args):
+    return load("pipeline", args.data_dir).main(["--data-dir", args.data_dir] + pipeline_args)
+
+
+def build_parser():
+    parser = argparse.ArgumentParser(description="Fetch, merge and aggregate the energy/weather data.")
+    parser.add_argument("--data-dir", default=DEFAULT_DATA_DIR, help="root of the Data tree (default: %(default)s)")
+    commands = parser.add_subparsers(dest="command", required=True, metavar="command")
+
+    weather = commands.add_parser("fetch-weather", help="fetch Open-Meteo weather and air quality per city")
+    weather.add_argument("--max-workers", type=int, default=4)
+    weather.add_argument("--batch-size", type=int, default=10, help="cities per Open-Meteo request")
+    weather.add_argument("--refresh", action="store_true", help="refetch recent data of cached cities")
+    weather.set_defaults(handler=fetch_weather)
+
+    grid = commands.add_parser("fetch-grid", help="fetch the GridStatus datasets")
+    grid.add_argument("--dataset", action="append", help="only this dataset (repeatable); default all")
+    grid.set_defaults(handler=fetch_grid)
+
+    merge_parser = commands.add_parser("merge", help="merge weather, AQI and grid data per ISO")
+    merge_parser.add_argument("--iso", action="append", help="only this ISO (repeatable); default all")
+    merge_parser.add_argument("--streaming", action="store_true", help="merge month by month to bound memory")
+    merge_parser.add_argument("--max-workers", type=int, help="ISOs merged in parallel (default: one process per ISO)")
+    merge_parser.add_argument("--city-workers", type=int, help="worker processes per ISO for per-city work")
+    merge_parser.set_defaults(handler=merge)
+
+    for name, (_, _, help_text) in ISO_COMMANDS.items():
+        command = commands.add_parser(name, help=help_text)
+        command.add_argument("--iso", action="append", help="only this ISO (repeatable); default all")
+        command.set_defaults(handler=run_iso_command)
+
+    commands.add_parser("pipeline", help="run pipeline.py with the arguments that follow, rebuilding only stale stages", add_help=False)
+    return parser
+
+
+def main(argv=None):
+    # The pipeline subcommand defines no arguments, so everything after it
+    # is left over and goes to pipeline.py unchanged; other commands take
+    # no extra arguments
+    parser = build_parser()
+    args, pipeline_args = parser.parse_known_args(argv)
+    args.data_dir = os.path.abspath(args.data_dir)
+    if args.command == "pipeline":
+        return pipeline(args, pipeline_args)
+    if pipeline_args:
+        parser.error(f"unrecognized arguments: {' '.join(pipeline_args)}")
+    return args.handler(args)
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,198 @@
+import numpy as np
+import pandas as pd
+
+from instrumentation import run, span
+from iso_adapters import ISO_ADAPTERS
+from storage import data_path, read_table, table_exists, write_table
+from time_index import HOUR_COL, add_hour_key
+
+# Hours whose regional_percentage sums further than this from 1.0
+WEIGHT_SUM_TOLERANCE = 1e-3
+
+# Metrics combined with max when partial reports (windows, worker
+# processes) are merged; every other metric is a count and is summed
+MAX_PREFIX = "max_"
+
+
+def quality_path(iso_name, stage):
+    return data_path("Merged", "quality", f"{stage}_{iso_name}")
+
+
+def key_codes(values):
+    # Integer codes and key names (as strings) of a key column; categorical
+    # columns reuse their codes instead of hashing every row
+    if isinstance(values.dtype, pd.CategoricalDtype):
+        return values.cat.codes.to_numpy(dtype="int64"), values.cat.categories.astype(str)
+    codes, keys = pd.factorize(values)
+    return codes, pd.Index(keys).astype(str)
+
+
+def rows_by(df, level):
+    # Row count per value of a key column (city, zone)
+    return df.groupby(level, observed=True).size()
+
+
+class QualityReport:
+    # Data-quality counts for one ISO and stage, as long records (level,
+    # key, metric, value) with level "city", "zone" or "iso". Every check
+    # is one vectorized pass over a frame the pipeline already holds, and
+    # counts from partial frames (streaming windows, per-city workers) add
+    # up, so the report costs no extra reads.
+    def __init__(self, iso_name):
+        self.iso_name = iso_name
+        self.records = []
+
+    def add(self, level, values, metric):
+        # values: a Series indexed by key, or a scalar for the ISO level.
+        # Kept as arrays until to_frame, so adding costs next to nothing.
+        if not isinstance(values, pd.Series):
+            values = pd.Series([values], index=[self.iso_name])
+        self.records.append((level, metric, values.index.astype(str).to_numpy(), values.to_numpy(dtype="float64")))
+
+    @classmethod
+    def from_frame(cls, iso_name, df_quality):
+        # A report back from its to_frame output, e.g. one city's part
+        report = cls(iso_name)
+        for (level, metric), group in df_quality.groupby(["level", "metric"], sort=False):
+            report.add(level, pd.Series(group["value"].to_numpy(), index=group["key"].astype(str)), metric)
+        return report
+
+    def extend(self, other):
+        self.records.extend(other.records)
+
+    def add_join(self, name, df_before, df_after, level="city"):
+        # Rows per key on each side of a join; loss is before minus after
+        self.add(level, rows_by(df_before, level), f"{name}_rows_in")
+        self.add(level, rows_by(df_after, level).reindex(rows_by(df_before, level).index, fill_value=0), f"{name}_rows_out")
+
+    def add_iso_join(self, name, rows_in, rows_out):
+        self.add("iso", rows_in, f"{name}_rows_in")
+        self.add("iso", rows_out, f"{name}_rows_out")
+
+    def check_hours(self, df, level, hour_range=None, duplicates=True):
+        # Missing and (with duplicates) duplicated hours of each key against
+        # hour_range (first, last), by default the frame's own first and
+        # last hour. Without duplicates, several rows per key and hour are
+        # expected (e.g. the cities of a zone) and count once.
+        hours = df[HOUR_COL].to_numpy(dtype="int64")
+        if not len(hours):
+            return
+        first, last = hour_range or (hours.min(), hours.max())
+        codes, keys = key_codes(df[level])
+        repeated = pd.Series(codes * (last - first + 1) + (hours - first)).duplicated().to_numpy()
+        rows = np.bincount(codes, minlength=len(keys))
+        repeats = np.bincount(codes[repeated], minlength=len(keys))
+        observed = rows > 0
+        hours_seen = pd.Series((rows - repeats)[observed], index=keys[observed])
+        self.add(level, last - first + 1 - hours_seen, "missing_hours")
+        if duplicates:
+            self.add(level, pd.Series(rows[observed], index=keys[observed]), "rows")
+            self.add(level, pd.Series(repeats[observed], index=keys[observed]), "duplicated_hours")
+
+    def check_nan(self, df, level, cols):
+        # NaN count of every column per key, a bincount per column
+        codes, keys = key_codes(df[level])
+        observed = np.bincount(codes, minlength=len(keys)) > 0
+        for col in cols:
+            nan_counts = np.bincount(codes[df[col].isna().to_numpy()], minlength=len(keys))
+            self.add(level, pd.Series(nan_counts[observed], index=keys[observed]), f"nan_{col}")
+
+    def check_weights(self, df, weight_col="regional_percentage"):
+        # Per ISO hour, the weights should sum to 1; NaN weights are
+        # counted per zone (aggregate_iso skips them)
+        weights = df[weight_col].to_numpy(dtype="float64")
+        nan_weight = np.isnan(weights)
+        codes, zones = key_codes(df["zone"])
+        observed = np.bincount(codes, minlength=len(zones)) > 0
+        nan_counts = np.bincount(codes[nan_weight], minlength=len(zones))
+        self.add("zone", pd.Series(nan_counts[observed], index=zones[observed]), f"nan_{weight_col}")
+
+        hours = df[HOUR_COL].to_numpy(dtype="int64")
+        hours = hours - hours.min() if len(hours) else hours
+        sums = np.bincount(hours, weights=np.where(nan_weight, 0.0, weights))
+        deviation = np.abs(sums - 1.0)[np.bincount(hours) > 0]
+        self.add("iso", len(deviation), "hours")
+        self.add("iso", int((deviation > WEIGHT_SUM_TOLERANCE).sum()), "weight_sum_off_hours")
+        self.add("iso", deviation.max() if len(deviation) else 0.0, f"{MAX_PREFIX}weight_sum_deviation")
+
+    def check_merged(self, df, hour_range=None):
+        # Everything the merged causal frame can tell: hour coverage per
+        # city and zone, NaN rates and weight sums
+        df = add_hour_key(df, "datetime_utc")
+        self.check_hours(df, "city", hour_range)
+        self.check_hours(df, "zone", hour_range, duplicates=False)
+        value_cols = [c for c in df.columns if pd.api.types.is_float_dtype(df[c])]
+        self.check_nan(df, "city", value_cols)
+        self.check_weights(df)
+
+    def to_frame(self):
+        # One row per (level, key, metric), partial counts combined
+        if not self.records:
+            return pd.DataFrame(columns=["iso", "level", "key", "metric", "value"])
+        sizes = [len(values) for _, _, _, values in self.records]
+        df = pd.DataFrame({
+            "level": np.repeat([level for level, _, _, _ in self.records], sizes),
+            "key": np.concatenate([keys for _, _, keys, _ in self.records]),
+            "metric": np.repeat([metric for _, metric, _, _ in self.records], sizes),
+            "value": np.concatenate([values for _, _, _, values in self.records]),
+        })
+        is_max = df["metric"].str.startswith(MAX_PREFIX)
+        combined = pd.concat([
+            df[~is_max].groupby(["level", "key", "metric"], sort=False)["value"].sum(),
+            df[is_max].groupby(["level", "key", "metric"], sort=False)["value"].max(),
+        ]).reset_index()
+        return combined.assign(iso=self.iso_name)[["iso", "level", "key", "metric", "value"]]
+
+    def write(self, stage):
+        df = self.to_frame()
+        path = write_table(df, quality_path(self.iso_name, stage))
+        print_summary(df, f"{self.iso_name.upper()} {stage}")
+        return path
+
+
+def summary(df_quality):
+    # Per-key problems worth a look: join loss, missing/duplicated hours,
+    # NaN rates and weight-sum deviations, zero entries left out
+    wide = df_quality.pivot_table(index=["level", "key"], columns="metric", values="value", aggfunc="first")
+    out = pd.DataFrame(index=wide.index)
+    for name in sorted({m[:-len("_rows_in")] for m in wide.columns if m.endswith("_rows_in")}):
+        out[f"{name}_lost"] = wide[f"{name}_rows_in"] - wide[f"{name}_rows_out"]
+    for metric in ["missing_hours", "duplicated_hours", "weight_sum_off_hours", f"{MAX_PREFIX}weight_sum_deviation"]:
+        if metric in wide.columns:
+            out[metric] = wide[metric]
+    if "rows" in wide.columns:
+        for metric in [m for m in wide.columns if m.startswith("nan_")]:
+            out[f"{metric}_rate"] = wide[metric] / wide["rows"]
+    out = out.loc[:, (out.fillna(0) != 0).any()]
+    return out[(out.fillna(0) != 0).any(axis=1)]
+
+
+def print_summary(df_quality, label):
+    problems = summary(df_quality) if len(df_quality) else df_quality
+    if problems.empty:
+        print(f"{label} data quality: no problems found")
+    else:
+        print(f"{label} data quality:\n{problems.to_string(float_format=lambda v: f'{v:.4g}', na_rep='')}")
+
+
+def validate_merged(iso_name):
+    # Standalone check of a merged table written earlier; join loss is only
+    # recorded while merging (see merge_data.merge_iso)
+    adapter = ISO_ADAPTERS[iso_name]
+    if not table_exists(adapter.merged_table):
+        print(f"No merged {iso_name.upper()} data, skipping.")
+        return None
+    with span(f"validate:{iso_name}"):
+        report = QualityReport(iso_name)
+        report.check_merged(read_table(adapter.merged_table))
+        return report.write("validate")
+
+
+def main():
+    with run("data_quality"):
+        for iso_name in ISO_ADAPTERS:
+            validate_merged(iso_name)
+
+
+if __name__ == "__main__":
+    main()
@@ -1,18 +1,24 @@
 
+import json
 import os
+import time
 from datetime import date
-from gridstatusio import GridStatusClient
+
+import pandas as pd
+
+from instrumentation import record_http, run, span
+from storage import data_path, read_table, table_exists, table_schema, unify_schemas, write_table, write_table_stream
 
 # Set up date range
 start_date = "2021-01-01"
 end_date = date.today().strftime("%Y-%m-%d")
 
-# Ensure output directory exists
-output_dir = "../GridStatusIO"
-os.makedirs(output_dir, exist_ok=True)
+# Output directory; per-window partitions go under partitions/<dataset>/
+output_dir = data_path("GridStatusIO")
+partitions_dir = os.path.join(output_dir, "partitions")
 
-# Recommended: set GRIDSTATUS_API_KEY as an environment variable instead of hardcoding
-client = GridStatusClient("a40502a0863e463984dae0439b84759e")
+# Download window size (pandas frequency): "MS" for months, "W-MON" for weeks
+window_freq = "MS"
 
 # List of datasets and their parameters
 datasets = [
@@ -63,15 +69,116 @@ datasets = [
     },
 ]
 
-for entry in datasets:
-    params = entry["params"].copy()
-    params["start"] = start_date
-    params["end"] = end_date
-    print(f"Fetching {entry['dataset']} from {start_date} to {end_date} ...")
-    df = client.get_dataset(
-        dataset=entry["dataset"],
-        **params
-    )
-    output_path = os.path.join(output_dir, entry["filename"])
-    df.to_csv(output_path, index=False)
-    print(f"Saved to {output_path}")
\ No newline at end of file
+
+def get_windows(start, end, freq=window_freq):
+    # Split [start, end) into windows aligned to freq boundaries. Returns
+    # (window_start, window_end, complete) tuples; a window is complete when
+    # it ends on a boundary, i.e. it was not cut short by `end`.
+    boundaries = [d.strftime("%Y-%m-%d") for d in pd.date_range(start, end, freq=freq)]
+    starts = sorted(set([start] + [b for b in boundaries if start < b < end]))
+    ends = starts[1:] + [end]
+    return [(s, e, e in boundaries) for s, e in zip(starts, ends)]
+
+
+def load_manifest(manifest_path):
+    if os.path.exists(manifest_path):
+        with open(manifest_path) as f:
+            return json.load(f)
+    return {}
+
+
+def save_manifest(manifest, manifest_path):
+    tmp_path = manifest_path + ".tmp"
+    with open(tmp_path, "w") as f:
+        json.dump(manifest, f, indent=2, sort_keys=True)
+    os.replace(tmp_path, manifest_path)
+
+
+def download_partitions(client, entry, start, end, freq=window_freq):
+    # Fetch one dataset window by window, writing each window to its own CSV.
+    # The manifest records finished windows so reruns only fetch new or
+    # still-open ones (e.g. the current month).
+    dataset_dir = os.path.join(partitions_dir, entry["dataset"])
+    os.makedirs(dataset_dir, exist_ok=True)
+    manifest_path = os.path.join(dataset_dir, "manifest.json")
+    manifest = load_manifest(manifest_path)
+
+    for window_start, window_end, complete in get_windows(start, end, freq):
+        record = manifest.get(window_start)
+        partition_path = os.path.join(dataset_dir, window_start)
+        if record and record["complete"] and (record["rows"] == 0 or table_exists(partition_path)):
+            continue
+
+        params = entry["params"].copy()
+        params["start"] = window_start
+        params["end"] = window_end
+        print(f"Fetching {entry['dataset']} from {window_start} to {window_end} ...")
+        with span("window", start=window_start, end=window_end):
+            t0 = time.perf_counter()
+            try:
+                df = client.get_dataset(
+                    dataset=entry["dataset"],
+                    **params
+                )
+            except Exception:
+                record_http(time.perf_counter() - t0, ok=False)
+                raise
+            record_http(time.perf_counter() - t0)
+            if len(df):
+                write_table(df, partition_path)
+        manifest[window_start] = {"end": window_end, "complete": complete, "rows": len(df)}
+        save_manifest(manifest, manifest_path)
+
+    return manifest
+
+
+def combine_partitions(entry, manifest):
+    # Concatenate partitions in window order into the single dataset table
+    # the merge scripts read, holding only one window in memory at a time.
+    # The table has every column of any window (GridStatus adds columns
+    # over time), typed from the windows' schemas, so a column that starts
+    # later or is empty in the first window is kept.
+    dataset_dir = os.path.join(partitions_dir, entry["dataset"])
+    paths = [
+        os.path.join(dataset_dir, window_start)
+        for window_start in sorted(manifest)
+        if manifest[window_start]["rows"] > 0
+    ]
+    with span("combine"):
+        schema = unify_schemas(table_schema(path) for path in paths) if paths else None
+        output_path = write_table_stream((read_table(path) for path in paths), dataset_table(entry), schema=schema)
+    if output_path is None:
+        print(f"No data for {entry['dataset']}")
+        return
+    print(f"Saved to {output_path}")
+
+
+def get_client():
+    # Imported here so the module stays importable without the client
+    from gridstatusio import GridStatusClient
+
+    # Recommended: set GRIDSTATUS_API_KEY as an environment variable instead of hardcoding
+    return GridStatusClient(os.environ.get("GRIDSTATUS_API_KEY", "a40502a0863e463984dae0439b84759e"))
+
+
+def dataset_table(entry):
+    # Combined table the merge scripts read for this dataset
+    return os.path.join(output_dir, entry["filename"])
+
+
+def update_dataset(entry, client=None):
+    # Fetch new windows of one dataset and rebuild its combined table
+    os.makedirs(output_dir, exist_ok=True)
+    with span(f"gridstatus:{entry['dataset']}"):
+        manifest = download_partitions(client or get_client(), entry, start_date, end_date)
+        combine_partitions(entry, manifest)
+
+
+def main():
+    client = get_client()
+    with run("get_gridstatus_data"):
+        for entry in datasets:
+            update_dataset(entry, client)
+
+if __name__ == "__main__":
+    main()
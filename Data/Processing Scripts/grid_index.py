@@ -0,0 +1,154 @@
+import os
+from functools import lru_cache
+
+import numpy as np
+import pandas as pd
+
+from instrumentation import span
+from iso_adapters import ISO_ADAPTERS, gridstatusio_dir
+from storage import data_path, find_table, read_arrays, write_arrays
+from time_index import HOUR_COL, hours_to_datetime
+
+# Grid values held per zone and hour
+GRID_COLS = ['load_forecast', 'regional_percentage', 'load']
+
+
+class GridIndex:
+    # One ISO's grid data as dense (zone, hour) arrays on a global hour
+    # axis: row z, column h holds zones[z] at utc_hour start_hour + h.
+    # present marks the hours that have a grid row, so joining a city's
+    # rows is array indexing instead of a keyed merge. Built once per
+    # grid-data refresh and saved as a directory of .npy arrays plus
+    # meta.json, which worker processes memory-map instead of unpickling.
+    def __init__(self, zones, start_hour, present, values):
+        self.zones = list(zones)
+        self.start_hour = int(start_hour)
+        self.present = present
+        self.values = values
+        self._zone_index = pd.Index(self.zones)
+
+    @property
+    def n_hours(self):
+        return self.present.shape[1]
+
+    @classmethod
+    def from_frame(cls, df_grid):
+        # From long grid data as returned by ISOAdapter.load_grid; if a
+        # (zone, hour) appears twice the last row wins
+        codes, zones = pd.factorize(df_grid['zone'], sort=True)
+        hours = df_grid[HOUR_COL].to_numpy(dtype='int64')
+        start_hour = hours.min() if len(hours) else 0
+        n_hours = int(hours.max() - start_hour + 1) if len(hours) else 0
+        cols = hours - start_hour
+
+        present = np.zeros((len(zones), n_hours), dtype=bool)
+        present[codes, cols] = True
+        values = {}
+        for col in GRID_COLS:
+            values[col] = np.full((len(zones), n_hours), np.nan)
+            values[col][codes, cols] = df_grid[col].to_numpy(dtype='float64')
+        return cls(zones.astype(str), start_hour, present, values)
+
+    def save(self, path):
+        meta = {'zones': self.zones, 'start_hour': self.start_hour}
+        return write_arrays(path, meta, {'present': self.present, **self.values})
+
+    @classmethod
+    def load(cls, path, mmap=False):
+        # mmap maps the arrays read-only instead of reading them, so
+        # processes loading the same index share it through the page cache
+        meta, arrays = read_arrays(path, ['present'] + GRID_COLS, mmap=mmap)
+        present = arrays.pop('present')
+        return cls(meta['zones'], meta['start_hour'], present, arrays)
+
+    def time_range(self):
+        # First and last hour with grid data in any zone
+        hours = np.flatnonzero(self.present.any(axis=0))
+        return tuple(hours_to_datetime(self.start_hour + hours[[0, -1]]))
+
+    def positions(self, zones, hours):
+        # (row, column) of each (zone, utc_hour) pair, and a mask of the
+        # pairs that have grid data
+        zones = pd.Series(zones).astype('category')
+        # -1 for unknown zones; code -1 (missing zone) picks the appended -1
+        lookup = np.append(self._zone_index.get_indexer(zones.cat.categories), -1)
+        rows = lookup[zones.cat.codes.to_numpy()]
+        cols = np.asarray(hours, dtype='int64') - self.start_hour
+        found = (rows >= 0) & (cols >= 0) & (cols < self.n_hours)
+        found[found] = self.present[rows[found], cols[found]]
+        return rows, cols, found
+
+    def join(self, df):
+        # Inner join of df (zone, utc_hour, ...) with the grid values,
+        # keeping df's row order like pd.merge(how='inner')
+        rows, cols, found = self.positions(df['zone'], df[HOUR_COL])
+        df_joined = df[found].reset_index(drop=True)
+        rows, cols = rows[found], cols[found]
+        for col in GRID_COLS:
+            df_joined[col] = self.values[col][rows, cols]
+        return df_joined
+
+    def to_frame(self):
+        # Back to long form: one row per zone and hour with grid data
+        rows, cols = np.nonzero(self.present)
+        df = pd.DataFrame({
+            'zone': np.asarray(self.zones, dtype=object)[rows],
+            HOUR_COL: self.start_hour + cols,
+            'datetime_utc': hours_to_datetime(self.start_hour + cols),
+        })
+        for col in GRID_COLS:
+            df[col] = self.values[col][rows, cols]
+        return df
+
+
+def grid_index_path(adapter):
+    return data_path("GridStatusIO", f"{adapter.name}_grid_index")
+
+
+def grid_sources(adapter):
+    return [find_table(os.path.join(gridstatusio_dir, t)) for t in adapter.grid_tables]
+
+
+def is_stale(adapter):
+    # The index is rebuilt when any grid table was written after it
+    path = grid_index_path(adapter)
+    if not os.path.exists(path):
+        return True
+    built = os.path.getmtime(path)
+    return any(source is not None and os.path.getmtime(source) > built for source in grid_sources(adapter))
+
+
+def build_grid_index(iso_name, cities=None):
+    # Build and save one ISO's grid index from its GridStatusIO tables. The
+    # index holds every zone in the grid data; cities only serve the
+    # adapters' missing-zone warnings.
+    adapter = ISO_ADAPTERS[iso_name]
+    if not adapter.has_grid_data():
+        print(f"{iso_name.upper()} grid data not found.")
+        return None
+    with span(f"grid_index:{iso_name}"):
+        index = GridIndex.from_frame(adapter.load_grid(cities))
+        path = index.save(grid_index_path(adapter))
+    print(f"Saved {iso_name.upper()} grid index to {path}")
+    return path
+
+
+def load_grid_index(iso_name, cities=None, mmap=False):
+    # The saved grid index, rebuilt first if missing or older than the grid tables
+    adapter = ISO_ADAPTERS[iso_name]
+    if is_stale(adapter):
+        build_grid_index(iso_name, cities)
+    return GridIndex.load(grid_index_path(adapter), mmap=mmap)
+
+
+@lru_cache(maxsize=None)
+def _mapped_grid_index(path, mtime_ns):
+    return GridIndex.load(path, mmap=True)
+
+
+def map_grid_index(iso_name):
+    # Memory-mapped grid index for worker processes, mapped once per
+    # process and again only after the index is rebuilt. The caller makes
+    # sure it is up to date (see load_grid_index).
+    path = grid_index_path(ISO_ADAPTERS[iso_name])
+    return _mapped_grid_index(path, os.stat(path).st_mtime_ns)
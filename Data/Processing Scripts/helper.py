@@ -1,25 +1,36 @@
-import openmeteo_requests
-from openmeteo_sdk.Unit import Unit
-from openmeteo_sdk.Variable import Variable
+import numpy as np
 import pandas as pd
 
-import requests
-from datetime import date
+from datetime import date, timedelta
+from concurrent.futures import ThreadPoolExecutor
+from functools import lru_cache
 
-import os
+from http_utils import CachedSession, ResponseCache, call_with_retries, is_retryable
+from instrumentation import bind, run, span
+from schema import DERIVED_COLS
+from storage import data_path, find_table, read_table, table_exists, write_table
+from time_index import parse_utc
 
+@lru_cache(maxsize=None)
+def get_enum_names(enum_cls):
+    # value -> name lookup for an openmeteo_sdk enum class, built once
+    names = {}
+    for name, value in enum_cls.__dict__.items():
+        if not name.startswith("__"):
+            names.setdefault(value, name)
+    return names
+
+
+# openmeteo_sdk and openmeteo_requests are imported where they are used so
+# importing this module stays cheap for code that never fetches
 def get_unit_name(unit_value):
-    for name, value in Unit.__dict__.items():
-        if value == unit_value and not name.startswith("__"):
-            return name
-    return f"unknown({unit_value})"
+    from openmeteo_sdk.Unit import Unit
+    return get_enum_names(Unit).get(unit_value, f"unknown({unit_value})")
 
 
 def get_variable_name(var_value):
-    for name, value in Variable.__dict__.items():
-        if value == var_value and not name.startswith("__"):
-            return name
-    return f"unknown({var_value})"
+    from openmeteo_sdk.Variable import Variable
+    return get_enum_names(Variable).get(var_value, f"unknown({var_value})")
 
 def extract_data_from_api_response(timeseries, cols, timezone = 'America/Los_Angeles'):
     datetime_index = pd.date_range(
@@ -32,92 +43,221 @@ def extract_data_from_api_response(timeseries, cols, timezone = 'America/Los_Ang
     # Convert DatetimeIndex to timezone-aware datetime
     datetime_index = datetime_index.tz_convert(timezone)  # e.g., "America/Los_Angeles"
 
-    # Construct DataFrame from converted index
-    df_dict = {}
-    df_dict["datetime"] = datetime_index
-    df_dict["date"] = datetime_index.date
-    df_dict["time"] = datetime_index.time
-
-    i = 0
-    while True:
-        try: 
-            col_name = cols[i] + "__" + \
-                get_unit_name(timeseries.Variables(i).Unit())
-            df_dict[col_name] = timeseries.Variables(i).ValuesAsNumpy()
-            i+=1
-            continue
-        except:
-            break
-    return pd.DataFrame(data = df_dict)
-
-def get_historical_hourly_data(lat, long, city_timezone, city, state, col_names=None, save_csv=True):
-    if col_names is None:
-        col_names = [
-            "temperature_2m", "dew_point_2m", "rain", "snowfall", "cloud_cover", "wind_speed_10m"
-        ]
-    
-    # Define filenames
-    weather_filename = f"../OpenMeteo/{city}_{state}_hourly_weather.csv"
-    aqi_filename = f"../OpenMeteo/{city}_{state}_hourly_aqi.csv"
-    
-    # Check if files already exist
-    weather_exists = os.path.exists(weather_filename)
-    aqi_exists = os.path.exists(aqi_filename)
-    
-    if weather_exists and aqi_exists:
-        print(f"Loading existing data for {city}, {state} from files...")
-        df_historical_weather = pd.read_csv(weather_filename)
-        df_historical_aqi = pd.read_csv(aqi_filename)
-        print(f"Loaded weather data from: {weather_filename}")
-        print(f"Loaded AQI data from: {aqi_filename}")
-        return df_historical_weather, df_historical_aqi, weather_filename, aqi_filename
-    
-    print(f"Fetching historical hourly weather for {city}, {state} from API...")
-    openmeteo = openmeteo_requests.Client()
-
-    # Historical hourly weather (last 4 years)
-    url = "https://archive-api.open-meteo.com/v1/archive"
+    # Copy every variable once into a single contiguous float32 block; the
+    # DataFrame wraps the block without copying it again. Local date/time
+    # columns are derived on demand (schema.with_local_date_time).
+    n_vars = min(timeseries.VariablesLength(), len(cols))
+    values = np.empty((len(datetime_index), n_vars), dtype="float32")
+    col_names = []
+    for i in range(n_vars):
+        variable = timeseries.Variables(i)
+        col_names.append(cols[i] + "__" + get_unit_name(variable.Unit()))
+        variable_values = variable.ValuesAsNumpy()
+        # Variables without values come back as 0 rather than an array
+        values[:, i] = variable_values if isinstance(variable_values, np.ndarray) else np.nan
+
+    df = pd.DataFrame(values, columns=col_names, copy=False)
+    df.insert(0, "datetime", datetime_index)
+    return df
+
+# Open-Meteo revises the most recent archive days (and leaves the last few
+# empty until they are published), so incremental refreshes re-request this
+# many days before the last non-empty cached hour
+ARCHIVE_REVISION_DAYS = 7
+
+GEOCODING_URL = "https://geocoding-api.open-meteo.com/v1/search"
+WEATHER_URL = "https://archive-api.open-meteo.com/v1/archive"
+AQI_URL = "https://air-quality-api.open-meteo.com/v1/air-quality"
+
+# Archive responses that reach into the revision window are only reused for
+# a few hours; older ranges and geocoding results never change
+RECENT_ARCHIVE_TTL = 6 * 3600
+
+
+def cache_ttl(url, params):
+    end_date = (params or {}).get("end_date")
+    if end_date is None:
+        return None
+    if date.fromisoformat(str(end_date)) >= date.today() - timedelta(days=ARCHIVE_REVISION_DAYS):
+        return RECENT_ARCHIVE_TTL
+    return None
+
+
+@lru_cache(maxsize=None)
+def _response_cache(cache_dir):
+    return ResponseCache(cache_dir, ttl=cache_ttl)
+
+
+def get_response_cache():
+    # Resolved per call so storage.set_data_dir (and cli.py --data-dir)
+    # applies; one cache, and so one eviction lock, per directory
+    return _response_cache(data_path(".http_cache"))
+
+
+def is_retryable_openmeteo(error):
+    # openmeteo_requests wraps every failure in OpenMeteoRequestsError. One
+    # without a cause carries the API's error body (a bad request, e.g. a
+    # coordinate out of range) and fails again on retry; wrapped transport
+    # and server errors are retried as usual.
+    from openmeteo_requests.Client import OpenMeteoRequestsError
+
+    while isinstance(error, OpenMeteoRequestsError) and error.__cause__ is not None:
+        error = error.__cause__
+    return not isinstance(error, OpenMeteoRequestsError) and is_retryable(error)
+
+
+def fetch_hourly_data_batch(url, locations, col_names, start_date, end_date):
+    # Fetch hourly data for several (lat, long, timezone) locations in one
+    # multi-location request. Returns a DataFrame, or the exception raised
+    # for it, per location in input order. If the whole request fails, the
+    # locations are retried one at a time so a bad coordinate only fails
+    # its own city; a rejected request goes there without retrying first.
+    import openmeteo_requests
+
+    openmeteo = openmeteo_requests.Client(session=CachedSession(get_response_cache()))
     params = {
-        "latitude": lat,
-        "longitude": long,
-        "start_date": date(date.today().year - 4, 1, 1),
-        "end_date": date.today(),
+        "latitude": [loc[0] for loc in locations],
+        "longitude": [loc[1] for loc in locations],
+        "start_date": start_date,
+        "end_date": end_date,
         "hourly": col_names,
         "timezone": 'GMT'
     }
-    responses = openmeteo.weather_api(url, params=params)
-    df_historical_weather = extract_data_from_api_response(responses[0].Hourly(), col_names, timezone=city_timezone)
+    try:
+        responses = call_with_retries(url, lambda: openmeteo.weather_api(url, params=params), retryable=is_retryable_openmeteo)
+        if len(responses) != len(locations):
+            raise ValueError(f"Expected {len(locations)} responses, got {len(responses)}")
+    except Exception as e:
+        if len(locations) == 1:
+            return [e]
+        print(f"Batch of {len(locations)} locations failed ({e}), retrying one at a time...")
+        return [
+            fetch_hourly_data_batch(url, [loc], col_names, start_date, end_date)[0]
+            for loc in locations
+        ]
 
-    # AQI (pm2.5, hourly) - last 4 years
-    url = "https://air-quality-api.open-meteo.com/v1/air-quality"
-    aqi_col_names = ["pm2_5"]
-    params = {
-        "latitude": lat,
-        "longitude": long,
-        "hourly": aqi_col_names,
-        "start_date": date(date.today().year - 4, 1, 1),
-        "end_date": date.today(),
-        "timezone": 'GMT'
-    }
-    responses = openmeteo.weather_api(url, params=params)
-    df_historical_aqi = extract_data_from_api_response(responses[0].Hourly(), aqi_col_names, timezone=city_timezone)
+    # responses[i] belongs to locations[i]; convert each to its own timezone
+    results = []
+    for response, (_, _, city_timezone) in zip(responses, locations):
+        try:
+            results.append(extract_data_from_api_response(response.Hourly(), col_names, timezone=city_timezone))
+        except Exception as e:
+            results.append(e)
+    return results
 
-    # Save to CSV files
-    if save_csv:
-        # Ensure Data directory exists
-        os.makedirs("Data", exist_ok=True)
-        
-        df_historical_weather.to_csv(weather_filename, index=False)
-        df_historical_aqi.to_csv(aqi_filename, index=False)
-        print(f"Saved weather data to: {weather_filename}")
-        print(f"Saved AQI data to: {aqi_filename}")
 
-    return df_historical_weather, df_historical_aqi, weather_filename, aqi_filename
+def get_refresh_start_date(df_cached):
+    # First date (UTC) to re-request: ARCHIVE_REVISION_DAYS before the last
+    # hour that has any non-null value, or None if the cache has no data
+    value_cols = [c for c in df_cached.columns if c not in ("datetime", "date", "time")]
+    df_valid = df_cached.dropna(subset=value_cols, how="all")
+    if df_valid.empty:
+        return None
+    last_hour = parse_utc(df_valid["datetime"]).max()
+    return last_hour.date() - timedelta(days=ARCHIVE_REVISION_DAYS)
+
+
+def merge_incremental(df_cached, df_new, city_timezone):
+    # Append newly fetched hours to the cache; overlapping hours take the
+    # freshly fetched (possibly revised) values
+    # Older caches still carry local date/time columns; drop them so old and
+    # new rows share one layout
+    df_cached = df_cached.drop(columns=DERIVED_COLS, errors="ignore")
+    df_cached["datetime"] = parse_utc(df_cached["datetime"]).dt.tz_convert(city_timezone)
+    df = pd.concat([df_cached, df_new], ignore_index=True)
+    df = df.drop_duplicates(subset="datetime", keep="last").sort_values("datetime")
+    return df.reset_index(drop=True)
+
+
+def get_historical_hourly_data_batch(locations, col_names=None, save_csv=True, refresh=False, batch_size=10, max_workers=1):
+    # Weather and AQI for many cities. locations is a list of dicts with
+    # city, state, latitude, longitude and timezone. Cities without a cached
+    # table (or all cities, with refresh=True) are fetched in multi-location
+    # requests of up to batch_size cities, max_workers batches at a time.
+    # Returns, per location, (weather_df, aqi_df, weather_filename,
+    # aqi_filename) or the exception that stopped that city.
+    if col_names is None:
+        col_names = [
+            "temperature_2m", "dew_point_2m", "rain", "snowfall", "cloud_cover", "wind_speed_10m"
+        ]
+    # Full history covers the last 4 years
+    full_start_date = date(date.today().year - 4, 1, 1)
+    end_date = date.today()
+
+    results = [{} for _ in locations]
+    errors = [None] * len(locations)
+    for kind, url, cols in [("weather", WEATHER_URL, col_names), ("aqi", AQI_URL, ["pm2_5"])]:
+        # Table paths (extension depends on the storage format). Cities are
+        # grouped by the start date they need: None for a full fetch, or the
+        # refresh start date for an incremental one.
+        tables = [data_path("OpenMeteo", f"{loc['city']}_{loc['state']}_hourly_{kind}") for loc in locations]
+        pending = {}
+        for i, table in enumerate(tables):
+            df_cached = read_table(table) if table_exists(table) else None
+            if df_cached is not None and not refresh:
+                results[i][kind] = (df_cached, find_table(table))
+                continue
+            start_date = get_refresh_start_date(df_cached) if df_cached is not None else None
+            pending.setdefault(start_date, []).append((i, df_cached))
+
+        jobs = [
+            (start_date, items[k:k + batch_size])
+            for start_date, items in pending.items()
+            for k in range(0, len(items), batch_size)
+        ]
+
+        def run_job(job):
+            start_date, items = job
+            batch = [
+                (locations[i]["latitude"], locations[i]["longitude"], locations[i]["timezone"])
+                for i, _ in items
+            ]
+            cities = [locations[i]["city"] for i, _ in items]
+            print(f"Fetching hourly {kind} for {', '.join(cities)} from API...")
+            with span(f"fetch_{kind}", cities=cities):
+                return fetch_hourly_data_batch(url, batch, cols, start_date or full_start_date, end_date)
+
+        with ThreadPoolExecutor(max_workers=max_workers) as executor:
+            batch_results = list(executor.map(bind(run_job), jobs))
+
+        for (start_date, items), dfs in zip(jobs, batch_results):
+            for (i, df_cached), df in zip(items, dfs):
+                if isinstance(df, Exception):
+                    errors[i] = errors[i] or df
+                    continue
+                # With an existing cache, only the range after the cached
+                # data was requested; merge it in
+                if start_date is not None:
+                    df = merge_incremental(df_cached, df, locations[i]["timezone"])
+                # Save to files (Parquet or CSV, see storage.STORAGE_FORMAT)
+                with span(f"save_{kind}", city=locations[i]["city"]):
+                    filename = write_table(df, tables[i]) if save_csv else find_table(tables[i])
+                results[i][kind] = (df, filename)
+
+    output = []
+    for result, error in zip(results, errors):
+        if error is not None:
+            output.append(error)
+        else:
+            (df_weather, weather_filename), (df_aqi, aqi_filename) = result["weather"], result["aqi"]
+            output.append((df_weather, df_aqi, weather_filename, aqi_filename))
+    return output
+
+def get_historical_hourly_data(lat, long, city_timezone, city, state, col_names=None, save_csv=True, refresh=False):
+    location = {"city": city, "state": state, "latitude": lat, "longitude": long, "timezone": city_timezone}
+    result = get_historical_hourly_data_batch([location], col_names, save_csv=save_csv, refresh=refresh)[0]
+    if isinstance(result, Exception):
+        raise result
+    return result
 
 def get_city_info(city, state):
-    url = f'https://geocoding-api.open-meteo.com/v1/search?name={city}&count=100'
-    response = requests.get(url)
-    data = response.json()
+    url = f'{GEOCODING_URL}?name={city}&count=100'
+    def fetch():
+        response = CachedSession(get_response_cache()).get(url, timeout=30)
+        response.raise_for_status()
+        return response.json()
+
+    data = call_with_retries(url, fetch)
     filtered_data = [item for item in data['results'] if item['country_code'] == 'US' and item['admin1'] == state]
     if not filtered_data:
         raise ValueError(f"No results found for {city}, {state}")
@@ -125,83 +265,105 @@ def get_city_info(city, state):
     return info['latitude'], info['longitude'], info['timezone'], info.get('population', None)
 
 
-def get_city_zone_info():
-    # Define city/state/zone info
-    city_data = [
-        # NEISO
-        {"city": "Portland", "state": "Maine", "zone": ".Z.MAINE"},
-        {"city": "Manchester", "state": "New Hampshire", "zone": ".Z.NEWHAMPSHIRE"},
-        {"city": "Burlington", "state": "Vermont", "zone": ".Z.VERMONT"},
-        {"city": "Providence", "state": "Rhode Island", "zone": ".Z.RHODEISLAND"},
-        {"city": "Bridgeport", "state": "Connecticut", "zone": ".Z.CONNECTICUT"},
-        {"city": "Brockton", "state": "Massachusetts", "zone": ".Z.WCMASS"},
-        {"city": "Springfield", "state": "Massachusetts", "zone": ".Z.SEMASS"},
-        {"city": "Boston", "state": "Massachusetts", "zone": ".Z.NEMASSBOST"},
-        # NYISO
-        {"city": "Buffalo", "state": "New York", "zone": "west"},
-        {"city": "Rochester", "state": "New York", "zone": "genese"},
-        {"city": "Syracuse", "state": "New York", "zone": "centrl"},
-        {"city": "Plattsburgh", "state": "New York", "zone": "north"},
-        {"city": "Utica", "state": "New York", "zone": "mhk_vl"},
-        {"city": "Albany", "state": "New York", "zone": "capitl"},
-        {"city": "Poughkeepsie", "state": "New York", "zone": "hud_vl"},
-        {"city": "White Plains", "state": "New York", "zone": "millwd"},
-        {"city": "Yonkers", "state": "New York", "zone": "dunwod"},
-        {"city": "New York City", "state": "New York", "zone": "nyc"},
-        {"city": "Hempstead", "state": "New York", "zone": "longil"},
-        # CAISO
-        {"city": "San Jose", "state": "California", "zone": None},
-        {"city": "Los Angeles", "state": "California", "zone": None},
-        {"city": "Truckee", "state": "California", "zone": None},
-        {"city": "Fresno", "state": "California", "zone": None},
-        {"city": "Sacramento", "state": "California", "zone": None},
-        {"city": "Redding", "state": "California", "zone": None},
-    ]
-
-    records = []
-    for entry in city_data:
-        try:
-            lat, lon, tz, pop = get_city_info(entry["city"], entry["state"])
-            
-            # Fetch historical weather and AQ data for each city
-            if lat is not None and lon is not None and tz is not None:
-                try:
-                    weather_df, aqi_df, weather_filename, aqi_filename = get_historical_hourly_data(
-                        lat, lon, tz, entry["city"], entry["state"]
-                    )
-                except Exception as e:
-                    print(f"Error fetching weather/AQ data for {entry['city']}, {entry['state']}: {e}")
-                    weather_filename = None
-                    aqi_filename = None
-            else:
-                weather_filename = None
-                aqi_filename = None
-                
-        except Exception as e:
-            print(f"Error getting city info for {entry['city']}, {entry['state']}: {e}")
-            lat, lon, tz, pop = None, None, None, None
+# City/state/zone info
+CITY_DATA = [
+    # NEISO
+    {"city": "Portland", "state": "Maine", "zone": ".Z.MAINE"},
+    {"city": "Manchester", "state": "New Hampshire", "zone": ".Z.NEWHAMPSHIRE"},
+    {"city": "Burlington", "state": "Vermont", "zone": ".Z.VERMONT"},
+    {"city": "Providence", "state": "Rhode Island", "zone": ".Z.RHODEISLAND"},
+    {"city": "Bridgeport", "state": "Connecticut", "zone": ".Z.CONNECTICUT"},
+    {"city": "Brockton", "state": "Massachusetts", "zone": ".Z.WCMASS"},
+    {"city": "Springfield", "state": "Massachusetts", "zone": ".Z.SEMASS"},
+    {"city": "Boston", "state": "Massachusetts", "zone": ".Z.NEMASSBOST"},
+    # NYISO
+    {"city": "Buffalo", "state": "New York", "zone": "west"},
+    {"city": "Rochester", "state": "New York", "zone": "genese"},
+    {"city": "Syracuse", "state": "New York", "zone": "centrl"},
+    {"city": "Plattsburgh", "state": "New York", "zone": "north"},
+    {"city": "Utica", "state": "New York", "zone": "mhk_vl"},
+    {"city": "Albany", "state": "New York", "zone": "capitl"},
+    {"city": "Poughkeepsie", "state": "New York", "zone": "hud_vl"},
+    {"city": "White Plains", "state": "New York", "zone": "millwd"},
+    {"city": "Yonkers", "state": "New York", "zone": "dunwod"},
+    {"city": "New York City", "state": "New York", "zone": "nyc"},
+    {"city": "Hempstead", "state": "New York", "zone": "longil"},
+    # CAISO
+    {"city": "San Jose", "state": "California", "zone": None},
+    {"city": "Los Angeles", "state": "California", "zone": None},
+    {"city": "Truckee", "state": "California", "zone": None},
+    {"city": "Fresno", "state": "California", "zone": None},
+    {"city": "Sacramento", "state": "California", "zone": None},
+    {"city": "Redding", "state": "California", "zone": None},
+]
+
+
+def locate_city(entry):
+    try:
+        with span("geocode", city=entry["city"], state=entry["state"]):
+            return get_city_info(entry["city"], entry["state"])
+    except Exception as e:
+        print(f"Error getting city info for {entry['city']}, {entry['state']}: {e}")
+        return None, None, None, None
+
+
+def get_city_zone_info(max_workers=4, refresh=False, batch_size=10):
+    # Geocode cities concurrently on a bounded thread pool, then fetch
+    # weather/AQI in multi-location batches (batch_size cities per request,
+    # max_workers requests at a time). Requests to each host are rate
+    # limited and retried in http_utils; records keep CITY_DATA order.
+    with span("openmeteo"):
+        with ThreadPoolExecutor(max_workers=max_workers) as executor:
+            city_infos = list(executor.map(bind(locate_city), CITY_DATA))
+
+        located = [
+            i for i, (lat, lon, tz, _) in enumerate(city_infos)
+            if lat is not None and lon is not None and tz is not None
+        ]
+        locations = [
+            {
+                "city": CITY_DATA[i]["city"],
+                "state": CITY_DATA[i]["state"],
+                "latitude": city_infos[i][0],
+                "longitude": city_infos[i][1],
+                "timezone": city_infos[i][2],
+            }
+            for i in located
+        ]
+        fetched = dict(zip(located, get_historical_hourly_data_batch(
+            locations, refresh=refresh, batch_size=batch_size, max_workers=max_workers
+        )))
+
+        records = []
+        for i, entry in enumerate(CITY_DATA):
+            lat, lon, tz, pop = city_infos[i]
             weather_filename = None
             aqi_filename = None
-            
-        records.append({
-            "city": entry["city"],
-            "state": entry["state"],
-            "zone": entry["zone"],
-            "latitude": lat,
-            "longitude": lon,
-            "timezone": tz,
-            "population": pop,
-            "weather_filename": weather_filename,
-            "aqi_filename": aqi_filename
-        })
-
-    df = pd.DataFrame(records)
-    df.to_csv("../city_zone_info.csv", index=False)
-    print("City zone info saved to Data/city_zone_info.csv")
+            result = fetched.get(i)
+            if isinstance(result, Exception):
+                print(f"Error fetching weather/AQ data for {entry['city']}, {entry['state']}: {result}")
+            elif result is not None:
+                weather_filename, aqi_filename = result[2], result[3]
+            records.append({
+                "city": entry["city"],
+                "state": entry["state"],
+                "zone": entry["zone"],
+                "latitude": lat,
+                "longitude": lon,
+                "timezone": tz,
+                "population": pop,
+                "weather_filename": weather_filename,
+                "aqi_filename": aqi_filename
+            })
+
+        df = pd.DataFrame(records)
+        df.to_csv(data_path("city_zone_info.csv"), index=False)
+        print("City zone info saved to Data/city_zone_info.csv")
 
 
 def main():
-    get_city_zone_info()
+    with run("helper"):
+        get_city_zone_info()
 
 if __name__ == "__main__":
     main()
@@ -0,0 +1,206 @@
+import hashlib
+import json
+import os
+import threading
+import time
+from urllib.parse import parse_qsl, urlparse
+
+import requests
+
+from instrumentation import count, record_http
+
+
+class HostRateLimiter:
+    # Spaces out requests to the same host by at least min_interval seconds,
+    # shared across all worker threads
+    def __init__(self, min_interval=0.2):
+        self.min_interval = min_interval
+        self._lock = threading.Lock()
+        self._next_slot = {}
+
+    def wait(self, url):
+        host = urlparse(url).netloc
+        with self._lock:
+            now = time.monotonic()
+            slot = max(now, self._next_slot.get(host, now))
+            self._next_slot[host] = slot + self.min_interval
+        delay = slot - now
+        if delay > 0:
+            time.sleep(delay)
+
+
+# Shared by every Open-Meteo call made from this process
+rate_limiter = HostRateLimiter()
+
+
+# Seconds before the first retry; doubled for each further one
+RETRY_BACKOFF = 1.0
+
+
+def is_retryable(error):
+    # Transport errors, timeouts and 5xx responses are worth retrying; a
+    # 4xx response anywhere in the cause chain is the request's own fault
+    while error is not None:
+        response = getattr(error, "response", None)
+        if response is not None and 400 <= response.status_code < 500:
+            return False
+        error = error.__cause__
+    return True
+
+
+def call_with_retries(url, fn, retries=3, backoff=None, retryable=is_retryable):
+    # Run fn(); on a failure retryable(error) accepts, retry with
+    # exponential backoff (backoff, 2*backoff, ...) and re-raise the last
+    # error once retries are exhausted. Other failures are raised at once.
+    # Rate limiting happens in CachedSession, so cache hits are not delayed.
+    backoff = RETRY_BACKOFF if backoff is None else backoff
+    for attempt in range(retries + 1):
+        try:
+            return fn()
+        except Exception as e:
+            if attempt == retries or not retryable(e):
+                raise
+            count(http_retries=1)
+            delay = backoff * (2 ** attempt)
+            print(f"Request to {urlparse(url).netloc} failed ({e}), retrying in {delay:.1f}s...")
+            time.sleep(delay)
+
+
+class ResponseCache:
+    # On-disk cache of HTTP response bodies keyed by a hash of the endpoint
+    # and normalized query params. ttl(url, params) gives each entry's
+    # lifetime in seconds (None = never expires). Once the cache exceeds
+    # max_bytes, least recently used entries are evicted down to
+    # EVICT_TO * max_bytes. A running total of body sizes (from one
+    # directory scan per process) decides when, so a put costs no scan
+    # until the cache is full.
+    EVICT_TO = 0.9
+
+    def __init__(self, cache_dir, max_bytes=500 * 1024 * 1024, ttl=None):
+        self.cache_dir = cache_dir
+        self.max_bytes = max_bytes
+        self.ttl = ttl or (lambda url, params: None)
+        self._lock = threading.Lock()
+        self._total_bytes = None
+
+    @staticmethod
+    def make_key(url, params=None):
+        # Query params from the URL and from params are merged and sorted so
+        # equivalent requests share an entry
+        parsed = urlparse(url)
+        items = parse_qsl(parsed.query)
+        for name, value in (params or {}).items():
+            values = value if isinstance(value, (list, tuple)) else [value]
+            items.extend((name, str(v)) for v in values)
+        endpoint = f"{parsed.scheme}://{parsed.netloc}{parsed.path}"
+        payload = json.dumps([endpoint, sorted(items)])
+        return hashlib.sha256(payload.encode()).hexdigest()
+
+    def _paths(self, key):
+        return os.path.join(self.cache_dir, key + ".bin"), os.path.join(self.cache_dir, key + ".json")
+
+    def get(self, url, params=None):
+        body_path, meta_path = self._paths(self.make_key(url, params))
+        try:
+            with open(meta_path) as f:
+                meta = json.load(f)
+            if meta["expires"] is not None and meta["expires"] < time.time():
+                return None
+            with open(body_path, "rb") as f:
+                content = f.read()
+            # Touch the entry so eviction sees it as recently used; a
+            # concurrent eviction may have removed it since the read
+            os.utime(body_path)
+        except (OSError, ValueError):
+            return None
+        return content
+
+    def put(self, url, params, content):
+        os.makedirs(self.cache_dir, exist_ok=True)
+        body_path, meta_path = self._paths(self.make_key(url, params))
+        ttl = self.ttl(url, params)
+        meta = {"url": url, "expires": None if ttl is None else time.time() + ttl}
+        replaced_bytes = os.path.getsize(body_path) if os.path.exists(body_path) else 0
+        for path, data, mode in [(body_path, content, "wb"), (meta_path, json.dumps(meta), "w")]:
+            tmp_path = f"{path}.{threading.get_ident()}.tmp"
+            with open(tmp_path, mode) as f:
+                f.write(data)
+            os.replace(tmp_path, path)
+        with self._lock:
+            if self._total_bytes is None:
+                self._total_bytes = sum(size for _, size, _ in self._entries())
+            else:
+                self._total_bytes += len(content) - replaced_bytes
+            full = self._total_bytes > self.max_bytes
+        if full:
+            self.evict()
+
+    def _entries(self):
+        # (mtime, size, key) of every cached body
+        entries = []
+        for name in os.listdir(self.cache_dir):
+            if name.endswith(".bin"):
+                try:
+                    stat = os.stat(os.path.join(self.cache_dir, name))
+                except OSError:
+                    continue
+                entries.append((stat.st_mtime, stat.st_size, name[:-4]))
+        return entries
+
+    def evict(self):
+        # Rescans the directory, so entries written by other processes
+        # count too, and resets the running total
+        with self._lock:
+            entries = self._entries()
+            total = sum(size for _, size, _ in entries)
+            for _, size, key in sorted(entries):
+                if total <= self.EVICT_TO * self.max_bytes:
+                    break
+                for path in self._paths(key):
+                    if os.path.exists(path):
+                        os.remove(path)
+                total -= size
+            self._total_bytes = total
+
+
+class CachedResponse:
+    # Minimal stand-in for a requests.Response served from the cache
+    status_code = 200
+
+    def __init__(self, content):
+        self.content = content
+
+    def json(self):
+        return json.loads(self.content)
+
+    def raise_for_status(self):
+        pass
+
+
+class CachedSession:
+    # Session wrapper that answers GETs from a ResponseCache and only goes to
+    # the network (rate limited per host) on a miss. Works for plain
+    # requests calls and as the session of openmeteo_requests.Client.
+    def __init__(self, cache, session=None):
+        self.cache = cache
+        self.session = session or requests.Session()
+
+    def get(self, url, params=None, **kwargs):
+        content = self.cache.get(url, params)
+        if content is not None:
+            count(http_cache_hits=1)
+            return CachedResponse(content)
+        rate_limiter.wait(url)
+        start = time.perf_counter()
+        try:
+            response = self.session.get(url, params=params, **kwargs)
+        except Exception:
+            record_http(time.perf_counter() - start, ok=False)
+            raise
+        record_http(time.perf_counter() - start, ok=response.status_code == 200)
+        if response.status_code == 200:
+            self.cache.put(url, params, response.content)
+        return response
+
+    def close(self):
+        self.session.close()
@@ -0,0 +1,290 @@
+import contextvars
+import cProfile
+import json
+import os
+import platform
+import resource
+import sys
+import threading
+import time
+from contextlib import contextmanager, nullcontext
+from datetime import datetime, timezone
+
+# Per-span counters; storage and http_utils add to whichever span is open
+COUNTERS = [
+    "rows_in", "rows_out", "bytes_read", "bytes_written",
+    "http_requests", "http_cache_hits", "http_retries", "http_errors", "http_latency_s",
+]
+
+# ENERGY_PROFILE names one span to run under a profiler (e.g.
+# "merge:isone"); ENERGY_PROFILER picks "cprofile" (default) or
+# "pyinstrument" if it is installed. Read at use so the pipeline can set
+# them from its command line.
+def profile_settings():
+    return os.environ.get("ENERGY_PROFILE"), os.environ.get("ENERGY_PROFILER", "cprofile")
+
+
+# Seconds between RSS samples of the open spans
+RSS_SAMPLE_S = 0.02
+
+_current = contextvars.ContextVar("span", default=None)
+_lock = threading.Lock()
+# Spans currently open in this process, sampled by _sample_rss
+_open_spans = set()
+_spans_open = threading.Event()
+_sampler_pid = None
+
+
+class Span:
+    # Timing and counters for one stage or step. A finished span adds its
+    # counters to its parent, so every span covers its children too.
+    def __init__(self, name, labels=None):
+        self.name = name
+        self.labels = labels or {}
+        self.started = datetime.now(timezone.utc).isoformat(timespec="seconds")
+        self.wall_s = None
+        self.peak_rss_mb = None
+        self.process_max_rss_mb = None
+        self.http_max_latency_s = 0.0
+        self.status = "ok"
+        self.error = None
+        self.counters = dict.fromkeys(COUNTERS, 0)
+        self.children = []
+
+    def adopt(self, child):
+        with _lock:
+            self.children.append(child)
+            for key, value in child.counters.items():
+                self.counters[key] += value
+            self.http_max_latency_s = max(self.http_max_latency_s, child.http_max_latency_s)
+            if child.peak_rss_mb is not None:
+                self.peak_rss_mb = max(self.peak_rss_mb or 0, child.peak_rss_mb)
+            if child.process_max_rss_mb is not None:
+                self.process_max_rss_mb = max(self.process_max_rss_mb or 0, child.process_max_rss_mb)
+
+    def observe_rss(self, rss_mb):
+        if rss_mb is not None:
+            self.peak_rss_mb = max(self.peak_rss_mb or 0, rss_mb)
+
+    def to_dict(self):
+        record = {"name": self.name, **({"labels": self.labels} if self.labels else {})}
+        record.update(
+            started=self.started,
+            wall_s=round(self.wall_s, 4) if self.wall_s is not None else None,
+            peak_rss_mb=self.peak_rss_mb,
+            process_max_rss_mb=self.process_max_rss_mb,
+            status=self.status,
+        )
+        if self.error:
+            record["error"] = self.error
+        record.update({k: round(v, 4) if isinstance(v, float) else v for k, v in self.counters.items()})
+        record["http_max_latency_s"] = round(self.http_max_latency_s, 4)
+        if self.children:
+            record["children"] = [child.to_dict() for child in self.children]
+        return record
+
+
+def current_rss_mb():
+    # Resident set size of this process now, from /proc (Linux); None where
+    # that is unavailable
+    try:
+        with open("/proc/self/statm") as f:
+            pages = int(f.read().split()[1])
+    except (OSError, ValueError, IndexError):
+        return None
+    return round(pages * os.sysconf("SC_PAGE_SIZE") / (1024 * 1024), 1)
+
+
+def _sample_rss():
+    # Raise the peak RSS of every open span every RSS_SAMPLE_S while any
+    # span is open
+    while True:
+        _spans_open.wait()
+        time.sleep(RSS_SAMPLE_S)
+        rss = current_rss_mb()
+        with _lock:
+            for open_span in _open_spans:
+                open_span.observe_rss(rss)
+
+
+def _track(open_span):
+    # Start sampling open_span (and the sampler thread, once per process:
+    # threads do not survive a fork into worker processes)
+    global _sampler_pid
+    with _lock:
+        if _sampler_pid != os.getpid():
+            _sampler_pid = os.getpid()
+            threading.Thread(target=_sample_rss, daemon=True).start()
+        _open_spans.add(open_span)
+        _spans_open.set()
+
+
+def _untrack(open_span):
+    with _lock:
+        _open_spans.discard(open_span)
+        if not _open_spans:
+            _spans_open.clear()
+
+
+def process_max_rss_mb():
+    # High-water mark of this process since it started (ru_maxrss is KB on
+    # Linux, bytes on macOS); the same for every span after the largest
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return round(rss / (1024 * 1024 if sys.platform == "darwin" else 1024), 1)
+
+
+@contextmanager
+def profiled(name, profiler_name="cprofile"):
+    # Profile the block into Data/reports; cProfile output loads with
+    # pstats or snakeviz, pyinstrument writes an HTML page
+    from storage import data_path
+    ext = ".html" if profiler_name == "pyinstrument" else ".prof"
+    path = data_path("reports", name.replace(":", "_") + ext)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    if profiler_name == "pyinstrument":
+        from pyinstrument import Profiler
+        profiler = Profiler()
+        profiler.start()
+        try:
+            yield
+        finally:
+            profiler.stop()
+            with open(path, "w") as f:
+                f.write(profiler.output_html())
+    else:
+        profiler = cProfile.Profile()
+        profiler.enable()
+        try:
+            yield
+        finally:
+            profiler.disable()
+            profiler.dump_stats(path)
+    print(f"Saved {name} profile to {path}")
+
+
+@contextmanager
+def span(name, **labels):
+    # Time a block and collect its counters under the enclosing span
+    parent = _current.get()
+    current = Span(name, labels)
+    token = _current.set(current)
+    profile_span, profiler_name = profile_settings()
+    # peak_rss_mb is this span's own peak: RSS sampled while it is open,
+    # plus at its start and end
+    current.observe_rss(current_rss_mb())
+    _track(current)
+    start = time.perf_counter()
+    try:
+        with profiled(name, profiler_name) if name == profile_span else nullcontext():
+            yield current
+    except BaseException as e:
+        current.status = "error"
+        current.error = repr(e)
+        raise
+    finally:
+        current.wall_s = time.perf_counter() - start
+        _untrack(current)
+        current.observe_rss(current_rss_mb())
+        current.process_max_rss_mb = process_max_rss_mb()
+        _current.reset(token)
+        if parent is not None:
+            parent.adopt(current)
+
+
+def count(**amounts):
+    # Add to the counters of the innermost open span (no-op outside spans)
+    current = _current.get()
+    if current is None:
+        return
+    with _lock:
+        for key, value in amounts.items():
+            current.counters[key] += value
+
+
+def record_http(latency_s, ok=True):
+    current = _current.get()
+    if current is None:
+        return
+    count(http_requests=1, http_latency_s=latency_s, http_errors=0 if ok else 1)
+    with _lock:
+        current.http_max_latency_s = max(current.http_max_latency_s, latency_s)
+
+
+def adopt(spans):
+    # Attach spans finished elsewhere (e.g. returned from a worker process)
+    current = _current.get()
+    if current is not None:
+        for child in spans:
+            current.adopt(child)
+
+
+def bind(fn):
+    # fn run in the caller's span, for ThreadPoolExecutor.map/submit (worker
+    # threads otherwise start outside any span)
+    context = contextvars.copy_context()
+    return lambda *args, **kwargs: context.copy().run(fn, *args, **kwargs)
+
+
+@contextmanager
+def collect():
+    # Top-level spans finished inside the block, detached from any caller
+    root = Span("collect")
+    token = _current.set(root)
+    try:
+        yield root.children
+    finally:
+        _current.reset(token)
+
+
+def path_bytes(path):
+    # Size on disk of a file or a partitioned table directory
+    if not os.path.isdir(path):
+        return os.path.getsize(path)
+    return sum(
+        os.path.getsize(os.path.join(root, name))
+        for root, _, files in os.walk(path)
+        for name in files
+    )
+
+
+def write_report(root, name):
+    from storage import data_path
+    # Microseconds and the pid keep runs started in the same second (e.g.
+    # stage worker processes) from overwriting each other's reports
+    path = data_path("reports", f"{name}_{datetime.now().strftime('%Y%m%dT%H%M%S%f')}_{os.getpid()}.json")
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    report = {
+        "run": name,
+        "python": platform.python_version(),
+        "argv": sys.argv,
+        "profile": profile_settings()[0],
+        "stages": root.to_dict(),
+    }
+    with open(path, "w") as f:
+        json.dump(report, f, indent=2)
+    print(f"Saved run report to {path}")
+    return path
+
+
+@contextmanager
+def run(name):
+    # Top-level span for a script or pipeline run; the JSON report is
+    # written under Data/reports even if the run fails
+    root = None
+    try:
+        with span(name) as root:
+            yield root
+    finally:
+        if root is not None:
+            write_report(root, name)
+
+
+def call_collected(fn, *args):
+    # Run fn(*args) and return (result, spans, error) so spans recorded in a
+    # worker process or thread can be adopted by the caller's span; the
+    # error (if any) is returned instead of raised so its spans survive
+    with collect() as spans:
+        try:
+            return fn(*args), spans, None
+        except Exception as e:
+            return None, spans, e
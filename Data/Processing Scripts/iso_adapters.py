@@ -0,0 +1,201 @@
+import os
+import pandas as pd
+from carbon_intensity import CAISO_FUEL_COLS, ISONE_FUEL_COLS, NYISO_FUEL_COLS
+from storage import data_path, read_table, table_exists
+from time_index import HOUR_COL, add_hour_key, hour_starts, parse_utc
+
+gridstatusio_dir = data_path("GridStatusIO")
+
+# NYISO reports one column per load zone
+NYISO_ZONE_COLS = ['west', 'genese', 'centrl', 'north', 'mhk_vl', 'capitl', 'hud_vl', 'millwd', 'dunwod', 'nyc', 'longil']
+
+# caiso_standardized_hourly is system-wide, so every CAISO city maps to one zone
+CAISO_ZONE = 'caiso'
+
+
+def time_filters(col, start=None, end=None):
+    # read_table filters selecting start <= col < end (either bound optional)
+    filters = []
+    if start is not None:
+        filters.append((col, '>=', pd.Timestamp(start)))
+    if end is not None:
+        filters.append((col, '<', pd.Timestamp(end)))
+    return filters or None
+
+
+def read_grid_table(name, start=None, end=None, columns=None):
+    # Read a GridStatusIO table with interval_start_utc parsed as UTC and
+    # its hour key assigned, optionally only the rows with
+    # start <= interval_start_utc < end. Sub-hourly tables keep only their
+    # on-the-hour rows (see hour_starts).
+    filters = time_filters('interval_start_utc', start, end)
+    df = read_table(os.path.join(gridstatusio_dir, name), columns=columns, filters=filters)
+    if 'interval_start_utc' not in df.columns and 'datetime_utc' in df.columns:
+        df['interval_start_utc'] = df['datetime_utc']
+    if 'interval_start_utc' not in df.columns:
+        raise ValueError(f"No interval_start_utc in {name}")
+    df['interval_start_utc'] = parse_utc(df['interval_start_utc'])
+    return add_hour_key(hour_starts(df, 'interval_start_utc'), 'interval_start_utc')
+
+
+def first_present(df, candidates):
+    for col in candidates:
+        if col in df.columns:
+            return col
+    raise ValueError(f"None of {candidates} found in columns")
+
+
+class ISOAdapter:
+    # One ISO's view of the pipeline. Subclasses say which cities belong to
+    # the ISO and how to turn its GridStatusIO tables into long grid data:
+    # one row per (zone, utc_hour) with datetime_utc, load_forecast,
+    # regional_percentage and load.
+    name = None
+    grid_tables = []
+    fuel_mix_table = None
+    fuel_cols = []
+    # Local time of the ISO's load patterns (hour of week, calendar days)
+    timezone = 'UTC'
+
+    @property
+    def merged_table(self):
+        return data_path("Merged", f"merged_{self.name}_causal")
+
+    @property
+    def agg_table(self):
+        return data_path("Merged", f"iso_level_{self.name}_agg")
+
+    @property
+    def features_table(self):
+        return data_path("Merged", f"aqi_features_{self.name}")
+
+    @property
+    def events_table(self):
+        return data_path("Merged", f"aqi_events_{self.name}")
+
+    @property
+    def anomaly_table(self):
+        return data_path("Merged", f"load_anomalies_{self.name}")
+
+    @property
+    def emissions_table(self):
+        return data_path("Merged", f"marginal_emissions_{self.name}")
+
+    def has_grid_data(self):
+        return all(table_exists(os.path.join(gridstatusio_dir, t)) for t in self.grid_tables)
+
+    def time_range(self):
+        # First and last hour of grid data, reading only the time column
+        df = read_grid_table(self.grid_tables[0], columns=['interval_start_utc'])
+        return df['interval_start_utc'].min(), df['interval_start_utc'].max()
+
+    def select_cities(self, city_zone_df):
+        # Rows of city_zone_df in this ISO, with their zone filled in
+        raise NotImplementedError
+
+    def load_grid(self, cities=None, start=None, end=None):
+        # start/end limit the rows read to start <= datetime_utc < end;
+        # cities (optional) are checked against the zones found
+        raise NotImplementedError
+
+    def load_fuel_mix(self, start=None, end=None):
+        # Fuel-mix MW per hour, with columns named as in fuel_cols
+        return read_grid_table(self.fuel_mix_table, start, end)
+
+
+class ISONEAdapter(ISOAdapter):
+    name = 'isone'
+    grid_tables = ['isone_reliability_region_load_forecast', 'isone_zonal_load_real_time_hourly']
+    fuel_mix_table = 'isone_fuel_mix'
+    fuel_cols = ISONE_FUEL_COLS
+    timezone = 'America/New_York'
+
+    def select_cities(self, city_zone_df):
+        return city_zone_df[city_zone_df['zone'].notna() & city_zone_df['zone'].astype(str).str.startswith('.Z')]
+
+    def load_grid(self, cities=None, start=None, end=None):
+        # ISONE grid data is already long (one row per location and hour)
+        rename = {'interval_start_utc': 'datetime_utc', 'location': 'zone'}
+        df_forecast = read_grid_table('isone_reliability_region_load_forecast', start, end).rename(columns=rename)
+        df_zonal = read_grid_table('isone_zonal_load_real_time_hourly', start, end).rename(columns=rename)
+        return pd.merge(
+            df_forecast[['zone', HOUR_COL, 'datetime_utc', 'load_forecast', 'regional_percentage']],
+            df_zonal[['zone', HOUR_COL, 'load']],
+            on=['zone', HOUR_COL],
+            how='inner'
+        )
+
+
+class NYISOAdapter(ISOAdapter):
+    name = 'nyiso'
+    grid_tables = ['nyiso_zonal_load_forecast_hourly', 'nyiso_load']
+    fuel_mix_table = 'nyiso_fuel_mix'
+    fuel_cols = NYISO_FUEL_COLS
+    timezone = 'America/New_York'
+
+    def select_cities(self, city_zone_df):
+        return city_zone_df[city_zone_df['zone'].notna() & ~city_zone_df['zone'].astype(str).str.startswith('.Z')]
+
+    def load_grid(self, cities=None, start=None, end=None):
+        # NYISO grid data has one column per zone; melt both frames to long
+        # form once. Regional percentage is each zone's share of the summed
+        # forecast, computed once for all zones.
+        df_forecast = read_grid_table('nyiso_zonal_load_forecast_hourly', start, end)
+        df_load = read_grid_table('nyiso_load', start, end)
+        for zone in [] if cities is None else cities['zone']:
+            if zone not in df_forecast.columns or zone not in df_load.columns:
+                print(f"Zone {zone} not found in NYISO grid data columns.")
+
+        df_share = df_forecast[NYISO_ZONE_COLS].div(df_forecast[NYISO_ZONE_COLS].sum(axis=1), axis=0)
+        df_share[HOUR_COL] = df_forecast[HOUR_COL]
+
+        def melt(df, value_name, id_cols=(HOUR_COL,)):
+            zone_cols = [c for c in NYISO_ZONE_COLS if c in df.columns]
+            return df[list(id_cols) + zone_cols].melt(
+                id_vars=list(id_cols),
+                var_name='zone',
+                value_name=value_name
+            )
+
+        df_grid = pd.merge(
+            melt(df_forecast, 'load_forecast', (HOUR_COL, 'interval_start_utc')),
+            melt(df_share, 'regional_percentage'),
+            on=['zone', HOUR_COL]
+        ).rename(columns={'interval_start_utc': 'datetime_utc'})
+        return pd.merge(df_grid, melt(df_load, 'load'), on=['zone', HOUR_COL], how='inner')
+
+
+class CAISOAdapter(ISOAdapter):
+    name = 'caiso'
+    grid_tables = ['caiso_standardized_hourly']
+    # Standardized hourly data carries the fuel mix as fuel_mix.<fuel> columns
+    fuel_mix_table = 'caiso_standardized_hourly'
+    fuel_cols = CAISO_FUEL_COLS
+    timezone = 'America/Los_Angeles'
+    load_cols = ['load.load', 'load']
+    forecast_cols = ['load_forecast.load_forecast', 'load_forecast']
+
+    def select_cities(self, city_zone_df):
+        cities = city_zone_df[city_zone_df['state'] == 'California']
+        return cities.assign(zone=CAISO_ZONE)
+
+    def load_grid(self, cities=None, start=None, end=None):
+        df = read_grid_table('caiso_standardized_hourly', start, end)
+        df_grid = pd.DataFrame({
+            'zone': CAISO_ZONE,
+            HOUR_COL: df[HOUR_COL],
+            'datetime_utc': df['interval_start_utc'],
+            'load_forecast': df[first_present(df, self.forecast_cols)],
+            'regional_percentage': 1.0,
+            'load': df[first_present(df, self.load_cols)],
+        })
+        return df_grid
+
+    def load_fuel_mix(self, start=None, end=None):
+        df = read_grid_table(self.fuel_mix_table, start, end)
+        fuel_mix_cols = [c for c in df.columns if c.startswith('fuel_mix.')]
+        df = df[['interval_start_utc', HOUR_COL] + fuel_mix_cols]
+        return df.rename(columns=lambda c: c.removeprefix('fuel_mix.'))
+
+
+ISO_ADAPTERS = {adapter.name: adapter for adapter in [ISONEAdapter(), NYISOAdapter(), CAISOAdapter()]}
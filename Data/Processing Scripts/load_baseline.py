@@ -0,0 +1,247 @@
+import glob
+import hashlib
+import json
+import os
+
+import numpy as np
+import pandas as pd
+
+from instrumentation import run, span
+from iso_adapters import ISO_ADAPTERS
+from storage import data_path, file_digest, path_stamp, read_table, remove_path, table_exists, write_table
+from time_index import HOUR_COL, add_hour_key, hours_to_datetime
+
+TEMP_COL = "temperature_2m__celsius"
+
+# Expected load is the mean load of a zone's clean hours with the same
+# local hour of week and temperature bin. Cells with fewer hours than
+# MIN_HOURS get no baseline (NaN anomaly).
+HOURS_PER_WEEK = 7 * 24
+TEMP_BIN_WIDTH = 2.0
+MIN_HOURS = 3
+
+class ZoneHours:
+    # The zone-level series behind a merged frame on dense (zone, hour)
+    # arrays: zone load (the same on every city row of the zone), the mean
+    # temperature of the zone's cities, local hour of week and whether the
+    # hour falls on a local day with a bad-air event in any of the zone's
+    # cities. rows/cols place each merged row on the grid.
+    def __init__(self, df_merged, timezone, df_features=None):
+        df_merged = add_hour_key(df_merged, "datetime_utc")
+        codes, zones = pd.factorize(df_merged["zone"], sort=True)
+        hours = df_merged[HOUR_COL].to_numpy(dtype="int64")
+        self.zones = [str(zone) for zone in zones]
+        self.start_hour = int(hours.min())
+        self.n_hours = int(hours.max()) - self.start_hour + 1
+        self.rows, self.cols = codes, hours - self.start_hour
+        shape = (len(self.zones), self.n_hours)
+        flat = self.rows * self.n_hours + self.cols
+
+        self.load = np.full(shape, np.nan)
+        self.load[self.rows, self.cols] = df_merged["load"].to_numpy(dtype="float64")
+        temp = df_merged[TEMP_COL].to_numpy(dtype="float64")
+        valid = ~np.isnan(temp)
+        temp_sum = np.bincount(flat[valid], weights=temp[valid], minlength=self.load.size)
+        temp_count = np.bincount(flat[valid], minlength=self.load.size)
+        with np.errstate(invalid="ignore"):
+            self.temp = (temp_sum / temp_count).reshape(shape)
+
+        local = hours_to_datetime(self.start_hour + np.arange(self.n_hours)).tz_convert(timezone)
+        self.hour_of_week = (local.dayofweek * 24 + local.hour).to_numpy()
+        days = local.tz_localize(None).to_numpy().astype("datetime64[D]").astype("int64")
+        self.day = days - days.min()
+        self.excluded = self.bad_air_days(df_features) if df_features is not None else np.zeros(shape, dtype=bool)
+
+    def bad_air_days(self, df_features):
+        # Every hour of a local day on which any city of the zone was in a
+        # bad-air event (aqi_features' aqi_event)
+        df_features = add_hour_key(df_features, "datetime_utc")
+        bad = df_features["aqi_event"].to_numpy(dtype=bool)
+        rows = pd.Index(self.zones).get_indexer(df_features["zone"].astype(str))
+        cols = df_features[HOUR_COL].to_numpy(dtype="int64") - self.start_hour
+        keep = bad & (rows >= 0) & (cols >= 0) & (cols < self.n_hours)
+        n_days = int(self.day.max()) + 1
+        bad_days = np.bincount(rows[keep] * n_days + self.day[cols[keep]], minlength=len(self.zones) * n_days) > 0
+        return bad_days.reshape(len(self.zones), n_days)[:, self.day]
+
+    def temp_bins(self):
+        return np.floor(self.temp / TEMP_BIN_WIDTH)
+
+
+class LoadBaseline:
+    # Expected load per (zone, hour of week, temperature bin), as dense
+    # arrays so looking up every hour of every zone is one gather. Bins
+    # are floor(temperature / TEMP_BIN_WIDTH), offset by first_bin.
+    def __init__(self, zones, first_bin, n_hours, expected, std):
+        self.zones = list(zones)
+        self.first_bin = int(first_bin)
+        self.n_hours = n_hours
+        self.expected = expected
+        self.std = std
+
+    @classmethod
+    def fit(cls, zone_hours):
+        # One sort-based grouped pass over the clean zone hours: sort by
+        # the combined (zone, hour of week, bin) key and reduce each run of
+        # equal keys, for every zone at once
+        bins = zone_hours.temp_bins()
+        hour_of_week = np.broadcast_to(zone_hours.hour_of_week, bins.shape)
+        clean = ~np.isnan(zone_hours.load) & ~np.isnan(bins) & ~zone_hours.excluded
+        rows, cols = np.nonzero(clean)
+        bins = bins[rows, cols].astype("int64")
+        first_bin = int(bins.min()) if len(bins) else 0
+        n_bins = int(bins.max()) - first_bin + 1 if len(bins) else 1
+        shape = (len(zone_hours.zones), HOURS_PER_WEEK, n_bins)
+
+        keys = np.ravel_multi_index((rows, hour_of_week[rows, cols], bins - first_bin), shape)
+        order = np.argsort(keys, kind="stable")
+        keys = keys[order]
+        load = zone_hours.load[rows, cols][order]
+        # keys are >= 0, so prepending -1 starts a group at the first key
+        starts = np.flatnonzero(np.diff(keys, prepend=-1))
+        count = np.diff(np.r_[starts, len(keys)])
+        total = np.add.reduceat(load, starts)
+        squares = np.add.reduceat(load * load, starts)
+        with np.errstate(invalid="ignore", divide="ignore"):
+            mean = total / count
+            var = (squares - count * mean * mean) / (count - 1)
+
+        n_hours = np.zeros(shape, dtype="int64")
+        expected = np.full(shape, np.nan)
+        std = np.full(shape, np.nan)
+        cells = keys[starts]
+        enough = count >= MIN_HOURS
+        n_hours.flat[cells] = count
+        expected.flat[cells[enough]] = mean[enough]
+        std.flat[cells[enough]] = np.sqrt(np.maximum(var[enough], 0))
+        return cls(zone_hours.zones, first_bin, n_hours, expected, std)
+
+    def lookup(self, zone_hours):
+        # (expected load, std) for every (zone, hour) of zone_hours, NaN
+        # where the zone, its temperature bin or its cell has no baseline
+        rows = pd.Index(self.zones).get_indexer(zone_hours.zones)
+        bins = zone_hours.temp_bins() - self.first_bin
+        n_bins = self.expected.shape[2]
+        found = (rows[:, None] >= 0) & ~np.isnan(bins) & (bins >= 0) & (bins < n_bins)
+        expected = np.full(bins.shape, np.nan)
+        std = np.full(bins.shape, np.nan)
+        r, c = np.nonzero(found)
+        cell = (rows[r], zone_hours.hour_of_week[c], bins[r, c].astype("int64"))
+        expected[r, c] = self.expected[cell]
+        std[r, c] = self.std[cell]
+        return expected, std
+
+    def to_frame(self):
+        zone, hour_of_week, temp_bin = np.nonzero(self.n_hours)
+        return pd.DataFrame({
+            "zone": np.asarray(self.zones, dtype=object)[zone],
+            "hour_of_week": hour_of_week,
+            "temp_bin": (temp_bin + self.first_bin) * TEMP_BIN_WIDTH,
+            "n_hours": self.n_hours[zone, hour_of_week, temp_bin],
+            "expected_load": self.expected[zone, hour_of_week, temp_bin],
+            "load_std": self.std[zone, hour_of_week, temp_bin],
+        })
+
+    @classmethod
+    def from_frame(cls, df):
+        # temp_bin holds each bin's lower edge in degrees C
+        codes, zones = pd.factorize(df["zone"].astype(str), sort=True)
+        bins = np.round(df["temp_bin"].to_numpy() / TEMP_BIN_WIDTH).astype("int64")
+        first_bin = int(bins.min()) if len(bins) else 0
+        shape = (len(zones), HOURS_PER_WEEK, int(bins.max()) - first_bin + 1 if len(bins) else 1)
+        cell = (codes, df["hour_of_week"].to_numpy(dtype="int64"), bins - first_bin)
+        n_hours = np.zeros(shape, dtype="int64")
+        expected = np.full(shape, np.nan)
+        std = np.full(shape, np.nan)
+        n_hours[cell] = df["n_hours"].to_numpy()
+        expected[cell] = df["expected_load"].to_numpy()
+        std[cell] = df["load_std"].to_numpy()
+        return cls(zones, first_bin, n_hours, expected, std)
+
+
+def add_load_anomalies(df_merged, baseline, zone_hours):
+    # df_merged with its zone's expected load, the anomaly (load minus
+    # expected) and the anomaly in standard deviations of its cell
+    expected, std = baseline.lookup(zone_hours)
+    anomaly = zone_hours.load - expected
+    with np.errstate(invalid="ignore", divide="ignore"):
+        z = np.where(std > 0, anomaly / std, np.nan)
+    rows, cols = zone_hours.rows, zone_hours.cols
+    return df_merged.assign(expected_load=expected[rows, cols], load_anomaly=anomaly[rows, cols], load_anomaly_z=z[rows, cols])
+
+
+def input_fingerprint(adapter):
+    # Hash of everything a baseline depends on: the settings above, this
+    # module's source and the merged and AQI feature tables. The tables are
+    # stamped by file size and mtime (as grid_index.is_stale does) rather
+    # than hashed, so a cache lookup does not read every byte of both.
+    h = hashlib.sha256()
+    h.update(json.dumps([adapter.timezone, TEMP_COL, TEMP_BIN_WIDTH, MIN_HOURS]).encode())
+    h.update(file_digest(os.path.abspath(__file__)).encode())
+    for path in [adapter.merged_table, adapter.features_table]:
+        h.update(path_stamp(path).encode())
+    return h.hexdigest()[:16]
+
+
+def baseline_path(iso_name, fingerprint):
+    return data_path("Merged", "load_baselines", f"{iso_name}_{fingerprint}")
+
+
+def read_inputs(adapter):
+    df_merged = read_table(adapter.merged_table)
+    df_features = None
+    if table_exists(adapter.features_table):
+        df_features = read_table(adapter.features_table, columns=["zone", "datetime_utc", HOUR_COL, "aqi_event"])
+    return df_merged, df_features
+
+
+def load_baseline(iso_name, zone_hours=None):
+    # One ISO's baseline, read from the cache when its inputs are unchanged
+    # and fitted (and cached, replacing older entries) otherwise
+    adapter = ISO_ADAPTERS[iso_name]
+    path = baseline_path(iso_name, input_fingerprint(adapter))
+    if table_exists(path):
+        return LoadBaseline.from_frame(read_table(path))
+
+    if zone_hours is None:
+        df_merged, df_features = read_inputs(adapter)
+        zone_hours = ZoneHours(df_merged, adapter.timezone, df_features)
+    with span("fit"):
+        baseline = LoadBaseline.fit(zone_hours)
+    # The new entry is in place before older ones (files or partitioned
+    # directories) are removed
+    written = write_table(baseline.to_frame(), path)
+    for old in glob.glob(baseline_path(iso_name, "*")):
+        if os.path.abspath(old) != os.path.abspath(written) and not old.endswith(".tmp"):
+            remove_path(old)
+    return baseline
+
+
+def compute_load_anomalies(iso_name):
+    # Load anomalies for every row of one ISO's merged table, written next to it
+    adapter = ISO_ADAPTERS[iso_name]
+    if not table_exists(adapter.merged_table):
+        print(f"No merged {iso_name.upper()} data, skipping.")
+        return None
+
+    with span(f"load_baseline:{iso_name}"):
+        with span("read"):
+            df_merged, df_features = read_inputs(adapter)
+            zone_hours = ZoneHours(df_merged, adapter.timezone, df_features)
+        baseline = load_baseline(iso_name, zone_hours)
+        with span("join"):
+            df_anomalies = add_load_anomalies(df_merged[["city", "state", "zone", "datetime_utc", HOUR_COL, "load"]], baseline, zone_hours)
+        with span("write"):
+            output_path = write_table(df_anomalies, adapter.anomaly_table, partition_cols=["zone"], partition_by_year=True)
+    print(f"Saved {iso_name.upper()} load anomalies to {output_path}")
+    return output_path
+
+
+def main():
+    with run("load_baseline"):
+        for iso_name in ISO_ADAPTERS:
+            compute_load_anomalies(iso_name)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,182 @@
+import os
+
+import numpy as np
+import pandas as pd
+
+from carbon_intensity import intensity_vector
+from grid_index import load_grid_index
+from instrumentation import run, span
+from iso_adapters import ISO_ADAPTERS, gridstatusio_dir
+from storage import data_path, find_table, read_arrays, table_exists, write_arrays, write_table
+from time_index import HOUR_COL, hours_to_datetime
+
+# Marginal emissions are the slope of a least-squares fit of the
+# hour-to-hour change in emissions on the change in ISO load over the
+# trailing WINDOW_HOURS. A window needs MIN_WINDOW_PAIRS consecutive-hour
+# pairs, else it is NaN.
+WINDOW_HOURS = 30 * 24
+MIN_WINDOW_PAIRS = WINDOW_HOURS // 2
+
+
+class FuelMix:
+    # One ISO's fuel mix as a dense (hour, fuel) MW array on the global hour
+    # axis: row h holds utc_hour start_hour + h, present marks the hours
+    # the table has. Cached as .npy arrays next to the fuel-mix table so
+    # reruns map the arrays instead of reparsing the history.
+    def __init__(self, fuel_cols, start_hour, present, mw):
+        self.fuel_cols = list(fuel_cols)
+        self.start_hour = int(start_hour)
+        self.present = present
+        self.mw = mw
+
+    @classmethod
+    def from_frame(cls, df_fuel, fuel_cols):
+        # From ISOAdapter.load_fuel_mix output; missing fuels count as 0 MW
+        hours = df_fuel[HOUR_COL].to_numpy(dtype="int64")
+        start_hour = hours.min() if len(hours) else 0
+        n_hours = int(hours.max() - start_hour + 1) if len(hours) else 0
+        present = np.zeros(n_hours, dtype=bool)
+        present[hours - start_hour] = True
+        mw = np.full((n_hours, len(fuel_cols)), np.nan)
+        mw[hours - start_hour] = df_fuel.reindex(columns=fuel_cols, fill_value=0).to_numpy(dtype="float64")
+        return cls(fuel_cols, start_hour, present, mw)
+
+    def save(self, path):
+        meta = {"fuel_cols": self.fuel_cols, "start_hour": self.start_hour}
+        return write_arrays(path, meta, {"present": self.present, "mw": self.mw})
+
+    @classmethod
+    def load(cls, path, mmap=True):
+        meta, arrays = read_arrays(path, ["present", "mw"], mmap=mmap)
+        return cls(meta["fuel_cols"], meta["start_hour"], arrays["present"], arrays["mw"])
+
+    def emissions(self):
+        # kg CO2 eq per hour: MW times g/kWh is kg/h
+        return self.mw @ intensity_vector(self.fuel_cols)
+
+
+def fuel_mix_path(adapter):
+    return data_path("GridStatusIO", f"{adapter.name}_fuel_mix_arrays")
+
+
+def load_fuel_mix_arrays(iso_name):
+    # The cached fuel mix, rebuilt first if missing, older than the table or
+    # cached for other fuel columns than the adapter's. Intensities are not
+    # cached; emissions() applies the current ones.
+    adapter = ISO_ADAPTERS[iso_name]
+    path = fuel_mix_path(adapter)
+    source = find_table(os.path.join(gridstatusio_dir, adapter.fuel_mix_table))
+    if os.path.exists(path) and os.path.getmtime(source) <= os.path.getmtime(path):
+        fuel_mix = FuelMix.load(path)
+        if fuel_mix.fuel_cols == list(adapter.fuel_cols):
+            return fuel_mix
+    with span("cache_fuel_mix"):
+        FuelMix.from_frame(adapter.load_fuel_mix(), adapter.fuel_cols).save(path)
+    return FuelMix.load(path)
+
+
+def iso_load(grid_index):
+    # System load per hour of the grid index: the sum of its zones, NaN
+    # unless every zone reported
+    load = np.where(grid_index.present, grid_index.values["load"], 0.0).sum(axis=0)
+    return np.where(grid_index.present.all(axis=0), load, np.nan)
+
+
+def on_hours(values, start_hour, first, n_hours):
+    # values (on an axis starting at start_hour) placed on the n_hours
+    # axis starting at first, NaN outside their range
+    out = np.full((n_hours,) + values.shape[1:], np.nan)
+    lo = max(start_hour, first)
+    hi = min(start_hour + len(values), first + n_hours)
+    if hi > lo:
+        out[lo - first:hi - first] = values[lo - start_hour:hi - start_hour]
+    return out
+
+
+def rolling_least_squares(X, y, window, min_rows):
+    # Coefficients of y ~ X fitted over every trailing window of `window`
+    # rows at once: running sums of X'X and X'y turn each window's normal
+    # equations into a difference of two cumulative sums, and all windows
+    # are solved as one batch. Rows with NaN drop out; windows with fewer
+    # than min_rows rows (or a singular X'X) are NaN. Returns (n, k).
+    valid = ~np.isnan(y) & ~np.isnan(X).any(axis=1)
+    X = np.where(valid[:, None], X, 0.0)
+    y = np.where(valid, y, 0.0)
+    n, k = X.shape
+
+    xtx = np.zeros((n + 1, k, k))
+    xty = np.zeros((n + 1, k))
+    rows = np.zeros(n + 1)
+    np.cumsum(X[:, :, None] * X[:, None, :], axis=0, out=xtx[1:])
+    np.cumsum(X * y[:, None], axis=0, out=xty[1:])
+    np.cumsum(valid, out=rows[1:])
+
+    lagged = np.maximum(np.arange(1, n + 1) - window, 0)
+    a = xtx[1:] - xtx[lagged]
+    b = xty[1:] - xty[lagged]
+    count = rows[1:] - rows[lagged]
+
+    # A determinant tiny next to the entries' scale means X'X is singular
+    # (e.g. load did not change within the window)
+    scale = np.abs(a).max(axis=(1, 2)) ** k
+    solvable = (count >= min_rows) & (np.abs(np.linalg.det(a)) > 1e-9 * scale)
+    coef = np.full((n, k), np.nan)
+    if solvable.any():
+        coef[solvable] = np.linalg.solve(a[solvable], b[solvable][:, :, None])[:, :, 0]
+    return coef
+
+
+def marginal_emissions(load, emissions, window=WINDOW_HOURS, min_pairs=MIN_WINDOW_PAIRS):
+    # Per-hour marginal emissions (kg/MWh, i.e. g/kWh) from hourly system
+    # load (MW) and emissions (kg/h) on the same hour axis. Changes are taken
+    # between consecutive hours only, so gaps never pair distant hours.
+    d_load = np.r_[np.nan, np.diff(load)]
+    d_emissions = np.r_[np.nan, np.diff(emissions)]
+    X = np.column_stack([np.ones_like(d_load), d_load])
+    return rolling_least_squares(X, d_emissions, window, min_pairs)[:, 1]
+
+
+def compute_marginal_emissions(iso_name):
+    # Hourly load, emissions, average and marginal emissions for one ISO
+    adapter = ISO_ADAPTERS[iso_name]
+    if not (adapter.has_grid_data() and table_exists(os.path.join(gridstatusio_dir, adapter.fuel_mix_table))):
+        print(f"{iso_name.upper()} grid or fuel-mix data not found.")
+        return None
+
+    with span(f"emissions:{iso_name}"):
+        with span("read"):
+            grid_index = load_grid_index(iso_name)
+            fuel_mix = load_fuel_mix_arrays(iso_name)
+        with span("fit"):
+            first = grid_index.start_hour
+            n_hours = grid_index.n_hours
+            load = iso_load(grid_index)
+            emissions = on_hours(fuel_mix.emissions(), fuel_mix.start_hour, first, n_hours)
+            generation = on_hours(fuel_mix.mw.sum(axis=1), fuel_mix.start_hour, first, n_hours)
+            marginal = marginal_emissions(load, emissions)
+            with np.errstate(divide="ignore", invalid="ignore"):
+                average = np.where(generation > 0, emissions / generation, np.nan)
+            hours = first + np.flatnonzero(~np.isnan(load) & ~np.isnan(emissions))
+            rows = hours - first
+            df = pd.DataFrame({
+                "datetime_utc": hours_to_datetime(hours),
+                HOUR_COL: hours,
+                "load": load[rows],
+                "emissions__kgco2eq_per_hour": emissions[rows],
+                "carbon_intensity__gco2eq_per_kwh": average[rows],
+                "marginal_emissions__gco2eq_per_kwh": marginal[rows],
+            })
+        with span("write"):
+            output_path = write_table(df, adapter.emissions_table, partition_by_year=True)
+    print(f"Saved {iso_name.upper()} marginal emissions to {output_path}")
+    return output_path
+
+
+def main():
+    with run("marginal_emissions"):
+        for iso_name in ISO_ADAPTERS:
+            compute_marginal_emissions(iso_name)
+
+
+if __name__ == "__main__":
+    main()
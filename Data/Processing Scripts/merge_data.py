@@ -1,250 +1,347 @@
 import os
+from concurrent.futures import ProcessPoolExecutor
+from contextlib import nullcontext
+from functools import partial
 import pandas as pd
-from helper import get_city_zone_info
+from aggregation import build_iso_level
+from data_quality import QualityReport
+from grid_index import GRID_COLS, build_grid_index, is_stale, load_grid_index, map_grid_index
+from instrumentation import adopt, call_collected, run, span
+from iso_adapters import ISO_ADAPTERS, time_filters
+from schema import DERIVED_COLS, apply_schema
+from storage import data_path, read_table, remove_table, table_exists, write_table, write_table_stream
+from time_index import HOUR_COL, add_hour_key, epoch_hours
 
 # Paths to data directories
-openmeteo_dir = "../OpenMeteo"
-gridstatusio_dir = "../GridStatusIO"
-# Load city/zone info from CSV
-city_zone_df = pd.read_csv("../city_zone_info.csv")
-
-# Helper: parse datetime with/without timezone
-def parse_datetime(dt):
-    try:
-        return pd.to_datetime(dt, utc=True)
-    except Exception:
-        return pd.to_datetime(dt)
-
-def merge_isone():
-    # Load ISONE grid data
-    forecast_path = os.path.join(gridstatusio_dir, "isone_reliability_region_load_forecast.csv")
-    zonal_load_path = os.path.join(gridstatusio_dir, "isone_zonal_load_real_time_hourly.csv")
-    if not (os.path.exists(forecast_path) and os.path.exists(zonal_load_path)):
-        print("ISONE grid data not found.")
-        return
-
-    df_forecast = pd.read_csv(forecast_path)
-    df_zonal = pd.read_csv(zonal_load_path)
-
-    # Parse datetimes
-    df_forecast['interval_start_utc'] = pd.to_datetime(df_forecast['interval_start_utc'], utc=True)
-    df_zonal['interval_start_utc'] = pd.to_datetime(df_zonal['interval_start_utc'], utc=True)
-
-    merged_rows = []
-    for _, row in city_zone_df.iterrows():
-        # Ignore missing zones (e.g., CAISO rows)
-        if pd.isna(row['zone']):
-            continue
-        if not str(row['zone']).startswith('.Z'):
-            continue  # Only NEISO/ISONE
-        city = row['city']
-        state = row['state']
-        zone = row['zone']
-
-        # Load weather/aqi
-        weather_path = os.path.join(openmeteo_dir, f"{city}_{state}_hourly_weather.csv")
-        aqi_path = os.path.join(openmeteo_dir, f"{city}_{state}_hourly_aqi.csv")
-        if not (os.path.exists(weather_path) and os.path.exists(aqi_path)):
-            print(f"Missing weather/aqi for {city}, {state}")
+openmeteo_dir = data_path("OpenMeteo")
+
+ID_COLS = ['datetime', 'datetime_utc', HOUR_COL, 'date', 'time', 'city', 'state', 'zone']
+
+def load_city_zone_info():
+    # City/zone table written by helper.get_city_zone_info, read when a
+    # merge starts so importing this module does no I/O
+    return pd.read_csv(data_path("city_zone_info.csv"))
+
+# Worker processes per ISO for per-city merge work; 1 (the default) merges
+# cities serially in the ISO's own process. Workers only pay off with
+# cores to spare beyond the ISOs merged in parallel and a per-city read
+# and join that outweighs shipping its rows back (CSV storage, many years
+# per city): on the synthetic benchmark tree (merge_nyiso_4_workers) a
+# pool is slower than the serial merge. Read at use so the pipeline can set it from its
+# command line.
+def city_workers_setting():
+    return int(os.environ.get("ENERGY_CITY_WORKERS", "1"))
+
+def load_weather_aqi(cities, start=None, end=None, report=None):
+    # Load weather and AQI for all cities into one long frame keyed by city,
+    # parsing timestamps once over the combined column instead of per city.
+    # Weather and AQI are joined on the integer hour key; AQI timestamps are
+    # only turned into keys, never into datetimes. start/end limit the rows
+    # read to start <= datetime < end. report (a QualityReport) gets the
+    # rows each city loses in the weather/AQI join.
+    filters = time_filters('datetime', start, end)
+    weather_frames = []
+    aqi_frames = []
+    for row in cities.itertuples(index=False):
+        weather_path = os.path.join(openmeteo_dir, f"{row.city}_{row.state}_hourly_weather")
+        aqi_path = os.path.join(openmeteo_dir, f"{row.city}_{row.state}_hourly_aqi")
+        if not (table_exists(weather_path) and table_exists(aqi_path)):
+            print(f"Missing weather/aqi for {row.city}, {row.state}")
             continue
 
-        df_weather = pd.read_csv(weather_path)
-        df_aqi = pd.read_csv(aqi_path)
-
-        # Merge weather and AQI on datetime, date, and time
-        # Ensure all three columns exist in both dataframes
-        for col in ['datetime', 'date', 'time']:
-            if col not in df_weather.columns:
-                raise ValueError(f"{col} column missing in weather data")
-            if col not in df_aqi.columns:
-                raise ValueError(f"{col} column missing in AQI data")
-
-        # Standardize datetime columns, handling timezone-aware strings
-        df_weather['datetime'] = pd.to_datetime(df_weather['datetime'], utc=True)
-        df_aqi['datetime'] = pd.to_datetime(df_aqi['datetime'], utc=True)
-
-        # Merge on all three columns
-        df_wa = pd.merge(
-            df_weather,
-            df_aqi,
-            on=['datetime', 'date', 'time'],
-            suffixes=('', '_aqi')
-        )
-
-        # Add city, state, zone
-        df_wa['city'] = city
-        df_wa['state'] = state
-        df_wa['zone'] = zone
-
-        # Convert local datetime to UTC for join
-        if df_wa['datetime'].dt.tz is None:
-            # Assume local time, need to localize then convert to UTC
-            # Try to infer timezone from weather file (OpenMeteo saves in local time)
-            # For now, treat as naive and localize to US/Eastern, then convert to UTC
-            df_wa['datetime_utc'] = df_wa['datetime'].dt.tz_localize('US/Eastern').dt.tz_convert('UTC')
-        else:
-            df_wa['datetime_utc'] = df_wa['datetime'].dt.tz_convert('UTC')
-
-        # Merge in forecast and zonal load
-        # The 'location' column in grid data matches the zone
-        df_zone_forecast = df_forecast[df_forecast['location'] == zone].copy()
-        df_zone_zonal = df_zonal[df_zonal['location'] == zone].copy()
-
-        # Merge on UTC datetime
-        df_zone_forecast = df_zone_forecast.rename(columns={'interval_start_utc': 'datetime_utc'})
-        df_zone_zonal = df_zone_zonal.rename(columns={'interval_start_utc': 'datetime_utc'})
-
-        # Only keep relevant columns
-        df_zone_forecast = df_zone_forecast[['datetime_utc', 'load_forecast', 'regional_percentage']]
-        df_zone_zonal = df_zone_zonal[['datetime_utc', 'load']]
-
-        # Merge with weather/aqi
-        df_wa = pd.merge(df_wa, df_zone_forecast, on='datetime_utc', how='inner')
-        df_wa = pd.merge(df_wa, df_zone_zonal, on='datetime_utc', how='inner')
-
-        # Reorder columns
-        cols = (
-            ['datetime', 'datetime_utc', 'date', 'time', 'city', 'state', 'zone']
-            + [c for c in df_wa.columns if c not in ['datetime', 'datetime_utc', 'date', 'time', 'city', 'state', 'zone', 'load_forecast', 'regional_percentage', 'load']]
-            + ['load_forecast', 'regional_percentage', 'load']
-        )
-        df_wa = df_wa[[c for c in cols if c in df_wa.columns]]
-
-        merged_rows.append(df_wa)
-
-    if merged_rows:
-        df_isone_final = pd.concat(merged_rows, ignore_index=True)
-        # Add load_to_forecast_diff column
-        if 'load' in df_isone_final.columns and 'load_forecast' in df_isone_final.columns:
-            df_isone_final['load_to_forecast_diff'] = df_isone_final['load'] - df_isone_final['load_forecast']
-        df_isone_final.to_csv("../Merged/merged_isone_causal.csv", index=False)
-        print("Saved merged ISONE data to ../Merged/merged_isone_causal.csv")
-    else:
-        print("No ISONE data merged.")
+        with span("read_city", city=row.city, state=row.state):
+            df_weather = read_table(weather_path, filters=filters)
+            df_aqi = read_table(aqi_path, filters=filters)
+        if 'datetime' not in df_weather.columns:
+            raise ValueError("datetime column missing in weather data")
+        if 'datetime' not in df_aqi.columns:
+            raise ValueError("datetime column missing in AQI data")
+
+        # Local date/time are derived on demand from datetime_utc (see
+        # schema.with_local_date_time), so they are dropped on the way in
+        weather_frames.append(df_weather.drop(columns=DERIVED_COLS, errors='ignore').assign(city=row.city, state=row.state, zone=row.zone))
+        aqi_frames.append(df_aqi.drop(columns=DERIVED_COLS, errors='ignore').assign(city=row.city))
+
+    if not weather_frames:
+        return None
+
+    df_weather = add_hour_key(apply_schema(pd.concat(weather_frames, ignore_index=True)), 'datetime')
+    df_aqi = pd.concat(aqi_frames, ignore_index=True)
+    df_aqi = apply_schema(add_hour_key(df_aqi, 'datetime').drop(columns='datetime'))
+
+    # One keyed merge for every city; left order (city, then time) is kept
+    df_wa = pd.merge(df_weather, df_aqi, on=['city', HOUR_COL], suffixes=('', '_aqi'))
+    df_wa['datetime_utc'] = df_wa['datetime']
+    if report is not None:
+        report.add_join("weather_aqi", df_weather, df_wa)
+    return df_wa
+
+def merge_city(iso_name, city, start=None, end=None):
+    # One city's weather/AQI joined with its zone's grid rows, the unit of
+    # work of parallel merges. The grid index is memory-mapped in the worker
+    # instead of being pickled with every job. Returns the joined rows and
+    # the city's QualityReport.
+    report = QualityReport(iso_name)
+    df_wa = load_weather_aqi(pd.DataFrame([city]), start, end, report)
+    if df_wa is None:
+        return None, report
+    df_joined = map_grid_index(iso_name).join(df_wa)
+    report.add_join("grid", df_wa, df_joined)
+    return df_joined, report
+
+def join_cities(iso_name, cities, grid_index, executor=None, start=None, end=None, report=None):
+    # Weather/AQI of every city joined with the grid index. Given a process
+    # pool, each city is loaded and joined in its own job; results come back
+    # in city order, so the rows match the serial path exactly. Join loss
+    # per city goes to report either way.
+    if executor is None:
+        df_wa = load_weather_aqi(cities, start, end, report)
+        if df_wa is None:
+            return None
+        df_joined = grid_index.join(df_wa)
+        if report is not None:
+            report.add_join("grid", df_wa, df_joined)
+        return df_joined
+
+    jobs = cities.to_dict("records")
+    n = len(jobs)
+    results = executor.map(call_collected, [merge_city] * n, [iso_name] * n, jobs, [start] * n, [end] * n)
+    frames = []
+    for result, spans, error in results:
+        adopt(spans)
+        if error is not None:
+            raise error
+        df, city_report = result
+        if report is not None:
+            report.extend(city_report)
+        if df is not None:
+            frames.append(df)
+    return pd.concat(frames, ignore_index=True) if frames else None
+
+def city_pool(city_workers, n_jobs=None):
+    # Process pool for per-city jobs, or no pool for serial merging. Never
+    # more workers than CPUs or jobs, so a pool is only started when at
+    # least two workers can run at once.
+    workers = min(city_workers, os.cpu_count() or 1, n_jobs or city_workers)
+    if workers > 1:
+        return ProcessPoolExecutor(max_workers=workers)
+    return nullcontext()
+
+def finish_merge(df_merged):
+    # Weather/AQI rows joined with the grid index (see join_cities) to the
+    # merged causal frame; steps that need every city of the ISO at once
+
+    # Cities sharing a zone (e.g. all CAISO cities) split its regional
+    # percentage so the weights still sum to 1 per hour
+    cities_per_zone = df_merged.groupby(['zone', HOUR_COL], observed=True)['city'].transform('size')
+    df_merged['regional_percentage'] = df_merged['regional_percentage'] / cities_per_zone
+
+    # Reorder columns
+    cols = (
+        ID_COLS
+        + [c for c in df_merged.columns if c not in ID_COLS + GRID_COLS]
+        + GRID_COLS
+    )
+    df_merged = df_merged[[c for c in cols if c in df_merged.columns]]
+
+    # Add load_to_forecast_diff column
+    if 'load' in df_merged.columns and 'load_forecast' in df_merged.columns:
+        df_merged['load_to_forecast_diff'] = df_merged['load'] - df_merged['load_forecast']
+    return apply_schema(df_merged)
+
+def write_merged(iso_name, df_joined, report):
+    # Finish, validate and write the joined rows of every city of one ISO
+    adapter = ISO_ADAPTERS[iso_name]
+    if df_joined is None:
+        print(f"No {iso_name.upper()} data merged.")
+        return None
+    with span("finish_merge"):
+        df_final = finish_merge(df_joined)
+    with span("validate"):
+        report.check_merged(df_final)
+    with span("write"):
+        output_path = write_table(df_final, adapter.merged_table, partition_cols=["zone"], partition_by_year=True)
+        report.write("merge")
+    print(f"Saved merged {iso_name.upper()} data to {output_path}")
+    return output_path
+
+def merge_iso(iso_name, city_workers=None):
+    # Merge every city of one ISO with that ISO's grid data. With
+    # city_workers > 1 (default: ENERGY_CITY_WORKERS) cities are loaded and
+    # joined on that many worker processes.
+    adapter = ISO_ADAPTERS[iso_name]
+    city_workers = city_workers or city_workers_setting()
+    if not adapter.has_grid_data():
+        print(f"{iso_name.upper()} grid data not found.")
+        return None
+
+    with span(f"merge:{iso_name}"):
+        cities = adapter.select_cities(load_city_zone_info())
+        report = QualityReport(iso_name)
+        with span("load_grid"):
+            grid_index = load_grid_index(iso_name, cities)
+        with span("join_cities", workers=city_workers), city_pool(city_workers, len(cities)) as executor:
+            df_joined = join_cities(iso_name, cities, grid_index, executor, report=report)
+        return write_merged(iso_name, df_joined, report)
+
+def city_partition_path(iso_name, city, state):
+    # One city's merge_city output, kept so the pipeline only rejoins the
+    # cities whose inputs changed; its join-loss report sits next to it
+    return data_path("Merged", "cities", iso_name, f"{city}_{state}")
+
+def city_report_path(iso_name, city, state):
+    return city_partition_path(iso_name, city, state) + "_quality"
+
+def merge_city_partition(iso_name, city, state):
+    # Rebuild one city's partition. A city without weather/AQI data (or no
+    # longer in city_zone_info.csv) has its old partition removed.
+    adapter = ISO_ADAPTERS[iso_name]
+    if not adapter.has_grid_data():
+        print(f"{iso_name.upper()} grid data not found.")
+        return None
+    path = city_partition_path(iso_name, city, state)
+    report_path = city_report_path(iso_name, city, state)
+    cities = adapter.select_cities(load_city_zone_info())
+    rows = cities[(cities["city"] == city) & (cities["state"] == state)].to_dict("records")
+
+    with span(f"merge_city:{iso_name}", city=city, state=state):
+        if is_stale(adapter):
+            build_grid_index(iso_name, cities)
+        df_joined, report = merge_city(iso_name, rows[0]) if rows else (None, None)
+        if df_joined is None:
+            remove_table(path)
+            remove_table(report_path)
+            return None
+        with span("write"):
+            write_table(report.to_frame(), report_path)
+            return write_table(df_joined, path)
+
+def merge_iso_partitions(iso_name, city_workers=None):
+    # merge_iso from the per-city partitions (see merge_city_partition),
+    # which the pipeline keeps up to date city by city; cities without one
+    # are joined first, on city_workers processes. Same table as merge_iso.
+    adapter = ISO_ADAPTERS[iso_name]
+    city_workers = city_workers or city_workers_setting()
+    if not adapter.has_grid_data():
+        print(f"{iso_name.upper()} grid data not found.")
+        return None
+
+    with span(f"merge:{iso_name}"):
+        cities = adapter.select_cities(load_city_zone_info())
+        if is_stale(adapter):
+            build_grid_index(iso_name, cities)
+        missing = [row for row in cities.itertuples(index=False) if not table_exists(city_partition_path(iso_name, row.city, row.state))]
+        if missing:
+            with span("join_cities", workers=city_workers), city_pool(city_workers, len(missing)) as executor:
+                jobs = [(iso_name, row.city, row.state) for row in missing]
+                if executor is None:
+                    for job in jobs:
+                        merge_city_partition(*job)
+                else:
+                    for _, spans, error in executor.map(call_collected, [merge_city_partition] * len(jobs), *zip(*jobs)):
+                        adopt(spans)
+                        if error is not None:
+                            raise error
+
+        report = QualityReport(iso_name)
+        frames = []
+        with span("read_partitions"):
+            for row in cities.itertuples(index=False):
+                path = city_partition_path(iso_name, row.city, row.state)
+                if table_exists(path):
+                    frames.append(read_table(path))
+                    report.extend(QualityReport.from_frame(iso_name, read_table(city_report_path(iso_name, row.city, row.state))))
+        df_joined = pd.concat(frames, ignore_index=True) if frames else None
+        return write_merged(iso_name, df_joined, report)
+
+def time_windows(start, end, freq="MS"):
+    # Consecutive [window_start, window_end) bounds covering the hours
+    # start..end, split on freq boundaries (month starts by default). The
+    # last window ends an hour after end; a 1ns bump would be truncated
+    # away when Parquet filters cast it to the column's us resolution.
+    edges = [start] + [e for e in pd.date_range(start, end, freq=freq) if e > start]
+    return list(zip(edges, edges[1:] + [end + pd.Timedelta(1, "h")]))
+
+def merge_iso_streaming(iso_name, freq="MS", city_workers=None):
+    # Same output as merge_iso, plus the ISO-level aggregate, but only one
+    # time window (a month by default) of weather and AQI data is in memory
+    # at once; the grid index is small and loaded once. Every join and the
+    # aggregate are per hour, so merging window by window gives the same
+    # rows as merging everything at once. city_workers as in merge_iso;
+    # one pool serves every window.
+    adapter = ISO_ADAPTERS[iso_name]
+    label = iso_name.upper()
+    city_workers = city_workers or city_workers_setting()
+    if not adapter.has_grid_data():
+        print(f"{label} grid data not found.")
+        return None
+
+    cities = adapter.select_cities(load_city_zone_info())
+    grid_index = load_grid_index(iso_name, cities)
+    report = QualityReport(iso_name)
+    agg_frames = []
+
+    def merged_windows(executor):
+        for start, end in time_windows(*grid_index.time_range(), freq=freq):
+            with span("window", start=start.isoformat()):
+                df_joined = join_cities(iso_name, cities, grid_index, executor, start, end, report)
+                if df_joined is None or df_joined.empty:
+                    continue
+                df_merged = finish_merge(df_joined)
+                # Counts per window add up; hours are checked against the
+                # window so gaps at its edges are not missed
+                first, last = epoch_hours(pd.Series([start, end]))
+                report.check_merged(df_merged, hour_range=(first, last - 1))
+                # Hourly aggregates are small, so they are collected as we go
+                df_agg = build_iso_level(df_merged, adapter.load_fuel_mix(start, end), adapter.fuel_cols)
+                report.add_iso_join("fuel_mix", df_merged[HOUR_COL].nunique(), len(df_agg))
+                agg_frames.append(df_agg)
+            yield df_merged
+
+    with span(f"merge:{iso_name}"), city_pool(city_workers) as executor:
+        output_path = write_table_stream(merged_windows(executor), adapter.merged_table, partition_cols=["zone"], partition_by_year=True)
+        if output_path is None:
+            print(f"No {label} data merged.")
+            return None
+        print(f"Saved merged {label} data to {output_path}")
+        report.write("merge")
+
+        with span(f"iso_level:{iso_name}"):
+            agg_path = write_table(pd.concat(agg_frames, ignore_index=True), adapter.agg_table, partition_by_year=True)
+    print(f"Saved {label} aggregate to {agg_path}")
+    return output_path
 
-def merge_nyiso():
-    # Load NYISO grid data
-    forecast_path = os.path.join(gridstatusio_dir, "nyiso_zonal_load_forecast_hourly.csv")
-    load_path = os.path.join(gridstatusio_dir, "nyiso_load.csv")
-    if not (os.path.exists(forecast_path) and os.path.exists(load_path)):
-        print("NYISO grid data not found.")
-        return
-
-    df_forecast = pd.read_csv(forecast_path)
-    df_load = pd.read_csv(load_path)
-
-    # Parse datetimes
-    if 'interval_start_utc' in df_forecast.columns:
-        df_forecast['interval_start_utc'] = pd.to_datetime(df_forecast['interval_start_utc'], utc=True)
-    elif 'datetime_utc' in df_forecast.columns:
-        df_forecast['interval_start_utc'] = pd.to_datetime(df_forecast['datetime_utc'], utc=True)
-    else:
-        raise ValueError("No interval_start_utc in NYISO forecast")
-
-    if 'interval_start_utc' in df_load.columns:
-        df_load['interval_start_utc'] = pd.to_datetime(df_load['interval_start_utc'], utc=True)
-    elif 'datetime_utc' in df_load.columns:
-        df_load['interval_start_utc'] = pd.to_datetime(df_load['datetime_utc'], utc=True)
-    else:
-        raise ValueError("No interval_start_utc in NYISO load")
-
-    merged_rows = []
-    for _, row in city_zone_df.iterrows():
-        # Ignore missing zones (e.g., CAISO rows)
-        if pd.isna(row['zone']):
-            continue
-        if str(row['zone']).startswith('.Z'):
-            continue  # Only NYISO
-        city = row['city']
-        state = row['state']
-        zone = row['zone']
-
-        # Load weather/aqi
-        weather_path = os.path.join(openmeteo_dir, f"{city}_{state}_hourly_weather.csv")
-        aqi_path = os.path.join(openmeteo_dir, f"{city}_{state}_hourly_aqi.csv")
-        if not (os.path.exists(weather_path) and os.path.exists(aqi_path)):
-            print(f"Missing weather/aqi for {city}, {state}")
-            continue
+def merge_isone():
+    return merge_iso('isone')
 
-        df_weather = pd.read_csv(weather_path)
-        df_aqi = pd.read_csv(aqi_path)
-
-        # Merge weather and AQI on all three columns: datetime, date, and time (if present)
-        # Identify columns to merge on
-        merge_cols = []
-        for col in ['datetime', 'date', 'time']:
-            if col in df_weather.columns and col in df_aqi.columns:
-                merge_cols.append(col)
-        if not merge_cols:
-            raise ValueError("No common columns (datetime/date/time) to merge on between weather and AQI data")
-
-        # Standardize datetime columns if present
-        if 'datetime' in merge_cols:
-            df_weather['datetime'] = pd.to_datetime(df_weather['datetime'], utc=True)
-            df_aqi['datetime'] = pd.to_datetime(df_aqi['datetime'], utc=True)
-        if 'date' in merge_cols:
-            df_weather['date'] = pd.to_datetime(df_weather['date']).dt.date
-            df_aqi['date'] = pd.to_datetime(df_aqi['date']).dt.date
-        if 'time' in merge_cols:
-            # If time is not already string, convert to string for merge
-            df_weather['time'] = df_weather['time'].astype(str)
-            df_aqi['time'] = df_aqi['time'].astype(str)
-
-        df_wa = pd.merge(df_weather, df_aqi, on=merge_cols, suffixes=('', '_aqi'))
-
-        # Add city, state, zone
-        df_wa['city'] = city
-        df_wa['state'] = state
-        df_wa['zone'] = zone
-
-        # Convert local datetime to UTC for join
-        if df_wa['datetime'].dt.tz is None:
-            df_wa['datetime_utc'] = df_wa['datetime'].dt.tz_localize('US/Eastern').dt.tz_convert('UTC')
-        else:
-            df_wa['datetime_utc'] = df_wa['datetime'].dt.tz_convert('UTC')
-
-        # In NYISO, each zone is a column in forecast/load
-        # Get forecast and load for this zone
-        zone_col = zone
-        if zone_col not in df_forecast.columns or zone_col not in df_load.columns:
-            print(f"Zone {zone_col} not found in NYISO grid data columns.")
-            continue
+def merge_nyiso():
+    return merge_iso('nyiso')
+
+def merge_isos(iso_names=None, max_workers=None, streaming=False, city_workers=None):
+    # Run any subset of ISOs, each in its own worker process. streaming
+    # merges month by month (see merge_iso_streaming) for data sets that
+    # do not fit in memory. city_workers gives each ISO its own pool of
+    # per-city workers, so up to max_workers * city_workers processes run.
+    iso_names = list(iso_names or ISO_ADAPTERS)
+    merge = partial(merge_iso_streaming if streaming else merge_iso, city_workers=city_workers)
+    if max_workers == 1 or len(iso_names) == 1:
+        return [merge(name) for name in iso_names]
+    # Spans recorded in the workers come back with each result
+    with ProcessPoolExecutor(max_workers=max_workers or len(iso_names)) as executor:
+        results = list(executor.map(call_collected, [merge] * len(iso_names), iso_names))
+    outputs = []
+    for output_path, spans, error in results:
+        adopt(spans)
+        if error is not None:
+            raise error
+        outputs.append(output_path)
+    return outputs
+
+
+def main():
+    with run("merge_data"):
+        merge_isos()
 
-        # Build forecast dataframe: datetime_utc, load_forecast, regional_percentage
-        df_zone_forecast = df_forecast[['interval_start_utc', zone_col]].copy()
-        df_zone_forecast = df_zone_forecast.rename(columns={zone_col: 'load_forecast', 'interval_start_utc': 'datetime_utc'})
-        # Regional percentage: load_forecast for this zone / sum across all zones
-        zone_cols = ['west', 'genese', 'centrl', 'north', 'mhk_vl', 'capitl', 'hud_vl', 'millwd', 'dunwod', 'nyc', 'longil']
-        df_zone_forecast['regional_percentage'] = df_zone_forecast['load_forecast'] / df_forecast[zone_cols].sum(axis=1)
-
-        # Build load dataframe: datetime_utc, load
-        df_zone_load = df_load[['interval_start_utc', zone_col]].copy()
-        df_zone_load = df_zone_load.rename(columns={zone_col: 'load', 'interval_start_utc': 'datetime_utc'})
-
-        # Merge with weather/aqi
-        df_wa = pd.merge(df_wa, df_zone_forecast, left_on='datetime_utc', right_on='datetime_utc', how='inner')
-        df_wa = pd.merge(df_wa, df_zone_load, left_on='datetime_utc', right_on='datetime_utc', how='inner')
-
-        # Reorder columns
-        cols = (
-            ['datetime', 'datetime_utc', 'date', 'time', 'city', 'state', 'zone']
-            + [c for c in df_wa.columns if c not in ['datetime', 'datetime_utc', 'date', 'time', 'city', 'state', 'zone', 'load_forecast', 'regional_percentage', 'load']]
-            + ['load_forecast', 'regional_percentage', 'load']
-        )
-        df_wa = df_wa[[c for c in cols if c in df_wa.columns]]
-
-        merged_rows.append(df_wa)
-
-    if merged_rows:
-        df_nyiso_final = pd.concat(merged_rows, ignore_index=True)
-        # Add load_to_forecast_diff column
-        if 'load' in df_nyiso_final.columns and 'load_forecast' in df_nyiso_final.columns:
-            df_nyiso_final['load_to_forecast_diff'] = df_nyiso_final['load'] - df_nyiso_final['load_forecast']
-        df_nyiso_final.to_csv("../Merged/merged_nyiso_causal.csv", index=False)
-        print("Saved merged NYISO data to ../Merged/merged_nyiso_causal.csv")
-    else:
-        print("No NYISO data merged.")
 
 if __name__ == "__main__":
-    merge_isone()
-    merge_nyiso()
\ No newline at end of file
+    main()
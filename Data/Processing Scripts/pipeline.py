@@ -0,0 +1,405 @@
+import argparse
+import hashlib
+import importlib
+import json
+import os
+import sys
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, ThreadPoolExecutor, wait
+from datetime import date
+
+import storage
+from instrumentation import Span, adopt, call_collected, run
+from storage import data_path, file_digest, path_digest, resolve_path
+
+SCRIPT_DIR = os.path.dirname(os.path.abspath(__file__))
+
+# Modules whose source each kind of stage runs; editing one makes the
+# stages that use it stale
+FETCH_CODE = ["helper", "http_utils", "schema", "storage", "time_index"]
+GRIDSTATUS_CODE = ["get_gridstatus_data", "storage", "time_index"]
+GRID_INDEX_CODE = ["grid_index", "iso_adapters", "storage", "time_index"]
+MERGE_CODE = ["merge_data", "grid_index", "iso_adapters", "aggregation", "carbon_intensity", "data_quality", "schema", "storage", "time_index"]
+ARRAY_STORE_CODE = ["array_store", "iso_adapters", "storage", "time_index"]
+FEATURES_CODE = ["aqi_features", "array_store", "iso_adapters", "schema", "storage", "time_index"]
+BASELINE_CODE = ["load_baseline", "iso_adapters", "storage", "time_index"]
+EMISSIONS_CODE = ["marginal_emissions", "grid_index", "iso_adapters", "carbon_intensity", "storage", "time_index"]
+ISO_LEVEL_CODE = ["merge_iso_level_data", "iso_adapters", "aggregation", "carbon_intensity", "data_quality", "schema", "storage", "time_index"]
+
+
+class Stage:
+    # One pipeline step. fn is "module:function", called with args in a
+    # worker (a process when cpu_bound, otherwise a thread) so modules are
+    # only imported once their inputs exist. inputs() lists the files and
+    # tables the stage reads; it is resolved just before the stage runs,
+    # after its deps have finished. params holds anything else the result
+    # depends on and code the modules whose source it runs.
+    def __init__(self, name, fn, args=(), deps=(), inputs=None, outputs=(), params=None, code=(), cpu_bound=False, kwargs=None):
+        self.name = name
+        self.fn = fn
+        self.args = tuple(args)
+        self.kwargs = kwargs or {}
+        self.deps = list(deps)
+        self.inputs = inputs or (lambda: [])
+        self.outputs = list(outputs)
+        self.params = params or {}
+        self.code = list(code)
+        self.cpu_bound = cpu_bound
+
+
+def call_stage(fn, args, kwargs=None):
+    module_name, func_name = fn.split(":")
+    return getattr(importlib.import_module(module_name), func_name)(*args, **(kwargs or {}))
+
+
+def fingerprint(stage, file_cache):
+    h = hashlib.sha256()
+    h.update(json.dumps([stage.name, stage.fn, stage.args, stage.kwargs, stage.params], sort_keys=True, default=str).encode())
+    for module in stage.code:
+        h.update(file_digest(os.path.join(SCRIPT_DIR, module + ".py"), file_cache).encode())
+    for path in sorted(set(stage.inputs())):
+        h.update(path.encode())
+        h.update(path_digest(path, file_cache).encode())
+    return h.hexdigest()
+
+
+def state_path():
+    return data_path(".pipeline_state.json")
+
+
+def load_state():
+    if os.path.exists(state_path()):
+        with open(state_path()) as f:
+            return json.load(f)
+    return {"stages": {}, "files": {}}
+
+
+def save_state(state):
+    # Drop hash-cache entries for files that no longer exist
+    state["files"] = {path: v for path, v in state["files"].items() if os.path.exists(path)}
+    tmp_path = state_path() + ".tmp"
+    with open(tmp_path, "w") as f:
+        json.dump(state, f, indent=2, sort_keys=True)
+    os.replace(tmp_path, state_path())
+
+
+def stale_reason(stage, fp, state, force=False):
+    # Why the stage has to run, or None if its outputs are up to date
+    if force:
+        return "forced"
+    record = state["stages"].get(stage.name)
+    if record is None:
+        return "never run"
+    missing = [path for path in stage.outputs if resolve_path(path) is None]
+    if missing:
+        return f"missing {os.path.basename(missing[0])}"
+    if record["fingerprint"] != fp:
+        return "inputs, params or code changed"
+    return None
+
+
+def grid_index_inputs(adapter):
+    from iso_adapters import gridstatusio_dir
+    return [os.path.join(gridstatusio_dir, t) for t in adapter.grid_tables]
+
+
+def iso_cities(adapter):
+    # The ISO's rows of city_zone_info.csv, empty before the first fetch
+    city_zone_info = data_path("city_zone_info.csv")
+    if not os.path.exists(city_zone_info):
+        return []
+    import pandas as pd
+    return adapter.select_cities(pd.read_csv(city_zone_info)).to_dict("records")
+
+
+def merge_city_inputs(adapter, city, state):
+    # Grid index plus the city's weather/AQI tables
+    from grid_index import grid_index_path
+    return [grid_index_path(adapter)] + [data_path("OpenMeteo", f"{city}_{state}_hourly_{kind}") for kind in ["weather", "aqi"]]
+
+
+def merge_inputs(iso_name, adapter):
+    # The per-city partitions of every city in the ISO
+    from merge_data import city_partition_path, city_report_path
+    paths = [data_path("city_zone_info.csv")]
+    for row in iso_cities(adapter):
+        paths += [city_partition_path(iso_name, row["city"], row["state"]), city_report_path(iso_name, row["city"], row["state"])]
+    return paths
+
+
+def iso_level_inputs(adapter):
+    from iso_adapters import gridstatusio_dir
+    return [adapter.merged_table, os.path.join(gridstatusio_dir, adapter.fuel_mix_table)]
+
+
+def emissions_inputs(adapter):
+    from grid_index import grid_index_path
+    from iso_adapters import gridstatusio_dir
+    return [grid_index_path(adapter), os.path.join(gridstatusio_dir, adapter.fuel_mix_table)]
+
+
+def build_stages():
+    # Every stage of the pipeline, in dependency order: Open-Meteo and
+    # GridStatus fetches (independent of each other), then one grid index,
+    # one merge per city and one per ISO, one array store, one AQI feature
+    # table, one load-anomaly table, one ISO-level aggregate and one marginal
+    # emissions table per ISO
+    import get_gridstatus_data
+    from array_store import store_path
+    from data_quality import quality_path
+    from grid_index import grid_index_path
+    from helper import CITY_DATA
+    from iso_adapters import ISO_ADAPTERS
+    from merge_data import city_partition_path, city_report_path
+
+    # Fetches reach up to today, so they are stale once a day. Open-Meteo
+    # refreshes the recent days of every cached city (which the archive
+    # revises); GridStatus only downloads the windows its manifests miss.
+    today = date.today().isoformat()
+    stages = [Stage(
+        "openmeteo",
+        "helper:get_city_zone_info",
+        kwargs={"refresh": True},
+        outputs=[data_path("city_zone_info.csv")],
+        params={"cities": CITY_DATA, "end_date": today},
+        code=FETCH_CODE,
+    )]
+
+    dataset_stages = {}
+    for entry in get_gridstatus_data.datasets:
+        name = f"gridstatus:{entry['dataset']}"
+        stages.append(Stage(
+            name,
+            "get_gridstatus_data:update_dataset",
+            args=(entry,),
+            outputs=[get_gridstatus_data.dataset_table(entry)],
+            params={"start_date": get_gridstatus_data.start_date, "end_date": today},
+            code=GRIDSTATUS_CODE,
+        ))
+        dataset_stages[os.path.splitext(entry["filename"])[0]] = name
+
+    for iso_name, adapter in ISO_ADAPTERS.items():
+        grid_deps = [dataset_stages[t] for t in adapter.grid_tables if t in dataset_stages]
+        stages.append(Stage(
+            f"grid_index:{iso_name}",
+            "grid_index:build_grid_index",
+            args=(iso_name,),
+            deps=grid_deps,
+            inputs=lambda adapter=adapter: grid_index_inputs(adapter),
+            outputs=[grid_index_path(adapter)],
+            code=GRID_INDEX_CODE,
+            cpu_bound=True,
+        ))
+        # Cities come from the last fetch's city_zone_info.csv; the ISO
+        # merge joins any city without a partition yet (e.g. on the first
+        # run) itself
+        city_stages = []
+        for row in iso_cities(adapter):
+            city, state = row["city"], row["state"]
+            city_stages.append(f"merge_city:{iso_name}:{city}_{state}")
+            stages.append(Stage(
+                city_stages[-1],
+                "merge_data:merge_city_partition",
+                args=(iso_name, city, state),
+                deps=["openmeteo", f"grid_index:{iso_name}"],
+                inputs=lambda adapter=adapter, city=city, state=state: merge_city_inputs(adapter, city, state),
+                outputs=[city_partition_path(iso_name, city, state), city_report_path(iso_name, city, state)],
+                params={"city": row},
+                code=MERGE_CODE,
+                cpu_bound=True,
+            ))
+        stages.append(Stage(
+            f"merge:{iso_name}",
+            "merge_data:merge_iso_partitions",
+            args=(iso_name,),
+            deps=["openmeteo", f"grid_index:{iso_name}"] + city_stages,
+            inputs=lambda iso_name=iso_name, adapter=adapter: merge_inputs(iso_name, adapter),
+            outputs=[adapter.merged_table, quality_path(iso_name, "merge")],
+            code=MERGE_CODE,
+            cpu_bound=True,
+        ))
+        stages.append(Stage(
+            f"array_store:{iso_name}",
+            "array_store:build_array_store",
+            args=(iso_name,),
+            deps=[f"merge:{iso_name}"],
+            inputs=lambda adapter=adapter: [adapter.merged_table],
+            outputs=[store_path(iso_name)],
+            code=ARRAY_STORE_CODE,
+            cpu_bound=True,
+        ))
+        stages.append(Stage(
+            f"features:{iso_name}",
+            "aqi_features:compute_aqi_features",
+            args=(iso_name,),
+            deps=[f"merge:{iso_name}"],
+            inputs=lambda adapter=adapter: [adapter.merged_table],
+            outputs=[adapter.features_table, adapter.events_table],
+            code=FEATURES_CODE,
+            cpu_bound=True,
+        ))
+        stages.append(Stage(
+            f"load_baseline:{iso_name}",
+            "load_baseline:compute_load_anomalies",
+            args=(iso_name,),
+            deps=[f"merge:{iso_name}", f"features:{iso_name}"],
+            inputs=lambda adapter=adapter: [adapter.merged_table, adapter.features_table],
+            outputs=[adapter.anomaly_table],
+            code=BASELINE_CODE,
+            cpu_bound=True,
+        ))
+        fuel_deps = [dataset_stages[adapter.fuel_mix_table]] if adapter.fuel_mix_table in dataset_stages else []
+        stages.append(Stage(
+            f"emissions:{iso_name}",
+            "marginal_emissions:compute_marginal_emissions",
+            args=(iso_name,),
+            deps=[f"grid_index:{iso_name}"] + fuel_deps,
+            inputs=lambda adapter=adapter: emissions_inputs(adapter),
+            outputs=[adapter.emissions_table],
+            code=EMISSIONS_CODE,
+            cpu_bound=True,
+        ))
+        stages.append(Stage(
+            f"iso_level:{iso_name}",
+            "merge_iso_level_data:aggregate_iso_level",
+            args=(iso_name,),
+            deps=[f"merge:{iso_name}"] + fuel_deps,
+            inputs=lambda adapter=adapter: iso_level_inputs(adapter),
+            outputs=[adapter.agg_table, quality_path(iso_name, "iso_level")],
+            code=ISO_LEVEL_CODE,
+            cpu_bound=True,
+        ))
+    return stages
+
+
+def select_stages(stages, targets):
+    # Stages matching any target (a full name, or a leading part of it such
+    # as "merge" or "merge_city:nyiso"), plus everything they depend on
+    if not targets:
+        return stages
+    by_name = {stage.name: stage for stage in stages}
+    wanted = set()
+    todo = [s.name for s in stages if any(s.name == t or s.name.startswith(t + ":") for t in targets)]
+    if not todo:
+        raise ValueError(f"No stages match {targets}; stages are {list(by_name)}")
+    while todo:
+        name = todo.pop()
+        if name not in wanted:
+            wanted.add(name)
+            todo.extend(by_name[name].deps)
+    return [stage for stage in stages if stage.name in wanted]
+
+
+def check_deps(stages):
+    # Every dep must be among the stages to run (select_stages adds them);
+    # otherwise its dependents could never start
+    names = {stage.name for stage in stages}
+    missing = {dep: stage.name for stage in stages for dep in stage.deps if dep not in names}
+    if missing:
+        dep, stage_name = next(iter(missing.items()))
+        raise ValueError(f"{stage_name} depends on {dep}, which is not selected; select it too or use select_stages")
+
+
+def plan(stages, force=False):
+    # Dry run: which stages would run and why. Stages downstream of a stale
+    # stage are reported as waiting on it, since whether they rerun depends
+    # on what it writes.
+    check_deps(stages)
+    state = load_state()
+    stale = set()
+    for stage in stages:
+        upstream = [d for d in stage.deps if d in stale]
+        if upstream:
+            reason = f"after {', '.join(upstream)}"
+        else:
+            reason = stale_reason(stage, fingerprint(stage, state["files"]), state, force)
+        if reason is not None:
+            stale.add(stage.name)
+        print(f"{stage.name:<45} {'run' if reason else 'skip':<5} {reason or 'up to date'}")
+    return stale
+
+
+def run_pipeline(stages, force=False, max_workers=4):
+    # Run stale stages as soon as their deps finish, fetches on threads and
+    # merges in worker processes. A failed stage blocks its dependents but
+    # not unrelated stages. Spans recorded by each stage are adopted by the
+    # caller's span (see instrumentation.run). Returns {stage name: status}.
+    check_deps(stages)
+    state = load_state()
+    status = {}
+    pending = list(stages)
+    running = {}
+    with ThreadPoolExecutor(max_workers=max_workers) as threads, \
+            ProcessPoolExecutor(max_workers=max_workers) as processes:
+        while pending or running:
+            for stage in list(pending):
+                dep_status = [status.get(d) for d in stage.deps]
+                if any(s in ("failed", "blocked") for s in dep_status):
+                    pending.remove(stage)
+                    status[stage.name] = "blocked"
+                    print(f"[blocked] {stage.name}")
+                elif all(s in ("ran", "skipped") for s in dep_status):
+                    pending.remove(stage)
+                    fp = fingerprint(stage, state["files"])
+                    reason = stale_reason(stage, fp, state, force)
+                    if reason is None:
+                        status[stage.name] = "skipped"
+                        skipped = Span(stage.name)
+                        skipped.status = "skipped"
+                        adopt([skipped])
+                        print(f"[skip] {stage.name}")
+                        continue
+                    print(f"[run] {stage.name} ({reason})")
+                    pool = processes if stage.cpu_bound else threads
+                    running[pool.submit(call_collected, call_stage, stage.fn, stage.args, stage.kwargs)] = (stage, fp)
+            if not running:
+                break
+
+            done, _ = wait(running, return_when=FIRST_COMPLETED)
+            for future in done:
+                stage, fp = running.pop(future)
+                try:
+                    _, spans, error = future.result()
+                except Exception as e:
+                    spans, error = [], e
+                adopt(spans)
+                if error is not None:
+                    status[stage.name] = "failed"
+                    print(f"[failed] {stage.name}: {error}")
+                    continue
+                status[stage.name] = "ran"
+                state["stages"][stage.name] = {"fingerprint": fp, "finished": date.today().isoformat()}
+                save_state(state)
+    save_state(state)
+    return status
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Run the data pipeline, rebuilding only stale stages.")
+    parser.add_argument("stages", nargs="*", help="stage names or kinds (e.g. merge:isone, merge); default all")
+    parser.add_argument("--data-dir", default=storage.DATA_DIR, help="root of the Data tree (default: %(default)s)")
+    parser.add_argument("--dry-run", action="store_true", help="print the plan without running anything")
+    parser.add_argument("--force", action="store_true", help="rerun stages even if they are up to date")
+    parser.add_argument("--max-workers", type=int, default=4)
+    parser.add_argument("--city-workers", type=int, help="worker processes per ISO merge for per-city work (default: ENERGY_CITY_WORKERS or 1)")
+    parser.add_argument("--profile", metavar="STAGE", help="profile one stage (e.g. merge:isone) into Data/reports")
+    parser.add_argument("--profiler", choices=["cprofile", "pyinstrument"], default="cprofile")
+    args = parser.parse_args(argv)
+
+    # Must happen before any stage module is imported
+    storage.set_data_dir(args.data_dir)
+    if args.city_workers:
+        os.environ["ENERGY_CITY_WORKERS"] = str(args.city_workers)
+    if args.profile:
+        os.environ["ENERGY_PROFILE"] = args.profile
+        os.environ["ENERGY_PROFILER"] = args.profiler
+    stages = select_stages(build_stages(), args.stages)
+    if args.dry_run:
+        plan(stages, force=args.force)
+        return 0
+    with run("pipeline"):
+        status = run_pipeline(stages, force=args.force, max_workers=args.max_workers)
+    return 1 if any(s in ("failed", "blocked") for s in status.values()) else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,58 @@
+import pandas as pd
+
+from time_index import parse_utc
+
+# Repeated identifiers stored once per category instead of once per row
+IDENTIFIER_COLS = ["city", "state", "zone"]
+DATETIME_COLS = ["datetime", "datetime_utc"]
+# Local date/time strings are derived on demand (see with_local_date_time)
+DERIVED_COLS = ["date", "time"]
+
+
+def is_measurement_col(col):
+    # Open-Meteo weather/AQI columns carry a __unit suffix and arrive as
+    # float32 from the API, so float32 loses nothing. Grid MW values (load,
+    # load_forecast, regional_percentage) stay float64 because they are
+    # summed across zones.
+    return "__" in col
+
+
+def apply_schema(df):
+    # Compact dtypes for merged causal frames: categorical identifiers,
+    # float32 measurements, tz-aware UTC datetimes, no date/time columns
+    df = df.drop(columns=[c for c in DERIVED_COLS if c in df.columns])
+    for col in DATETIME_COLS:
+        if col in df.columns and not isinstance(df[col].dtype, pd.DatetimeTZDtype):
+            df[col] = parse_utc(df[col])
+    for col in IDENTIFIER_COLS:
+        if col in df.columns and not isinstance(df[col].dtype, pd.CategoricalDtype):
+            df[col] = df[col].astype("category")
+    for col in df.columns:
+        if is_measurement_col(col) and pd.api.types.is_float_dtype(df[col]):
+            df[col] = df[col].astype("float32")
+    return df
+
+
+def with_local_date_time(df, city_timezones):
+    # Add local date and time columns from datetime_utc, using each city's
+    # timezone (city -> tz name, e.g. from city_zone_info.csv)
+    df = df.copy()
+    date = pd.Series(index=df.index, dtype="object")
+    time = pd.Series(index=df.index, dtype="object")
+    for city, idx in df.groupby("city", observed=True).groups.items():
+        local = df.loc[idx, "datetime_utc"].dt.tz_convert(city_timezones[city])
+        date.loc[idx] = local.dt.date
+        time.loc[idx] = local.dt.time
+    df["date"] = date
+    df["time"] = time
+    return df
+
+
+def memory_usage_mb(df):
+    return df.memory_usage(deep=True).sum() / 1e6
+
+
+def memory_report(df_before, df_after, label):
+    before = memory_usage_mb(df_before)
+    after = memory_usage_mb(df_after)
+    print(f"{label}: {before:.1f} MB -> {after:.1f} MB ({after / before:.0%})")
@@ -0,0 +1,372 @@
+import hashlib
+import importlib.util
+import json
+import os
+import shutil
+
+import numpy as np
+import pandas as pd
+
+from instrumentation import count, path_bytes
+from time_index import parse_utc
+
+# On-disk format for pipeline tables. Parquet keeps dtypes (tz-aware
+# datetimes, dates, floats) so nothing is reparsed on read; CSV is kept for
+# export and for environments without pyarrow.
+HAVE_PYARROW = importlib.util.find_spec("pyarrow") is not None
+STORAGE_FORMAT = os.environ.get("ENERGY_STORAGE_FORMAT", "parquet" if HAVE_PYARROW else "csv")
+PARQUET_COMPRESSION = "zstd"
+# Rows per chunk when filtering CSV tables
+CSV_CHUNK_ROWS = 500_000
+
+# Root of the Data tree. Scripts run from Data/Processing Scripts, so the
+# default is the parent directory; ENERGY_DATA_DIR (or set_data_dir before
+# the other modules are imported) points the pipeline at another tree.
+DATA_DIR = os.environ.get("ENERGY_DATA_DIR", "..")
+
+# Tables written with partition_by_year get a "year" partition derived from
+# this column; it is dropped again on read unless explicitly requested
+YEAR_SOURCE_COL = "datetime_utc"
+
+_FORMATS = ("parquet", "csv")
+
+
+def data_path(*parts):
+    return os.path.join(DATA_DIR, *parts)
+
+
+def set_data_dir(path):
+    # Modules build their paths at import time, so call this first; the
+    # environment variable carries the setting into worker processes
+    global DATA_DIR
+    DATA_DIR = os.path.abspath(path)
+    os.environ["ENERGY_DATA_DIR"] = DATA_DIR
+
+
+def table_path(path, fmt=None):
+    # Path for a table in the given format; any existing extension is replaced
+    base, ext = os.path.splitext(path)
+    if ext.lstrip(".") not in _FORMATS:
+        base = path
+    return f"{base}.{fmt or STORAGE_FORMAT}"
+
+
+def find_table(path):
+    # Existing file/directory for a table, preferring STORAGE_FORMAT but
+    # falling back to the other format (e.g. CSVs from older runs)
+    for fmt in sorted(_FORMATS, key=lambda f: f != STORAGE_FORMAT):
+        candidate = table_path(path, fmt)
+        if os.path.exists(candidate):
+            return candidate
+    return None
+
+
+def table_exists(path):
+    return find_table(path) is not None
+
+
+def resolve_path(path):
+    # Plain files are used as given; table paths may carry either extension
+    return path if os.path.exists(path) else find_table(path)
+
+
+def file_digest(path, file_cache=None):
+    # Content hash of one file, reused while its size and mtime are unchanged
+    file_cache = {} if file_cache is None else file_cache
+    stat = os.stat(path)
+    key = [stat.st_size, stat.st_mtime_ns]
+    cached = file_cache.get(path)
+    if cached and cached[:2] == key:
+        return cached[2]
+    h = hashlib.sha256()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(1 << 20), b""):
+            h.update(block)
+    file_cache[path] = key + [h.hexdigest()]
+    return h.hexdigest()
+
+
+def path_digest(path, file_cache=None):
+    # Content hash of a file or of every file under a (partitioned) table
+    found = resolve_path(path)
+    if found is None:
+        return "missing"
+    if not os.path.isdir(found):
+        return file_digest(found, file_cache)
+    h = hashlib.sha256()
+    for root, dirs, files in os.walk(found):
+        dirs.sort()
+        for name in sorted(files):
+            file = os.path.join(root, name)
+            h.update(os.path.relpath(file, found).encode())
+            h.update(file_digest(file, file_cache).encode())
+    return h.hexdigest()
+
+
+def path_stamp(path):
+    # Cheap stand-in for path_digest: names, sizes and mtimes of a file or
+    # of every file under a (partitioned) table, without reading them
+    found = resolve_path(path)
+    if found is None:
+        return "missing"
+    h = hashlib.sha256()
+    files = [found] if not os.path.isdir(found) else [
+        os.path.join(root, name) for root, dirs, names in sorted(os.walk(found)) for name in sorted(names)
+    ]
+    for file in files:
+        stat = os.stat(file)
+        h.update(f"{os.path.relpath(file, found)}:{stat.st_size}:{stat.st_mtime_ns};".encode())
+    return h.hexdigest()
+
+
+def remove_path(path):
+    # Delete a file or directory (e.g. a partitioned table), if present
+    if os.path.isdir(path):
+        shutil.rmtree(path)
+    elif os.path.exists(path):
+        os.remove(path)
+
+
+def remove_table(path):
+    # Delete a table in any format
+    for fmt in _FORMATS:
+        remove_path(table_path(path, fmt))
+
+
+def _replace_path(tmp_path, out_path):
+    # Move a finished temp file/directory into place
+    if os.path.isdir(out_path):
+        shutil.rmtree(out_path)
+    os.replace(tmp_path, out_path)
+
+
+def write_table(df, path, fmt=None, partition_cols=None, partition_by_year=False):
+    # Write df as a table and return the path written. Parquet output can be
+    # hive-partitioned (e.g. by zone and year) into a directory; CSV output
+    # ignores partitioning. Writes go through a temp path and a rename.
+    fmt = fmt or STORAGE_FORMAT
+    out_path = table_path(path, fmt)
+    tmp_path = out_path + ".tmp"
+    os.makedirs(os.path.dirname(out_path) or ".", exist_ok=True)
+    if os.path.isdir(tmp_path):
+        shutil.rmtree(tmp_path)
+
+    if fmt == "csv":
+        df.to_csv(tmp_path, index=False)
+    else:
+        partition_cols = list(partition_cols or [])
+        if partition_by_year:
+            df = df.assign(year=parse_utc(df[YEAR_SOURCE_COL]).dt.year)
+            partition_cols.append("year")
+        df.to_parquet(
+            tmp_path,
+            index=False,
+            compression=PARQUET_COMPRESSION,
+            partition_cols=partition_cols or None,
+        )
+    _replace_path(tmp_path, out_path)
+    count(rows_out=len(df), bytes_written=path_bytes(out_path))
+    return out_path
+
+
+def _apply_filters(df, filters):
+    # In-memory equivalent of pyarrow's [(column, op, value), ...] filters
+    ops = {
+        "=": lambda s, v: s == v,
+        "==": lambda s, v: s == v,
+        "!=": lambda s, v: s != v,
+        "<": lambda s, v: s < v,
+        "<=": lambda s, v: s <= v,
+        ">": lambda s, v: s > v,
+        ">=": lambda s, v: s >= v,
+        "in": lambda s, v: s.isin(v),
+        "not in": lambda s, v: ~s.isin(v),
+    }
+    mask = pd.Series(True, index=df.index)
+    for col, op, value in filters:
+        if col == "year" and col not in df.columns:
+            series = parse_utc(df[YEAR_SOURCE_COL]).dt.year
+        else:
+            series = df[col]
+        # CSV datetimes are strings until parsed
+        if isinstance(value, pd.Timestamp) and not pd.api.types.is_datetime64_any_dtype(series):
+            series = parse_utc(series)
+        mask &= ops[op](series, value)
+    return df[mask].reset_index(drop=True)
+
+
+def read_table(path, columns=None, filters=None, parse_dates=None):
+    # Read a table written by write_table (or a plain CSV). columns projects
+    # on read; filters are pushed down to Parquet and applied chunk by chunk
+    # for CSV. parse_dates only matters for CSV, Parquet keeps its dtypes.
+    found = find_table(path)
+    if found is None:
+        raise FileNotFoundError(f"No table found for {path}")
+
+    if found.endswith(".parquet"):
+        df = pd.read_parquet(found, columns=columns, filters=filters)
+        if "year" in df.columns and not (columns and "year" in columns):
+            df = df.drop(columns="year")
+        count(rows_in=len(df), bytes_read=path_bytes(found))
+        return df
+
+    usecols = None
+    if columns is not None:
+        filter_cols = [f[0] for f in filters or []]
+        if "year" in filter_cols:
+            filter_cols.append(YEAR_SOURCE_COL)
+        usecols = list(dict.fromkeys(columns + [c for c in filter_cols if c != "year"]))
+    if filters:
+        # Filter chunk by chunk so only matching rows are ever held in full
+        chunks = pd.read_csv(found, usecols=usecols, parse_dates=parse_dates, chunksize=CSV_CHUNK_ROWS)
+        df = pd.concat([_apply_filters(chunk, filters) for chunk in chunks], ignore_index=True)
+    else:
+        df = pd.read_csv(found, usecols=usecols, parse_dates=parse_dates)
+    if columns is not None:
+        df = df[columns]
+    count(rows_in=len(df), bytes_read=path_bytes(found))
+    return df
+
+
+def table_schema(path):
+    # Arrow schema of a table without reading its rows. CSV tables only
+    # give their column names (typed as null, which unify_schemas promotes).
+    import pyarrow as pa
+    found = find_table(path)
+    if found is None:
+        raise FileNotFoundError(f"No table found for {path}")
+    if found.endswith(".csv"):
+        return pa.schema([(name, pa.null()) for name in pd.read_csv(found, nrows=0).columns])
+    if os.path.isdir(found):
+        import pyarrow.dataset as ds
+        return ds.dataset(found, partitioning="hive").schema.remove_metadata()
+    import pyarrow.parquet as pq
+    return pq.read_schema(found).remove_metadata()
+
+
+def unify_schemas(schemas):
+    # One schema holding every column of the given schemas, in order of
+    # first appearance. Null columns (all-missing in one table) and ints
+    # next to floats are promoted; incompatible types raise ArrowTypeError.
+    import pyarrow as pa
+    return pa.unify_schemas(list(schemas), promote_options="permissive")
+
+
+def _conform(df, schema):
+    # df as an Arrow table with exactly schema's columns and types; columns
+    # df lacks (or has only missing values in) are null
+    import pyarrow as pa
+    table = pa.Table.from_pandas(df, preserve_index=False)
+    columns = []
+    for field in schema:
+        column = table[field.name] if field.name in table.column_names else None
+        if column is None or column.null_count == len(column):
+            columns.append(pa.nulls(len(table), field.type))
+        else:
+            columns.append(column.cast(field.type))
+    return pa.table(columns, schema=schema)
+
+
+def write_table_stream(frames, path, fmt=None, partition_cols=None, partition_by_year=False, schema=None):
+    # Write an iterable of DataFrames as one table while holding only one
+    # frame in memory. schema (an Arrow schema, e.g. unify_schemas of the
+    # inputs' table_schema) fixes the output columns and types; frames
+    # missing a column get nulls there. Without it, columns and types follow
+    # the first non-empty frame and a later frame with other columns raises
+    # ValueError instead of losing them. Partitioned Parquet output gets one
+    # numbered file per frame in each partition, so rows read back in frame
+    # order. Returns the path written, or None if every frame was empty.
+    fmt = fmt or STORAGE_FORMAT
+    out_path = table_path(path, fmt)
+    tmp_path = out_path + ".tmp"
+    os.makedirs(os.path.dirname(out_path) or ".", exist_ok=True)
+    if os.path.isdir(tmp_path):
+        shutil.rmtree(tmp_path)
+    partition_cols = list(partition_cols or [])
+    if partition_by_year:
+        partition_cols.append("year")
+
+    columns = None if schema is None else list(schema.names)
+    writer = None
+    rows = 0
+    try:
+        for n, df in enumerate(frames):
+            if df.empty:
+                continue
+            rows += len(df)
+            if columns is None:
+                columns = list(df.columns)
+            extra = [c for c in df.columns if c not in columns]
+            if extra:
+                raise ValueError(f"Frame {n} of {out_path} has columns {extra} the output schema lacks; pass a schema covering every frame")
+            df = df.reindex(columns=columns)
+            if fmt == "csv":
+                df.to_csv(tmp_path, mode="w" if writer is None else "a", header=writer is None, index=False)
+                writer = True
+            elif partition_cols:
+                if partition_by_year:
+                    df = df.assign(year=parse_utc(df[YEAR_SOURCE_COL]).dt.year)
+                df.to_parquet(
+                    tmp_path,
+                    index=False,
+                    compression=PARQUET_COMPRESSION,
+                    partition_cols=partition_cols,
+                    basename_template=f"part-{n:05d}-{{i}}.parquet",
+                )
+                writer = True
+            else:
+                import pyarrow as pa
+                import pyarrow.parquet as pq
+                if writer is None:
+                    table = pa.Table.from_pandas(df, preserve_index=False) if schema is None else _conform(df, schema)
+                    writer = pq.ParquetWriter(tmp_path, table.schema, compression=PARQUET_COMPRESSION)
+                else:
+                    table = _conform(df, writer.schema)
+                writer.write_table(table)
+    finally:
+        if writer is not None and writer is not True:
+            writer.close()
+
+    if columns is None:
+        return None
+    _replace_path(tmp_path, out_path)
+    count(rows_out=rows, bytes_written=path_bytes(out_path))
+    return out_path
+
+
+def write_arrays(path, meta, arrays):
+    # Save named NumPy arrays as a directory of .npy files plus meta.json,
+    # through a temp directory and a rename. .npy files can be memory-mapped
+    # by readers (see read_arrays).
+    tmp_path = path + ".tmp"
+    if os.path.isdir(tmp_path):
+        shutil.rmtree(tmp_path)
+    os.makedirs(tmp_path)
+    with open(os.path.join(tmp_path, "meta.json"), "w") as f:
+        json.dump(meta, f, indent=2)
+    for name, array in arrays.items():
+        np.save(os.path.join(tmp_path, f"{name}.npy"), array)
+    _replace_path(tmp_path, path)
+    count(bytes_written=path_bytes(path))
+    return path
+
+
+def read_arrays(path, names, mmap=False):
+    # (meta, {name: array}) from a directory written by write_arrays. With
+    # mmap the arrays are mapped read-only instead of read: nothing is
+    # loaded until it is touched, and processes mapping the same files
+    # share them through the page cache.
+    with open(os.path.join(path, "meta.json")) as f:
+        meta = json.load(f)
+    arrays = {
+        name: np.load(os.path.join(path, f"{name}.npy"), mmap_mode="r" if mmap else None)
+        for name in names
+    }
+    if not mmap:
+        count(bytes_read=sum(path_bytes(os.path.join(path, f"{name}.npy")) for name in names))
+    return meta, arrays
+
+
+def export_csv(path):
+    # Write a CSV copy of a stored table next to it
+    return write_table(read_table(path), path, fmt="csv")
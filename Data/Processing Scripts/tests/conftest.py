@@ -0,0 +1,18 @@
+import os
+import sys
+
+import pytest
+
+# The scripts import each other as top-level modules
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+
+@pytest.fixture
+def data_dir(tmp_path, monkeypatch):
+    # An empty Data tree for the test; paths resolved at call time (and
+    # worker processes, through ENERGY_DATA_DIR) land under it
+    import storage
+
+    monkeypatch.setattr(storage, "DATA_DIR", str(tmp_path))
+    monkeypatch.setenv("ENERGY_DATA_DIR", str(tmp_path))
+    return tmp_path
@@ -0,0 +1,200 @@
+import calendar
+import json
+import threading
+import time
+import zlib
+from datetime import date
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+
+import flatbuffers
+import numpy as np
+from openmeteo_sdk.Unit import Unit
+from openmeteo_sdk.WeatherApiResponse import WeatherApiResponse
+
+# Open-Meteo stand-ins for the fetch tests: responses in the API's wire
+# format (length-prefixed WeatherApiResponse FlatBuffers, one message per
+# location) and a local HTTP server that answers geocoding and archive
+# requests with them. Values depend only on (latitude, longitude, variable,
+# hour), so any batching of the same cities gives the same data.
+
+UNITS = {"pm2_5": Unit.micrograms_per_cubic_metre}
+
+# Latitudes above this are rejected with a 400, like an out-of-range
+# coordinate
+BAD_LATITUDE = 90
+
+
+def hourly_values(latitude, longitude, variable, hours):
+    seed = zlib.crc32(f"{latitude:.4f},{longitude:.4f},{variable}".encode())
+    rng = np.random.default_rng(seed)
+    base = rng.normal(10, 5)
+    return (base + np.sin(hours / 24.0) * 5 + (hours % 7)).astype("float32")
+
+
+def encode_location(latitude, longitude, variables, start, end):
+    # One WeatherApiResponse with hourly data for [start, end] (dates,
+    # inclusive) in GMT. Field slots follow openmeteo_sdk's schema.
+    time_start = calendar.timegm(start.timetuple())
+    n_hours = ((end - start).days + 1) * 24
+    hours = np.arange(n_hours) + time_start // 3600
+    builder = flatbuffers.Builder(1024)
+
+    variable_offsets = []
+    for variable in variables:
+        values = hourly_values(latitude, longitude, variable, hours)
+        values_offset = builder.CreateNumpyVector(values)
+        builder.StartObject(14)
+        builder.PrependUint8Slot(1, UNITS.get(variable, Unit.celsius), 0)
+        builder.PrependUOffsetTRelativeSlot(3, values_offset, 0)
+        variable_offsets.append(builder.EndObject())
+
+    builder.StartVector(4, len(variable_offsets), 4)
+    for offset in variable_offsets[::-1]:
+        builder.PrependUOffsetTRelative(offset)
+    variables_offset = builder.EndVector()
+    builder.StartObject(4)
+    builder.PrependInt64Slot(0, time_start, 0)
+    builder.PrependInt64Slot(1, time_start + n_hours * 3600, 0)
+    builder.PrependInt32Slot(2, 3600, 0)
+    builder.PrependUOffsetTRelativeSlot(3, variables_offset, 0)
+    hourly_offset = builder.EndObject()
+
+    builder.StartObject(16)
+    builder.PrependFloat32Slot(0, latitude, 0)
+    builder.PrependFloat32Slot(1, longitude, 0)
+    builder.PrependUOffsetTRelativeSlot(11, hourly_offset, 0)
+    builder.Finish(builder.EndObject())
+    message = bytes(builder.Output())
+    return len(message).to_bytes(4, "little") + message
+
+
+def encode_response(params):
+    # Body for a (possibly multi-location) archive request's params, as
+    # parsed by parse_qs
+    start = date.fromisoformat(params["start_date"][0])
+    end = date.fromisoformat(params["end_date"][0])
+    variables = params["hourly"]
+    return b"".join(
+        encode_location(float(latitude), float(longitude), variables, start, end)
+        for latitude, longitude in zip(params["latitude"], params["longitude"])
+    )
+
+
+def decode_response(body):
+    # WeatherApiResponse messages of a body, as openmeteo_requests does
+    messages = []
+    pos = 0
+    while pos < len(body):
+        length = int.from_bytes(body[pos:pos + 4], "little")
+        messages.append(WeatherApiResponse.GetRootAs(body, pos + 4))
+        pos += length + 4
+    return messages
+
+
+class FakeClient:
+    # Stands in for openmeteo_requests.Client: replays encode_response
+    # bodies through the real decoder and raises what the client raises.
+    # Bad latitudes get the API's 400 error; the first `failures` calls a
+    # wrapped 503. calls logs the latitudes of every request.
+    def __init__(self, failures=0):
+        self.failures = failures
+        self.calls = []
+
+    def __call__(self, session=None):
+        return self
+
+    def weather_api(self, url, params):
+        from openmeteo_requests.Client import OpenMeteoRequestsError
+        import requests
+
+        latitudes = [str(v) for v in params["latitude"]]
+        self.calls.append(latitudes)
+        if any(float(v) > BAD_LATITUDE for v in latitudes):
+            error = OpenMeteoRequestsError({"error": True, "reason": "Latitude must be in range of -90 to 90°."})
+            raise OpenMeteoRequestsError(f"failed to request {url!r}: {error}") from error
+        if self.failures > 0:
+            self.failures -= 1
+            response = requests.Response()
+            response.status_code = 503
+            error = requests.HTTPError("503 Server Error", response=response)
+            raise OpenMeteoRequestsError(f"failed to request {url!r}: {error}") from error
+        query = {
+            "latitude": latitudes,
+            "longitude": [str(v) for v in params["longitude"]],
+            "start_date": [str(params["start_date"])],
+            "end_date": [str(params["end_date"])],
+            "hourly": list(params["hourly"]),
+        }
+        return decode_response(encode_response(query))
+
+
+def geocoding_result(name, cities):
+    # cities: name -> (state, latitude, longitude, timezone)
+    state, latitude, longitude, timezone = cities[name]
+    return {"results": [{
+        "name": name, "latitude": latitude, "longitude": longitude, "timezone": timezone,
+        "country_code": "US", "admin1": state, "population": 1000,
+    }]}
+
+
+class StubServer:
+    # Local Open-Meteo: /v1/search (geocoding), /v1/archive and
+    # /v1/air-quality. Every request sleeps `latency` seconds; the first
+    # `failures` archive/air-quality requests get a 503, and requests with a
+    # latitude above BAD_LATITUDE a 400 with an API error body. requests
+    # logs (host header, path, arrival time, status) of each request.
+    def __init__(self, cities, latency=0.05, failures=0):
+        self.cities = cities
+        self.latency = latency
+        self.failures = failures
+        self.requests = []
+        self._lock = threading.Lock()
+        self.server = ThreadingHTTPServer(("127.0.0.1", 0), self._handler())
+        self.port = self.server.server_address[1]
+        self.thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+
+    def url(self, host, path):
+        return f"http://{host}:{self.port}{path}"
+
+    def __enter__(self):
+        self.thread.start()
+        return self
+
+    def __exit__(self, *exc):
+        self.server.shutdown()
+        self.server.server_close()
+
+    def respond(self, path, params):
+        if path == "/v1/search":
+            return 200, "application/json", json.dumps(geocoding_result(params["name"][0], self.cities)).encode()
+        if any(float(latitude) > BAD_LATITUDE for latitude in params["latitude"]):
+            return 400, "application/json", json.dumps({"error": True, "reason": "Latitude must be in range of -90 to 90°."}).encode()
+        with self._lock:
+            fail = self.failures > 0
+            self.failures -= fail
+        if fail:
+            return 503, "text/plain", b"unavailable"
+        return 200, "application/octet-stream", encode_response(params)
+
+    def _handler(self):
+        stub = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                arrived = time.monotonic()
+                parsed = urlparse(self.path)
+                time.sleep(stub.latency)
+                status, content_type, body = stub.respond(parsed.path, parse_qs(parsed.query))
+                with stub._lock:
+                    stub.requests.append((self.headers["Host"].split(":")[0], parsed.path, arrived, status))
+                self.send_response(status)
+                self.send_header("Content-Type", content_type)
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, *args):
+                pass
+
+        return Handler
@@ -0,0 +1,64 @@
+import numpy as np
+import pandas as pd
+
+from aggregation import WEATHER_AQI_COLS, aggregate_iso
+from benchmarks.comparisons import aggregate_weighted_lambda, carbon_intensity_row
+from benchmarks.generators import make_fuel_mix_frame, make_merged_frame
+from carbon_intensity import ISONE_FUEL_COLS, carbon_intensity
+
+# The vectorized aggregate_iso and carbon_intensity against the loops they
+# replaced (kept in benchmarks.comparisons), without timing anything
+
+
+def aggregate_reference(df, group_col="datetime_utc"):
+    # Per-group loop with the documented edge cases: rows with a NaN value
+    # or weight drop out of that column's average, all-zero weights give
+    # NaN, and NaN loads are skipped by the sum
+    df = df[df["regional_percentage"].notnull()]
+    rows = {}
+    for key, group in df.groupby(group_col):
+        row = {}
+        for col in WEATHER_AQI_COLS:
+            valid = group[col].notna()
+            weights = group.loc[valid, "regional_percentage"]
+            row[col] = np.average(group.loc[valid, col], weights=weights) if weights.sum() != 0 else np.nan
+        row["load"] = group["load"].sum()
+        row["load_forecast"] = group["load_forecast"].sum()
+        row["regional_percentage"] = group["regional_percentage"].sum()
+        rows[key] = row
+    return pd.DataFrame.from_dict(rows, orient="index").rename_axis(group_col).reset_index()
+
+
+def test_aggregate_iso_matches_lambda_aggregation():
+    df = make_merged_frame(n_zones=5, n_hours=48)
+    actual = aggregate_iso(df)
+    expected = aggregate_weighted_lambda(df).join(df.groupby("datetime_utc")[["load", "load_forecast", "regional_percentage"]].sum())
+    pd.testing.assert_frame_equal(actual, expected.reset_index(), check_exact=False, rtol=1e-9)
+
+
+def test_aggregate_iso_zero_weights_and_nan_loads():
+    df = make_merged_frame(n_zones=4, n_hours=24)
+    hours = df["datetime_utc"].unique()
+    # One hour with all weights zero, one with a NaN weight, NaN loads and
+    # NaN weather values scattered over others
+    df.loc[df["datetime_utc"] == hours[0], "regional_percentage"] = 0.0
+    df.loc[(df["datetime_utc"] == hours[1]) & (df["zone"] == "zone_0"), "regional_percentage"] = np.nan
+    df.loc[df.index[::7], "load"] = np.nan
+    df.loc[df.index[::5], "temperature_2m__celsius"] = np.nan
+    df.loc[df["datetime_utc"] == hours[2], "pm2_5__micrograms_per_cubic_metre"] = np.nan
+
+    actual = aggregate_iso(df)
+    expected = aggregate_reference(df)
+    pd.testing.assert_frame_equal(actual, expected[actual.columns], check_exact=False, rtol=1e-9)
+    assert actual.loc[0, WEATHER_AQI_COLS].isna().all()
+    assert np.isnan(actual.loc[2, "pm2_5__micrograms_per_cubic_metre"])
+
+
+def test_carbon_intensity_matches_row_loop():
+    # One fuel missing from the frame, zero-MW hours and a NaN reading
+    df = make_fuel_mix_frame(ISONE_FUEL_COLS[:-1], n_hours=2000)
+    df.loc[5, "coal"] = np.nan
+    actual = carbon_intensity(df, ISONE_FUEL_COLS)
+    expected = df.apply(carbon_intensity_row, axis=1, fuel_cols=ISONE_FUEL_COLS)
+    pd.testing.assert_series_equal(actual, expected, check_exact=False, rtol=1e-9)
+    assert actual[df[ISONE_FUEL_COLS[:-1]].sum(axis=1) == 0].isna().all()
@@ -0,0 +1,93 @@
+import os
+
+import numpy as np
+import pandas as pd
+import pytest
+
+import helper
+import http_utils
+import storage
+from openmeteo_stub import BAD_LATITUDE, StubServer
+
+# get_city_zone_info against a local Open-Meteo stub with per-request
+# latency: geocoding answers on "localhost" and the archives on
+# "127.0.0.1", so the two hosts are rate limited separately
+
+CITY_DATA = [
+    {"city": "Portland", "state": "Maine", "zone": ".Z.MAINE"},
+    {"city": "Boston", "state": "Massachusetts", "zone": ".Z.NEMASSBOST"},
+    {"city": "Buffalo", "state": "New York", "zone": "west"},
+    {"city": "Albany", "state": "New York", "zone": "capitl"},
+    {"city": "Utica", "state": "New York", "zone": "mhk_vl"},
+    {"city": "Fresno", "state": "California", "zone": None},
+    {"city": "Redding", "state": "California", "zone": None},
+]
+# Utica geocodes to a coordinate the archives reject
+CITIES = {
+    "Portland": ("Maine", 43.66, -70.26, "America/New_York"),
+    "Boston": ("Massachusetts", 42.36, -71.06, "America/New_York"),
+    "Buffalo": ("New York", 42.89, -78.88, "America/New_York"),
+    "Albany": ("New York", 42.65, -73.76, "America/New_York"),
+    "Utica": ("New York", BAD_LATITUDE + 5, -75.23, "America/New_York"),
+    "Fresno": ("California", 36.74, -119.79, "America/Los_Angeles"),
+    "Redding": ("California", 40.59, -122.39, "America/Los_Angeles"),
+}
+MIN_INTERVAL = 0.2
+ARRIVAL_JITTER = 0.05
+
+
+@pytest.fixture
+def stub(monkeypatch):
+    with StubServer(CITIES, latency=0.05, failures=2) as server:
+        monkeypatch.setattr(helper, "CITY_DATA", CITY_DATA)
+        monkeypatch.setattr(helper, "GEOCODING_URL", server.url("localhost", "/v1/search"))
+        monkeypatch.setattr(helper, "WEATHER_URL", server.url("127.0.0.1", "/v1/archive"))
+        monkeypatch.setattr(helper, "AQI_URL", server.url("127.0.0.1", "/v1/air-quality"))
+        monkeypatch.setattr(http_utils, "rate_limiter", http_utils.HostRateLimiter(MIN_INTERVAL))
+        monkeypatch.setattr(http_utils, "RETRY_BACKOFF", 0.05)
+        yield server
+
+
+def run_fetch(monkeypatch, root, **kwargs):
+    monkeypatch.setattr(storage, "DATA_DIR", str(root))
+    helper.get_city_zone_info(**kwargs)
+    return pd.read_csv(root / "city_zone_info.csv")
+
+
+def relative(paths, root):
+    return [os.path.relpath(p, root) if isinstance(p, str) else p for p in paths]
+
+
+def test_concurrent_fetch_matches_serial(data_dir, stub, monkeypatch):
+    concurrent = run_fetch(monkeypatch, data_dir / "concurrent", max_workers=4, batch_size=3)
+    log = list(stub.requests)
+    stub.failures = 2
+    serial = run_fetch(monkeypatch, data_dir / "serial", max_workers=1, batch_size=1)
+
+    # At most one request per MIN_INTERVAL per host. Requests are spaced
+    # when sent; ARRIVAL_JITTER allows for connection setup delaying one
+    # request's arrival at the server more than the next one's.
+    for host in ["localhost", "127.0.0.1"]:
+        arrivals = np.sort([arrived for h, _, arrived, _ in log if h == host])
+        assert len(arrivals) > 1
+        assert np.diff(arrivals).min() >= MIN_INTERVAL - ARRIVAL_JITTER
+
+    # The 503s were retried, and the batch holding Utica was rejected and
+    # fell back to one request per city
+    statuses = [status for _, path, _, status in log if path != "/v1/search"]
+    assert statuses.count(503) == 2
+    assert 400 in statuses and statuses[-1] == 200
+    utica = concurrent.set_index("city").loc["Utica"]
+    assert pd.isna(utica["weather_filename"]) and pd.isna(utica["aqi_filename"])
+    assert concurrent.drop(index=4)["weather_filename"].notna().all()
+
+    # Same city_zone_info.csv and weather/AQI tables as the serial run
+    for col in ["weather_filename", "aqi_filename"]:
+        concurrent[col] = relative(concurrent[col], data_dir / "concurrent")
+        serial[col] = relative(serial[col], data_dir / "serial")
+    pd.testing.assert_frame_equal(concurrent, serial)
+    for path in serial["weather_filename"].dropna().tolist() + serial["aqi_filename"].dropna().tolist():
+        pd.testing.assert_frame_equal(
+            storage.read_table(str(data_dir / "concurrent" / path)),
+            storage.read_table(str(data_dir / "serial" / path)),
+        )
@@ -0,0 +1,72 @@
+import time
+
+import openmeteo_requests
+import pandas as pd
+import pytest
+
+import helper
+import http_utils
+import storage
+from openmeteo_stub import FakeClient
+
+# Multi-location Open-Meteo requests against a fake client replaying
+# wire-format responses: batching must not change any city's output
+
+LOCATIONS = [
+    {"city": "Boston", "state": "Massachusetts", "latitude": 42.36, "longitude": -71.06, "timezone": "America/New_York"},
+    {"city": "Buffalo", "state": "New York", "latitude": 42.89, "longitude": -78.88, "timezone": "America/New_York"},
+    {"city": "Fresno", "state": "California", "latitude": 36.74, "longitude": -119.79, "timezone": "America/Los_Angeles"},
+    {"city": "Redding", "state": "California", "latitude": 40.59, "longitude": -122.39, "timezone": "America/Los_Angeles"},
+    {"city": "Portland", "state": "Maine", "latitude": 43.66, "longitude": -70.26, "timezone": "America/New_York"},
+]
+
+
+@pytest.fixture
+def fake_client(monkeypatch):
+    client = FakeClient()
+    monkeypatch.setattr(openmeteo_requests, "Client", client)
+    monkeypatch.setattr(http_utils, "RETRY_BACKOFF", 0.0)
+    return client
+
+
+def fetch(monkeypatch, root, locations, batch_size):
+    monkeypatch.setattr(storage, "DATA_DIR", str(root))
+    return helper.get_historical_hourly_data_batch(locations, batch_size=batch_size, max_workers=2)
+
+
+def test_batched_output_matches_per_city(data_dir, fake_client, monkeypatch):
+    batched = fetch(monkeypatch, data_dir / "batched", LOCATIONS, batch_size=3)
+    batch_calls = len(fake_client.calls)
+    single = fetch(monkeypatch, data_dir / "single", LOCATIONS, batch_size=1)
+
+    # weather and AQI: two batches of 3 + 2 cities each, then one per city
+    assert batch_calls == 4
+    assert len(fake_client.calls) - batch_calls == 2 * len(LOCATIONS)
+    for location, (df_weather, df_aqi, _, _), (df_weather_single, df_aqi_single, _, _) in zip(LOCATIONS, batched, single):
+        pd.testing.assert_frame_equal(df_weather, df_weather_single)
+        pd.testing.assert_frame_equal(df_aqi, df_aqi_single)
+        assert str(df_weather["datetime"].dt.tz) == location["timezone"]
+
+
+def test_rejected_batch_falls_back_without_retrying(data_dir, fake_client, monkeypatch):
+    bad = dict(LOCATIONS[1], latitude=95.0)
+    locations = [LOCATIONS[0], bad, LOCATIONS[2]]
+    monkeypatch.setattr(http_utils, "RETRY_BACKOFF", 10.0)
+    start = time.perf_counter()
+    results = fetch(monkeypatch, data_dir, locations, batch_size=3)
+    assert time.perf_counter() - start < 5
+
+    # Per kind: the batch once, then each city once; no retries
+    assert len(fake_client.calls) == 2 * (1 + len(locations))
+    assert isinstance(results[1], Exception)
+    assert not isinstance(results[0], Exception) and not isinstance(results[2], Exception)
+    expected = fetch(monkeypatch, data_dir / "single", [LOCATIONS[0]], batch_size=1)[0]
+    pd.testing.assert_frame_equal(results[0][0], expected[0])
+
+
+def test_server_errors_are_retried(data_dir, fake_client, monkeypatch):
+    fake_client.failures = 2
+    results = fetch(monkeypatch, data_dir, LOCATIONS[:2], batch_size=2)
+    # Two failed attempts, then one batch per kind
+    assert len(fake_client.calls) == 4
+    assert not any(isinstance(result, Exception) for result in results)
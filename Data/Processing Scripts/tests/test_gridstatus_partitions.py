@@ -0,0 +1,79 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+import get_gridstatus_data
+import storage
+
+ENTRY = {"dataset": "nyiso_load", "params": {"timezone": "GMT"}, "filename": "nyiso_load.csv"}
+
+
+class FakeClient:
+    # Stands in for GridStatusClient.get_dataset: hourly rows for the
+    # window. new_col appears from March 2021 on; sparse_col is empty in
+    # January. fail_on lists window starts that raise once. calls logs
+    # the windows requested.
+    def __init__(self, fail_on=()):
+        self.fail_on = set(fail_on)
+        self.calls = []
+
+    def get_dataset(self, dataset, start, end, timezone):
+        self.calls.append(start)
+        if start in self.fail_on:
+            self.fail_on.discard(start)
+            raise ConnectionError(f"window {start} failed")
+        utc = pd.date_range(start, end, freq="h", tz="UTC", inclusive="left")
+        df = pd.DataFrame({"interval_start_utc": utc, "load": np.arange(len(utc), dtype="int64")})
+        df["sparse_col"] = None if start < "2021-02-01" else np.arange(len(utc)) * 0.5
+        if start >= "2021-03-01":
+            df["new_col"] = 1.0
+        return df
+
+
+@pytest.fixture
+def gridstatus(data_dir, monkeypatch):
+    output_dir = str(data_dir / "GridStatusIO")
+    monkeypatch.setattr(get_gridstatus_data, "output_dir", output_dir)
+    monkeypatch.setattr(get_gridstatus_data, "partitions_dir", str(data_dir / "GridStatusIO" / "partitions"))
+    monkeypatch.setattr(get_gridstatus_data, "start_date", "2021-01-01")
+    monkeypatch.setattr(get_gridstatus_data, "end_date", "2021-04-15")
+    return get_gridstatus_data
+
+
+def expected_table():
+    frames = [FakeClient().get_dataset("nyiso_load", s, e, "GMT") for s, e, _ in get_gridstatus_data.get_windows("2021-01-01", "2021-04-15")]
+    return pd.concat(frames, ignore_index=True)
+
+
+def test_combined_table_keeps_columns_added_later(gridstatus):
+    gridstatus.update_dataset(ENTRY, FakeClient())
+    df = storage.read_table(gridstatus.dataset_table(ENTRY))
+    expected = expected_table()
+    assert list(df.columns) == ["interval_start_utc", "load", "sparse_col", "new_col"]
+    assert df["new_col"].notna().sum() == (expected["interval_start_utc"] >= "2021-03-01").sum()
+    np.testing.assert_allclose(df["sparse_col"].astype("float64"), expected["sparse_col"].astype("float64"))
+    pd.testing.assert_series_equal(df["load"], expected["load"])
+
+
+def test_resume_after_failure(gridstatus):
+    client = FakeClient(fail_on={"2021-03-01"})
+    with pytest.raises(ConnectionError):
+        gridstatus.update_dataset(ENTRY, client)
+    assert client.calls == ["2021-01-01", "2021-02-01", "2021-03-01"]
+
+    # Finished windows are not fetched again; the open April window is
+    # refetched on every run
+    gridstatus.update_dataset(ENTRY, client)
+    assert client.calls[3:] == ["2021-03-01", "2021-04-01"]
+    gridstatus.update_dataset(ENTRY, client)
+    assert client.calls[5:] == ["2021-04-01"]
+
+    df = storage.read_table(gridstatus.dataset_table(ENTRY))
+    assert len(df) == len(expected_table())
+    assert df["interval_start_utc"].is_monotonic_increasing
+
+
+def test_stream_without_schema_rejects_new_columns(data_dir):
+    frames = [pd.DataFrame({"a": [1.0]}), pd.DataFrame({"a": [2.0], "b": [3.0]})]
+    with pytest.raises(ValueError, match="b"):
+        storage.write_table_stream(iter(frames), str(data_dir / "drift"))
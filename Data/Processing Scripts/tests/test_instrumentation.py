@@ -0,0 +1,24 @@
+import time
+
+import numpy as np
+import pytest
+
+from instrumentation import collect, current_rss_mb, span
+
+
+@pytest.mark.skipif(current_rss_mb() is None, reason="RSS sampling needs /proc")
+def test_peak_rss_is_per_span():
+    with collect() as spans:
+        with span("outer"):
+            with span("big"):
+                data = np.ones(50_000_000)
+                time.sleep(0.1)
+                del data
+            with span("small"):
+                time.sleep(0.1)
+    outer = spans[0]
+    big, small = outer.children
+    # 400 MB live in "big" only; the process high-water mark stays
+    assert big.peak_rss_mb - small.peak_rss_mb > 300
+    assert outer.peak_rss_mb == big.peak_rss_mb
+    assert small.process_max_rss_mb - small.peak_rss_mb > 300
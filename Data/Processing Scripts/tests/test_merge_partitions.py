@@ -0,0 +1,58 @@
+import os
+
+import pandas as pd
+import pytest
+
+import iso_adapters
+import merge_data
+import pipeline
+import storage
+from benchmarks.generators import write_data_tree
+from data_quality import quality_path
+
+ISO_NAME = "nyiso"
+
+
+@pytest.fixture
+def tree(data_dir, monkeypatch):
+    # Stage modules build these paths at import time
+    monkeypatch.setattr(iso_adapters, "gridstatusio_dir", str(data_dir / "GridStatusIO"))
+    monkeypatch.setattr(merge_data, "openmeteo_dir", str(data_dir / "OpenMeteo"))
+    return write_data_tree(str(data_dir), n_cities=3)
+
+
+def read_merge(adapter):
+    df_quality = storage.read_table(quality_path(ISO_NAME, "merge"))
+    df_quality = df_quality.sort_values(["level", "key", "metric"]).reset_index(drop=True)
+    return storage.read_table(adapter.merged_table), df_quality
+
+
+def test_partitions_match_merge_iso(tree):
+    adapter = iso_adapters.ISO_ADAPTERS[ISO_NAME]
+    merge_data.merge_iso(ISO_NAME)
+    expected, expected_quality = read_merge(adapter)
+
+    merge_data.merge_iso_partitions(ISO_NAME)
+    merged, quality = read_merge(adapter)
+    pd.testing.assert_frame_equal(merged, expected)
+    pd.testing.assert_frame_equal(quality, expected_quality)
+
+    # A city that lost its weather data drops out of the ISO table
+    cities = adapter.select_cities(merge_data.load_city_zone_info())
+    city, state = cities.iloc[0][["city", "state"]]
+    storage.remove_table(os.path.join(merge_data.openmeteo_dir, f"{city}_{state}_hourly_weather"))
+    merge_data.merge_city_partition(ISO_NAME, city, state)
+    assert not storage.table_exists(merge_data.city_partition_path(ISO_NAME, city, state))
+    merge_data.merge_iso_partitions(ISO_NAME)
+    merged, _ = read_merge(adapter)
+    assert city not in set(merged["city"].astype(str))
+    assert len(merged) == len(expected) * 2 // 3
+
+
+def test_unselected_dependency_is_an_error(tree):
+    stages = [stage for stage in pipeline.build_stages() if stage.name == f"merge:{ISO_NAME}"]
+    with pytest.raises(ValueError, match="not selected"):
+        pipeline.run_pipeline(stages)
+    assert [stage.name for stage in pipeline.select_stages(pipeline.build_stages(), [f"merge_city:{ISO_NAME}"])][-3:] == [
+        f"merge_city:{ISO_NAME}:{city}_New York" for city in ["Nyiso City 0", "Nyiso City 1", "Nyiso City 2"]
+    ]
@@ -0,0 +1,63 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+import iso_adapters
+import marginal_emissions
+from aggregation import build_iso_level
+from benchmarks.generators import make_fuel_mix_frame, make_merged_frame, write_data_tree
+from carbon_intensity import ISONE_FUEL_COLS, NYISO_FUEL_COLS
+from grid_index import GridIndex
+from time_index import HOUR_COL, epoch_hours
+
+# GridStatus reports nyiso_load and the ISONE/NYISO fuel mixes every 5
+# minutes. Every hour key must stand for the on-the-hour reading, as the
+# exact datetime joins did before the hour key.
+
+N_HOURS = 48
+
+
+def on_the_hour(df):
+    return df[df["interval_start_utc"].dt.minute == 0].reset_index(drop=True)
+
+
+def test_build_iso_level_keeps_one_fuel_mix_row_per_hour():
+    df_merged = make_merged_frame(n_zones=3, n_hours=N_HOURS)
+    df_fuel = make_fuel_mix_frame(ISONE_FUEL_COLS, N_HOURS, minutes=5)
+    assert len(df_fuel) == N_HOURS * 12
+
+    df_agg = build_iso_level(df_merged, df_fuel, ISONE_FUEL_COLS)
+    expected = build_iso_level(df_merged, on_the_hour(df_fuel), ISONE_FUEL_COLS)
+    assert len(df_agg) == N_HOURS
+    pd.testing.assert_frame_equal(df_agg, expected)
+
+
+@pytest.fixture
+def tree(data_dir, monkeypatch):
+    monkeypatch.setattr(iso_adapters, "gridstatusio_dir", str(data_dir / "GridStatusIO"))
+    return write_data_tree(str(data_dir), n_cities=1)
+
+
+def test_nyiso_grid_uses_on_the_hour_load(tree):
+    adapter = iso_adapters.ISO_ADAPTERS["nyiso"]
+    df_raw = iso_adapters.read_table(f"{iso_adapters.gridstatusio_dir}/nyiso_load")
+    assert (df_raw["interval_start_utc"].dt.minute != 0).any()
+
+    df_grid = adapter.load_grid()
+    assert not df_grid.duplicated(["zone", HOUR_COL]).any()
+
+    df_hourly = on_the_hour(df_raw)
+    index = GridIndex.from_frame(df_grid)
+    row = index.zones.index("west")
+    cols = epoch_hours(df_hourly["interval_start_utc"]) - index.start_hour
+    np.testing.assert_allclose(index.values["load"][row, cols], df_hourly["west"])
+
+
+def test_fuel_mix_arrays_use_on_the_hour_rows(tree):
+    adapter = iso_adapters.ISO_ADAPTERS["nyiso"]
+    df_raw = iso_adapters.read_table(f"{iso_adapters.gridstatusio_dir}/nyiso_fuel_mix")
+    df_hourly = on_the_hour(df_raw)
+
+    fuel_mix = marginal_emissions.FuelMix.from_frame(adapter.load_fuel_mix(), NYISO_FUEL_COLS)
+    assert fuel_mix.present.sum() == len(df_hourly)
+    np.testing.assert_allclose(fuel_mix.mw[fuel_mix.present], df_hourly[NYISO_FUEL_COLS].to_numpy())
@@ -0,0 +1,131 @@
+import numpy as np
+import pandas as pd
+
+# Canonical time key: whole hours since 1970-01-01 00:00 UTC as int64. It
+# is assigned once when a table is read (see add_hour_key) and every join
+# between weather, AQI, grid and fuel-mix data is done on it instead of on
+# parsed datetimes.
+HOUR_COL = "utc_hour"
+
+# Layouts to_csv writes for the tz-aware columns the pipeline stores:
+# Open-Meteo local datetime (mixed -05:00/-04:00 offsets across DST) and
+# GridStatus interval_start_utc / merged datetime_utc (+00:00). Both are
+# tried in order before falling back to pandas' mixed-format parser.
+TIME_FORMATS = ["%Y-%m-%d %H:%M:%S%z", "%Y-%m-%dT%H:%M:%S%z"]
+
+# "YYYY-MM-DD HH:MM:SS+HH:MM" is 25 characters; one spare byte catches
+# longer strings (fractional seconds etc.) that must take the slow path
+_FIXED_WIDTH = 25
+_DIGIT_POS = [0, 1, 2, 3, 5, 6, 8, 9, 11, 12, 14, 15, 17, 18, 20, 21, 23, 24]
+_SEPARATORS = {4: b"-", 7: b"-", 13: b":", 16: b":", 22: b":"}
+
+
+def _field(chars, start, stop):
+    # Integer value of the digits in chars[:, start:stop]
+    out = np.zeros(len(chars), dtype="int64")
+    for pos in range(start, stop):
+        out = out * 10 + chars[:, pos]
+    return out
+
+
+def _days_from_civil(year, month, day):
+    # Days since 1970-01-01 for proleptic Gregorian dates (H. Hinnant's
+    # days_from_civil), vectorized
+    year = year - (month <= 2)
+    era = year // 400
+    yoe = year - era * 400
+    doy = (153 * (month + np.where(month > 2, -3, 9)) + 2) // 5 + day - 1
+    doe = yoe * 365 + yoe // 4 - yoe // 100 + doy
+    return era * 146097 + doe - 719468
+
+
+def parse_fixed_width(values):
+    # Seconds since the epoch (UTC) for strings laid out exactly as
+    # "YYYY-MM-DD HH:MM:SS+HH:MM" (or with a "T" separator), decoded as
+    # byte columns in NumPy. Returns None if any value has another layout
+    # or is missing, so the caller can fall back to pandas.
+    try:
+        raw = np.asarray(values, dtype=f"S{_FIXED_WIDTH + 1}")
+    except (TypeError, ValueError, UnicodeEncodeError):
+        return None
+    if raw.size == 0:
+        return np.empty(0, dtype="int64")
+    chars = raw.view(np.uint8).reshape(len(raw), _FIXED_WIDTH + 1)
+    digits = chars[:, _DIGIT_POS]
+    layout_ok = (
+        (digits >= ord("0")).all() and (digits <= ord("9")).all()
+        and (chars[:, _FIXED_WIDTH] == 0).all()
+        and np.isin(chars[:, 10], [ord(" "), ord("T")]).all()
+        and np.isin(chars[:, 19], [ord("+"), ord("-")]).all()
+        and all((chars[:, pos] == ord(sep)).all() for pos, sep in _SEPARATORS.items())
+    )
+    if not layout_ok:
+        return None
+
+    chars = chars.astype("int64") - ord("0")
+    days = _days_from_civil(_field(chars, 0, 4), _field(chars, 5, 7), _field(chars, 8, 10))
+    sign = np.where(chars[:, 19] == ord("-") - ord("0"), -1, 1)
+    offset_min = sign * (_field(chars, 20, 22) * 60 + _field(chars, 23, 25))
+    minutes = (days * 24 + _field(chars, 11, 13)) * 60 + _field(chars, 14, 16) - offset_min
+    return minutes * 60 + _field(chars, 17, 19)
+
+
+def parse_utc(values):
+    # tz-aware UTC datetimes from strings written by to_csv or from
+    # datetimes (naive ones are taken as UTC). Keeps a Series' index.
+    series = values if isinstance(values, pd.Series) else pd.Series(values)
+    if isinstance(series.dtype, pd.DatetimeTZDtype):
+        result = series.dt.tz_convert("UTC")
+    elif pd.api.types.is_datetime64_dtype(series):
+        result = series.dt.tz_localize("UTC")
+    else:
+        seconds = parse_fixed_width(series.to_numpy(dtype=object))
+        if seconds is not None:
+            result = pd.Series(pd.to_datetime(seconds, unit="s", utc=True), index=series.index)
+        else:
+            result = _parse_formats(series)
+    result = result.rename(series.name)
+    return result if isinstance(values, pd.Series) else pd.DatetimeIndex(result)
+
+
+def _parse_formats(series):
+    for fmt in TIME_FORMATS:
+        try:
+            return pd.to_datetime(series, format=fmt, utc=True)
+        except ValueError:
+            continue
+    return pd.to_datetime(series, format="mixed", utc=True)
+
+
+def epoch_hours(values):
+    # Canonical int64 hour key for datetimes or datetime strings; times
+    # within an hour map to the hour they fall in
+    if not pd.api.types.is_datetime64_any_dtype(values):
+        seconds = parse_fixed_width(pd.Series(values).to_numpy(dtype=object))
+        if seconds is not None:
+            return seconds // 3600
+    utc = pd.DatetimeIndex(parse_utc(values)).tz_convert(None)
+    return utc.to_numpy().astype("datetime64[h]").astype("int64")
+
+
+def hours_to_datetime(hours):
+    # Inverse of epoch_hours: tz-aware UTC datetimes for hour keys
+    return pd.to_datetime(np.asarray(hours, dtype="int64") * 3600, unit="s", utc=True)
+
+
+def add_hour_key(df, col):
+    # df with HOUR_COL assigned from the datetime column col, unless it
+    # already carries it
+    if HOUR_COL in df.columns:
+        return df
+    return df.assign(**{HOUR_COL: epoch_hours(df[col])})
+
+
+def hour_starts(df, col):
+    # Rows of df whose datetime column col falls exactly on an hour start.
+    # Sub-hourly GridStatus tables (5-minute NYISO load, the ISONE/NYISO
+    # fuel mixes) are reduced to their on-the-hour readings before being
+    # keyed, so each hour key is one reading rather than the last of ~12.
+    times = pd.DatetimeIndex(parse_utc(df[col]))
+    on_hour = times == times.floor("h")
+    return df if on_hour.all() else df[on_hour]